@@ -0,0 +1,228 @@
+#! /usr/bin/env python
+
+# Benchmarks for the SisPy library, using the emulated power strip.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure what every public API call costs: USB transfers, bytes moved, wall time and memory allocations.
+
+   Usage: PYTHONPATH=src python benchmarks/run_benchmarks.py [--quick] [--latency SECONDS] [--output FILE] [--compare FILE]
+
+   --output saves the results as JSON, --compare prints the change against earlier saved results.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from SisPy import codec
+from SisPy.emulator import EmulatedDevice
+from SisPy.lib import OutletSchedule
+from SisPy.lib import SisPy
+from SisPy.pool import SisPyPool
+
+# 2016-01-05 17:10:00 UTC
+EPOCH = 1452013800
+
+SCHEDULE_SIZES = (1, 2, 4, 8, 16)
+FLEET_SIZES = (1, 10, 100, 1000)
+QUICK_FLEET_SIZES = (1, 10)
+
+
+def _devices_of(target):
+    if isinstance(target, SisPyPool):
+        return [sispy._dev for sispy in target.strips.values()]
+    if isinstance(target, SisPy):
+        return [target._dev]
+    return []
+
+
+def measure(name, func, repeat, params=None, target=None):
+    """Run func repeat times and return the cost per call.
+
+       target is the SisPy or SisPyPool whose emulated devices count the transfers.
+    """
+    devices = _devices_of(target)
+    transfers = sum(dev.nr_transfers for dev in devices)
+    nr_bytes = sum(dev.nr_bytes for dev in devices)
+    start = time.perf_counter()
+    for i in range(repeat):
+        func()
+    seconds = time.perf_counter() - start
+    transfers = sum(dev.nr_transfers for dev in devices) - transfers
+    nr_bytes = sum(dev.nr_bytes for dev in devices) - nr_bytes
+
+    # measure the allocations on a separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'lineno') if stat.count_diff > 0)
+
+    return {
+        'name': name,
+        'params': params or {},
+        'calls': repeat,
+        'transfers_per_call': transfers / float(repeat),
+        'bytes_per_call': nr_bytes / float(repeat),
+        'seconds_per_call': seconds / repeat,
+        'peak_bytes_per_call': peak,
+        'retained_blocks_per_call': blocks,
+    }
+
+
+def _schedule(sispy, nr_entries):
+    """An outlet schedule with nr_entries entries, as read from the power strip."""
+    schedule = sispy.outlets[0].schedule
+    schedule._get_current_time = lambda: time.gmtime(EPOCH)
+    schedule.reset()
+    schedule.add_entry()
+    schedule._epoch_activated = EPOCH
+    schedule.entries[0].start_time = time.gmtime(EPOCH + 60)
+    for i in range(nr_entries):
+        if i > 0:
+            schedule.add_entry()
+        schedule.entries[i].switch_on = (i % 2 == 0)
+        schedule.entries[i].minutes_to_next_schedule_entry = 10 + i
+    schedule.apply()
+    sispy.outlets[0]._schedule = None
+    schedule = sispy.outlets[0].schedule
+    schedule._get_current_time = lambda: time.gmtime(EPOCH)
+    return schedule
+
+
+def bench_strip(latency, repeat):
+    results = []
+    sispy = SisPy(EmulatedDevice(epoch=EPOCH, latency=latency))
+    outlet = sispy.outlets[0]
+    params = {'latency': latency}
+
+    results.append(measure('SisPy()', lambda: SisPy(EmulatedDevice(epoch=EPOCH, latency=latency)), repeat, params))
+    results.append(measure('SisPy.id', lambda: sispy.id, repeat, params, sispy))
+    results.append(measure('Outlet.switched_on (read)', lambda: outlet.switched_on, repeat, params, sispy))
+    results.append(measure('Outlet.switched_on (write)', lambda: setattr(outlet, 'switched_on', True), repeat, params, sispy))
+    results.append(measure('Outlet.current_schedule_entry', lambda: outlet.current_schedule_entry, repeat, params, sispy))
+    results.append(measure('SisPy.snapshot()', sispy.snapshot, repeat, params, sispy))
+
+    def read_schedule():
+        outlet._schedule = None
+        return outlet.schedule
+    results.append(measure('Outlet.schedule', read_schedule, repeat, params, sispy))
+    return results
+
+
+def bench_schedule(latency, repeat):
+    results = []
+    for nr_entries in SCHEDULE_SIZES:
+        sispy = SisPy(EmulatedDevice(epoch=EPOCH, latency=latency))
+        schedule = _schedule(sispy, nr_entries)
+        last = schedule.entries[-1]
+        params = {'latency': latency, 'entries': nr_entries}
+
+        results.append(measure('OutletSchedule.apply()', lambda: schedule.apply(force=True), repeat, params, sispy))
+        results.append(measure('OutletSchedule.apply() (unchanged)', schedule.apply, repeat, params, sispy))
+        results.append(measure('OutletSchedule.__str__', lambda: str(schedule), repeat, params, sispy))
+        results.append(measure('OutletSchedule(data)', lambda: OutletSchedule(schedule._data, sispy), repeat, params, sispy))
+        results.append(measure('codec.decode_schedule()', lambda: codec.decode_schedule(schedule._data), repeat, params, sispy))
+        results.append(measure('OutletScheduleEntry.start_time (last entry)', lambda: last.start_time, repeat, params, sispy))
+        results.append(measure('OutletScheduleEntry.end_time (last entry)', lambda: last.end_time, repeat, params, sispy))
+        results.append(measure('OutletScheduleEntry.minutes_to_next_schedule_entry (set)',
+                               lambda: setattr(schedule.entries[0], 'minutes_to_next_schedule_entry', 10), repeat, params, sispy))
+        results.append(measure('OutletScheduleEntry.start_time (set, last entry)',
+                               lambda: setattr(last, 'start_time', last.start_time), repeat, params, sispy))
+        results.append(measure('OutletScheduleEntry.end_time (set, last entry)',
+                               lambda: setattr(last, 'end_time', last.end_time), repeat, params, sispy))
+    return results
+
+
+def bench_fleet(latency, fleet_sizes):
+    results = []
+    for size in fleet_sizes:
+        params = {'latency': latency, 'strips': size}
+        devices = [EmulatedDevice(dev_id=i, epoch=EPOCH, latency=latency) for i in range(size)]
+        start = time.perf_counter()
+        pool = SisPyPool(devices)
+        results.append({
+            'name': 'SisPyPool()',
+            'params': params,
+            'calls': 1,
+            'transfers_per_call': float(sum(dev.nr_transfers for dev in devices)),
+            'bytes_per_call': float(sum(dev.nr_bytes for dev in devices)),
+            'seconds_per_call': time.perf_counter() - start,
+        })
+        results.append(measure('SisPyPool.map(snapshot)', lambda: pool.map(lambda sispy: sispy.snapshot()), 3, params, pool))
+        results.append(measure('SisPyPool.map(switched_on)', lambda: pool.map(lambda outlet: outlet.switched_on, [(i, 0) for i in pool.ids]), 3, params, pool))
+        template = _schedule(pool[pool.ids[0]], 4)
+        schedules = dict(((i, nr), template) for i in pool.ids for nr in range(4))
+        results.append(measure('SisPyPool.apply_schedules()', lambda: pool.apply_schedules(schedules, force=True, activation_time=time.gmtime(EPOCH)),
+                               3, params, pool))
+        pool.close()
+    return results
+
+
+def compare(results, old_results):
+    old = dict(((r['name'], json.dumps(r['params'], sort_keys=True)), r) for r in old_results['results'])
+    for r in results['results']:
+        o = old.get((r['name'], json.dumps(r['params'], sort_keys=True)))
+        if o is None:
+            continue
+        ratio = r['seconds_per_call'] / o['seconds_per_call'] if o['seconds_per_call'] > 0 else float('inf')
+        transfers = r['transfers_per_call'] - o['transfers_per_call']
+        print("%-60s %-35s time x%.2f, transfers %+.1f" % (r['name'], json.dumps(r['params'], sort_keys=True), ratio, transfers))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the SisPy library on emulated power strips.")
+    parser.add_argument('--quick', action='store_true', help="fewer repetitions and smaller fleets")
+    parser.add_argument('--latency', type=float, default=0.0, help="emulated time per USB transfer, in seconds")
+    parser.add_argument('--output', help="save the results as JSON to this file")
+    parser.add_argument('--compare', help="compare with the results saved in this file")
+    args = parser.parse_args(argv)
+
+    repeat = 20 if args.quick else 200
+    fleet_sizes = QUICK_FLEET_SIZES if args.quick else FLEET_SIZES
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime()),
+            'latency': args.latency,
+        },
+        'results': bench_strip(args.latency, repeat) + bench_schedule(args.latency, repeat) + bench_fleet(args.latency, fleet_sizes),
+    }
+
+    for r in results['results']:
+        print("%-60s %-35s %8.1f transfers %8.1f bytes %10.1f us" % (
+            r['name'], json.dumps(r['params'], sort_keys=True), r['transfers_per_call'], r['bytes_per_call'], r['seconds_per_call'] * 1e6))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
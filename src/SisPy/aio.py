@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+"""asyncio interface to the Energenie power strips.
+
+   The USB transfers themselves are blocking. Each power strip gets a single worker thread to execute them,
+   so coroutines working on the same power strip are served one after the other while different power strips
+   progress in parallel.
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from SisPy.lib import SisPy
+from SisPy.watch import Watcher
+
+
+class AsyncSisPy(object):
+    """Represent the power supply for use with asyncio.
+
+       Wraps a SisPy object. Use the open() coroutine to also create the SisPy object without blocking the event loop.
+    """
+    def __init__(self, sispy, executor=None):
+        self._sispy = sispy
+        self._own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1)
+        self._executor = executor
+        self._outlets = [AsyncOutlet(outlet, self) for outlet in sispy.outlets]
+
+    @classmethod
+    async def open(cls, dev=None):
+        """Create the SisPy object for the given USB device (by default the first one found) on the worker thread.
+
+           Returns an AsyncSisPy object.
+        """
+        executor = ThreadPoolExecutor(max_workers=1)
+        sispy = await asyncio.get_running_loop().run_in_executor(executor, SisPy, dev)
+        result = cls(sispy, executor)
+        result._own_executor = True
+        return result
+
+    async def _run(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    @property
+    def sispy(self):
+        """The wrapped SisPy object. Don't use it from the event loop, as every access can block.
+        """
+        return self._sispy
+
+    @property
+    def nr_outlets(self):
+        """The number of programmable outlets.
+
+           An integer.
+        """
+        return self._sispy.nr_outlets
+
+    @property
+    def outlets(self):
+        """List of AsyncOutlet objects, one for each programmable outlet.
+        """
+        return self._outlets
+
+    async def get_id(self):
+        """The internal identifier of the power strip.
+
+           A (large) integer.
+        """
+        return await self._run(lambda: self._sispy.id)
+
+    async def snapshot(self):
+        """The complete state of the power strip, see SisPy.snapshot().
+
+           A SisPySnapshot object.
+        """
+        return await self._run(self._sispy.snapshot)
+
+    async def watch(self, min_interval=1.0, max_interval=60.0):
+        """Asynchronous iterator over the changes of the outlets, as SisPy.watch.OutletEvent objects.
+
+           The power strip is polled like SisPy.watch() does. Polling stops when the iteration stops.
+        """
+        watcher = Watcher(self._sispy, min_interval, max_interval)
+        while True:
+            for event in await self._run(watcher.poll):
+                yield event
+            await asyncio.sleep(watcher.next_interval)
+
+    async def close(self):
+        """Stop the worker thread, if it was created by this object, after it finished the outstanding work.
+           The event loop keeps running while waiting for that.
+        """
+        if self._own_executor is True:
+            await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown, True)
+
+
+class AsyncOutlet(object):
+    """Represent the state of a single outlet for use with asyncio. See Outlet.
+    """
+    def __init__(self, outlet, async_sispy):
+        self._outlet = outlet
+        self._async_sispy = async_sispy
+
+    @property
+    def outlet(self):
+        """The wrapped Outlet object. Don't use it from the event loop, as every access can block.
+        """
+        return self._outlet
+
+    async def get_switched_on(self):
+        """Indicate whether the outlet is switched on. True if the outlet is switched on. False otherwise.
+        """
+        return await self._async_sispy._run(lambda: self._outlet.switched_on)
+
+    async def set_switched_on(self, value):
+        """Set the outlet on (True) or off (False).
+        """
+        if not isinstance(value, bool):
+            raise TypeError("Can't assign a " + value.__class__.__name__ + " to a boolean property.")
+        await self._async_sispy._run(setattr, self._outlet, 'switched_on', value)
+
+    async def get_schedule(self):
+        """The OutletSchedule object with the hardware schedule of the outlet.
+
+           Manipulating the schedule itself doesn't access the power strip, use apply_schedule() to store it.
+        """
+        return await self._async_sispy._run(lambda: self._outlet.schedule)
+
+    async def apply_schedule(self, schedule=None, force=False):
+        """Store the schedule (by default the one returned by get_schedule()) on this outlet. See OutletSchedule.apply().
+           The schedule can be one of another outlet, e.g. a template: it's stored on this outlet, not on its own.
+           A template that is running already is stored with the same phase, see SisPy.pool.SisPyPool.apply_schedules().
+
+           Returns True if the schedule was written, False otherwise.
+        """
+        if schedule is None:
+            schedule = await self.get_schedule()
+        return await self._async_sispy._run(self._outlet._apply_schedule, schedule, force)
+
+    async def get_current_schedule_entry(self):
+        """The OutletCurrentScheduleEntry object with the schedule entry that's being executed.
+        """
+        return await self._async_sispy._run(lambda: self._outlet.current_schedule_entry)
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+"""Encoding and decoding of the feature reports of the Energenie power strips.
+
+   Every report layout is a precompiled struct.Struct. Decoding is a single unpack_from() on the buffer as it was
+   received (a bytearray, array or memoryview, with an optional offset), so nothing is copied.
+   Encoding is a single pack_into(), in a new buffer or in a preallocated one that is reused.
+
+   Report numbers: 1 is the id, 2 the buzzer. For outlet n (from 0 onwards), 3 + 3n is the status,
+   4 + 3n the schedule and 5 + 3n the current schedule entry.
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+NR_SCHEDULE_ENTRIES = 16
+
+# id of the power strip
+ID = struct.Struct('<L')
+# bit 2: buzzer enabled
+BUZZER = struct.Struct('<B')
+# bit 0: switched on, bit 1: voltage present
+STATUS = struct.Struct('<B')
+# time activated, the raw entries, rampup minutes
+SCHEDULE = struct.Struct('<L%dHH' % NR_SCHEDULE_ENTRIES)
+# entry number and flags, raw entry
+CURRENT_SCHEDULE_ENTRY = struct.Struct('<BH')
+
+# length of the data of the reports, indexed by the report nr of the first outlet (0 is not a report)
+REPORT_LENGTHS = (0, ID.size, BUZZER.size, STATUS.size, SCHEDULE.size, CURRENT_SCHEDULE_ENTRY.size)
+
+# raw schedule entry values
+ENTRY_SWITCH_ON = 0x8000
+# "delay without switching": the entry only waits
+ENTRY_DELAY = 0x4000
+ENTRY_MINUTES = 0x3FFF
+# ends a non-periodic schedule
+ENTRY_END = 0x0
+# a slot without entry
+ENTRY_UNUSED = 0x3FFF
+
+
+def report_nr(command, outlet_nr=None):
+    """The report nr for the given report of the first outlet (1 to 5) and outlet nr (None for the id and buzzer)."""
+    if outlet_nr is None:
+        return command
+    return command + outlet_nr * 3
+
+
+def report_length(report_nr):
+    """The length of the data of the given report, without the report nr."""
+    if report_nr < 3:
+        return REPORT_LENGTHS[report_nr]
+    return REPORT_LENGTHS[3 + (report_nr - 3) % 3]
+
+
+def decode_id(data, offset=0):
+    return ID.unpack_from(data, offset)[0]
+
+
+def decode_status(data, offset=0):
+    """Returns (switched on, voltage present)."""
+    value = data[offset]
+    return (value & 0x01 == 0x01, value & 0x02 == 0x02)
+
+
+def decode_schedule(data, offset=0):
+    """Returns (time activated, tuple with the 16 raw entries, rampup minutes)."""
+    values = SCHEDULE.unpack_from(data, offset)
+    return (values[0], values[1:NR_SCHEDULE_ENTRIES + 1], values[NR_SCHEDULE_ENTRIES + 1])
+
+
+def decode_current_schedule_entry(data, offset=0):
+    """Returns (entry number and flags, raw entry)."""
+    return CURRENT_SCHEDULE_ENTRY.unpack_from(data, offset)
+
+
+def schedule_entries(entries, periodic):
+    """The 16 raw entries to store for the given list of raw entries.
+
+       A non-periodic schedule is ended with ENTRY_END, so it can have at most 15 entries.
+    """
+    nr_entries = len(entries)
+    if periodic is False:
+        nr_entries += 1
+    if nr_entries > NR_SCHEDULE_ENTRIES:
+        kind = "periodic" if periodic else "non-periodic"
+        raise ValueError("A " + kind + " schedule can't have more than " + str(NR_SCHEDULE_ENTRIES - (nr_entries - len(entries))) + " entries")
+    values = list(entries)
+    if periodic is False:
+        values.append(ENTRY_END)
+    values.extend([ENTRY_UNUSED] * (NR_SCHEDULE_ENTRIES - len(values)))
+    return values
+
+
+def encode_schedule(epoch_activated, entries, rampup_minutes, buffer=None, offset=0):
+    """Pack a schedule report. entries are the 16 raw entries, see schedule_entries().
+
+       Without a buffer, a new bytearray is returned. Otherwise the report is packed in the buffer at the given offset
+       and the buffer is returned.
+    """
+    if buffer is None:
+        buffer = bytearray(SCHEDULE.size)
+    SCHEDULE.pack_into(buffer, offset, epoch_activated, *entries, rampup_minutes)
+    return buffer
+
+
+def encode_status(switched_on, buffer=None, offset=0):
+    if buffer is None:
+        buffer = bytearray(STATUS.size)
+    STATUS.pack_into(buffer, offset, 0x01 if switched_on else 0x00)
+    return buffer
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -0,0 +1,288 @@
+#! /usr/bin/env python
+"""Compile on/off intervals or a weekly calendar into the hardware schedule of an outlet.
+
+   The hardware keeps at most 16 entries of at most 0x3FFF minutes (about 11 days), after a rampup of at most
+   0xFFFF minutes. The compiler keeps the number of entries down:
+   - overlapping and adjacent intervals are merged, and switch points that don't change the state are dropped
+   - the wait until the first switch goes in the rampup
+   - a periodic calendar is rotated so its cycle starts at the first switch after the activation
+   - a wait longer than an entry can hold is continued with "delay without switching" entries
+   What doesn't fit is reported in CompiledSchedule.overflow, instead of raising an exception.
+
+   All times are on the UTC minute grid: the activation time is rounded down to a whole minute, interval bounds
+   are rounded to the nearest minute.
+
+   E.g.
+   compiled = compile_weekly([(0, 8, 0, True), (0, 18, 0, False), (4, 8, 0, True), (4, 12, 0, False)], time.time())
+   compiled.apply(sispy.outlets[0])
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+
+from SisPy import codec
+from SisPy.lib import OutletSchedule
+
+MINUTES_PER_WEEK = 7 * 24 * 60
+MAX_RAMPUP_MINUTES = 0xFFFF
+# 1970-01-05 00:00 UTC, a Monday
+_FIRST_MONDAY = 4 * 24 * 60 * 60
+
+# an entry switching off can't wait 0x3FFF minutes, that's an unused slot
+_MAX_SWITCH_MINUTES = {True: codec.ENTRY_MINUTES, False: codec.ENTRY_MINUTES - 1}
+
+
+def _nr_entries(state, minutes):
+    """The number of entries needed to switch to state and wait minutes."""
+    extra = minutes - _MAX_SWITCH_MINUTES[state]
+    if extra <= 0:
+        return 1
+    return 1 + (extra + codec.ENTRY_MINUTES - 1) // codec.ENTRY_MINUTES
+
+
+def _entries(state, minutes):
+    """The raw entries switching to state and waiting minutes: a switching entry, chained with delay entries."""
+    switch = codec.ENTRY_SWITCH_ON if state else 0
+    chunk = min(minutes, _MAX_SWITCH_MINUTES[state])
+    entries = [switch | chunk]
+    minutes -= chunk
+    while minutes > 0:
+        chunk = min(minutes, codec.ENTRY_MINUTES)
+        entries.append(codec.ENTRY_DELAY | switch | chunk)
+        minutes -= chunk
+    return entries
+
+
+def _delay_entries(minutes):
+    entries = []
+    while minutes > 0:
+        chunk = min(minutes, codec.ENTRY_MINUTES)
+        entries.append(codec.ENTRY_DELAY | chunk)
+        minutes -= chunk
+    return entries
+
+
+class CompiledSchedule(object):
+    """A hardware schedule made by compile_intervals(), compile_periodic() or compile_weekly(). Nothing can be set.
+    """
+    __slots__ = ('_epoch_activated', '_rampup_minutes', '_entries', '_periodic', '_state_at_activation', '_overflow', '_nr_entries_needed')
+
+    def __init__(self, epoch_activated, rampup_minutes, entries, periodic, state_at_activation, overflow, nr_entries_needed):
+        self._epoch_activated = epoch_activated
+        self._rampup_minutes = rampup_minutes
+        self._entries = tuple(entries)
+        self._periodic = periodic
+        self._state_at_activation = state_at_activation
+        self._overflow = tuple(overflow)
+        self._nr_entries_needed = nr_entries_needed
+
+    @property
+    def epoch_activated(self):
+        """The activation time the schedule was compiled for, in seconds since the epoch (a whole minute).
+        """
+        return self._epoch_activated
+
+    @property
+    def rampup_minutes(self):
+        """Minutes between the activation and the first entry.
+        """
+        return self._rampup_minutes
+
+    @property
+    def entries(self):
+        """Tuple with the raw entries, see SisPy.codec.
+        """
+        return self._entries
+
+    @property
+    def periodic(self):
+        """Whether the entries repeat.
+        """
+        return self._periodic
+
+    @property
+    def state_at_activation(self):
+        """Whether the outlet should be on at the activation. The schedule only switches at the end of the rampup,
+           so switch the outlet yourself if needed.
+        """
+        return self._state_at_activation
+
+    @property
+    def overflow(self):
+        """Tuple with the (start epoch, end epoch, state) periods that didn't fit, empty if everything fits.
+
+           A non-periodic schedule is cut off before the first of them: it follows the intervals until then and
+           switches off. A periodic schedule that doesn't fit has no entries, the periods are the ones of the
+           first cycle beyond the last entry.
+        """
+        return self._overflow
+
+    @property
+    def fits(self):
+        """True if the complete calendar fits in the schedule.
+        """
+        return len(self._overflow) == 0
+
+    @property
+    def nr_entries_needed(self):
+        """The number of entries the complete calendar needs.
+        """
+        return self._nr_entries_needed
+
+    def data(self):
+        """The schedule report, as stored on the power strip.
+        """
+        if self._periodic and not self.fits:
+            raise ValueError("The calendar needs " + str(self._nr_entries_needed) + " entries, a periodic schedule has " + str(codec.NR_SCHEDULE_ENTRIES))
+        values = codec.schedule_entries(self._entries, self._periodic)
+        return codec.encode_schedule(self._epoch_activated, values, self._rampup_minutes)
+
+    def to_schedule(self, sispy=None, outlet_nr=0):
+        """An OutletSchedule with this schedule, e.g. for SisPy.pool.SisPyPool.apply_schedules().
+        """
+        return OutletSchedule(self.data(), sispy, outlet_nr)
+
+    def apply(self, outlet, force=False):
+        """Store the schedule on the given Outlet, activated at epoch_activated.
+
+           Unless forced, nothing is written if the outlet has an equivalent schedule.
+           Returns True if the schedule was written.
+        """
+        data = self.data()
+        return outlet._store_schedule(OutletSchedule(data, None, outlet._nr), data, force)
+
+    def __repr__(self):
+        return "CompiledSchedule(" + str(len(self._entries)) + " entries, rampup " + str(self._rampup_minutes) + " minutes, " + \
+               ("periodic" if self._periodic else "non-periodic") + ", " + str(len(self._overflow)) + " overflowing)"
+
+
+def compile_intervals(intervals, activation_epoch):
+    """Compile a list of (start epoch, end epoch) intervals in which the outlet should be on, into a non-periodic
+       schedule. Outside the intervals, the outlet is off. The parts before the activation are ignored.
+
+       Returns a CompiledSchedule. When the intervals need more than 15 entries, the last intervals are left out,
+       see CompiledSchedule.overflow.
+    """
+    activation_minute = int(activation_epoch) // 60
+    spans = []
+    for start, end in sorted((int(round(s / 60.0)), int(round(e / 60.0))) for s, e in intervals):
+        start = max(start, activation_minute)
+        if end <= start:
+            continue
+        if len(spans) > 0 and start <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], end)
+        else:
+            spans.append([start, end])
+
+    epoch_activated = activation_minute * 60
+    if len(spans) == 0:
+        return CompiledSchedule(epoch_activated, 0, [], False, False, [], 0)
+
+    lead = spans[0][0] - activation_minute
+    rampup = min(lead, MAX_RAMPUP_MINUTES)
+    entries = _delay_entries(lead - rampup)
+    # one entry is needed for the end of a non-periodic schedule, one for the final switch off
+    limit = codec.NR_SCHEDULE_ENTRIES - 2
+    nr_needed = len(entries)
+    nr_programmed = 0
+    previous_end = None
+    for i, (start, end) in enumerate(spans):
+        new_entries = [] if previous_end is None else _entries(False, start - previous_end)
+        new_entries.extend(_entries(True, end - start))
+        nr_needed += len(new_entries)
+        # once an interval doesn't fit, the later ones can't be programmed either
+        if nr_programmed == i and len(entries) + len(new_entries) <= limit:
+            entries.extend(new_entries)
+            nr_programmed += 1
+        previous_end = end
+    nr_needed += 1
+
+    overflow = [(s * 60, e * 60, True) for s, e in spans[nr_programmed:]]
+    if nr_programmed == 0:
+        return CompiledSchedule(epoch_activated, 0, [], False, lead == 0, overflow, nr_needed)
+    # switch off at the end of the last interval, then the schedule is done
+    entries.append(1)
+    return CompiledSchedule(epoch_activated, rampup, entries, False, lead == 0, overflow, nr_needed)
+
+
+def compile_periodic(switch_points, period_minutes, activation_epoch, origin_epoch=0):
+    """Compile a list of (minute in the period, state) switch points into a periodic schedule. The periods start
+       at origin_epoch and every period_minutes after that.
+
+       Returns a CompiledSchedule. When the switch points need more than 16 entries, it has no entries, see
+       CompiledSchedule.overflow.
+    """
+    if period_minutes < 1:
+        raise ValueError("Need a period of at least 1 minute")
+    points = {}
+    for minute, state in switch_points:
+        if not 0 <= minute < period_minutes:
+            raise ValueError("Switch point at minute " + str(minute) + " is outside of the period")
+        points[minute] = bool(state)
+    if len(points) == 0:
+        raise ValueError("Need at least one switch point")
+    minutes = sorted(points)
+    # drop the switch points that don't change the state, also around the end of the period
+    kept = [m for i, m in enumerate(minutes) if points[m] != points[minutes[i - 1]]]
+    if len(kept) == 0:
+        kept = minutes[:1]
+    states = [points[m] for m in kept]
+
+    activation_minute = int(activation_epoch) // 60
+    epoch_activated = activation_minute * 60
+    phase = (activation_minute - int(origin_epoch) // 60) % period_minutes
+    # the cycle starts at the first switch point at or after the activation
+    first = bisect.bisect_left(kept, phase) % len(kept)
+    rampup = (kept[first] - phase) % period_minutes
+    if rampup > MAX_RAMPUP_MINUTES:
+        raise ValueError("The first switch point is more than " + str(MAX_RAMPUP_MINUTES) + " minutes after the activation")
+
+    entries = []
+    overflow = []
+    nr_needed = 0
+    offset = rampup
+    for i in range(len(kept)):
+        index = (first + i) % len(kept)
+        length = (kept[(index + 1) % len(kept)] - kept[index]) % period_minutes or period_minutes
+        nr_needed += _nr_entries(states[index], length)
+        if nr_needed > codec.NR_SCHEDULE_ENTRIES:
+            overflow.append((epoch_activated + offset * 60, epoch_activated + (offset + length) * 60, states[index]))
+        else:
+            entries.extend(_entries(states[index], length))
+        offset += length
+    if len(overflow) > 0:
+        entries = []
+    # without rampup, the first entry switches at the activation
+    state_at_activation = states[first] if rampup == 0 else states[first - 1]
+    return CompiledSchedule(epoch_activated, rampup, entries, True, state_at_activation, overflow, nr_needed)
+
+
+def compile_weekly(switch_points, activation_epoch):
+    """Compile a weekly calendar into a periodic schedule. switch_points is a list of
+       (weekday, hour, minute, state) tuples in UTC, weekday 0 being Monday, as in time.struct_time.
+
+       Returns a CompiledSchedule, see compile_periodic().
+    """
+    minutes = []
+    for weekday, hour, minute, state in switch_points:
+        if not (0 <= weekday < 7 and 0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError("Invalid switch point " + str((weekday, hour, minute)))
+        minutes.append((weekday * 24 * 60 + hour * 60 + minute, state))
+    return compile_periodic(minutes, MINUTES_PER_WEEK, activation_epoch, _FIRST_MONDAY)
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
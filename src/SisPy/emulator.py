@@ -0,0 +1,223 @@
+#! /usr/bin/env python
+"""Software emulation of an Energenie EG-PMS2 power strip.
+
+   EmulatedDevice implements the ctrl_transfer() call SisPy uses on a pyusb device, for reports 1 to 14.
+   It keeps the outlet states and schedules, executes the schedules on a virtual clock and reports the
+   current schedule entries like the power strip does. Use it to test or benchmark without a power strip attached:
+
+       sispy = SisPy(EmulatedDevice())
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+from SisPy import codec
+
+_NR_OUTLETS = 4
+
+
+class _EmulatedOutlet(object):
+    def __init__(self):
+        self.switched_on = False
+        self.voltage_present = True
+        self.set_schedule(bytearray(codec.SCHEDULE.size))
+
+    def set_schedule(self, data):
+        self.schedule_data = bytearray(data)
+        epoch_activated, values, self.rampup_minutes = codec.decode_schedule(data)
+        self.entries = []
+        self.periodic = True
+        for value in values:
+            if value == codec.ENTRY_END:
+                self.periodic = False
+                break
+            if value != codec.ENTRY_UNUSED:
+                self.entries.append(value)
+        if len(self.entries) == 0:
+            self.periodic = False
+        # seconds the schedule has been running, only increased while the power strip has power
+        self.elapsed = 0
+        self.entries_started = 0
+        self.timing_error = False
+
+    def _position(self):
+        """Returns (entries started in total, index of the current entry or None in rampup, seconds left in the current entry or rampup)."""
+        rampup = self.rampup_minutes * 60
+        if self.elapsed < rampup or len(self.entries) == 0:
+            return (0, None, max(rampup - self.elapsed, 0))
+        t = self.elapsed - rampup
+        durations = [(value & 0x3FFF) * 60 for value in self.entries]
+        total = sum(durations)
+        cycles = 0
+        if self.periodic is True and total > 0:
+            cycles = int(t // total)
+            t -= cycles * total
+        started = 0
+        for i, duration in enumerate(durations):
+            started += 1
+            if t < duration:
+                return (cycles * len(durations) + started, i, duration - t)
+            t -= duration
+        # a non-periodic schedule that finished
+        return (len(durations), len(durations) - 1, 0)
+
+    def advance(self, seconds, powered):
+        if powered is False:
+            if len(self.entries) > 0:
+                self.timing_error = True
+            return
+        self.elapsed += seconds
+        started, index, left = self._position()
+        if started > self.entries_started:
+            # perform the last switching entry that started since the previous update
+            n = len(self.entries)
+            for nr in range(started - 1, max(self.entries_started, started - n) - 1, -1):
+                value = self.entries[nr % n]
+                if value & 0x4000 == 0:
+                    self.switched_on = (value & 0x8000 == 0x8000)
+                    break
+            self.entries_started = started
+
+    def current_schedule_entry_data(self):
+        started, index, left = self._position()
+        minutes_left = int((left + 59) // 60)
+        if index is None and len(self.entries) > 0:
+            flags = 0x10
+            value = minutes_left & 0xFFFF
+        elif index is None:
+            flags = 0
+            value = 0
+        else:
+            if minutes_left == 0:
+                flags = len(self.entries)
+            else:
+                flags = (index + 1) % len(self.entries) if self.periodic else index + 1
+            value = (self.entries[index] & 0xC000) | (minutes_left & 0x3FFF)
+        if self.timing_error is True:
+            flags |= 0x80
+        return bytearray(codec.CURRENT_SCHEDULE_ENTRY.pack(flags, value))
+
+    def status_data(self):
+        value = 0
+        if self.switched_on is True:
+            value |= 0x01
+            if self.voltage_present is True:
+                value |= 0x02
+        return bytearray([value])
+
+
+class EmulatedDevice(object):
+    """Emulate the USB device of an EG-PMS2 power strip.
+
+       The schedules run on a virtual clock, starting at the given epoch (default: now). Use advance() to let time pass.
+       latency is the time in seconds every transfer takes.
+
+       nr_transfers and nr_bytes count the transfers and the number of bytes moved over the emulated bus.
+    """
+    def __init__(self, dev_id=0x04030201, epoch=None, latency=0):
+        self._lock = threading.Lock()
+        self._id = dev_id
+        self._now = time.time() if epoch is None else epoch
+        self.latency = latency
+        self.buzzer_enabled = True
+        self.outlets = [_EmulatedOutlet() for i in range(_NR_OUTLETS)]
+        self.nr_transfers = 0
+        self.nr_bytes = 0
+
+    @property
+    def now(self):
+        """The time of the virtual clock, in seconds since the epoch.
+        """
+        return self._now
+
+    def advance(self, seconds):
+        """Let the given number of seconds pass on the virtual clock and execute the schedules.
+        """
+        with self._lock:
+            self._now += seconds
+            for outlet in self.outlets:
+                outlet.advance(seconds, True)
+
+    def power_failure(self, seconds):
+        """Emulate a power failure of the given number of seconds.
+           Running schedules are paused and get their timing error flag set.
+        """
+        with self._lock:
+            self._now += seconds
+            for outlet in self.outlets:
+                outlet.advance(seconds, False)
+
+    def _read(self, report_nr):
+        if report_nr == 1:
+            return bytearray(codec.ID.pack(self._id))
+        if report_nr == 2:
+            return bytearray([0x04 if self.buzzer_enabled else 0x00])
+        outlet = self.outlets[int((report_nr - 3) / 3)]
+        report_type = (report_nr - 3) % 3
+        if report_type == 0:
+            return outlet.status_data()
+        if report_type == 1:
+            return bytearray(outlet.schedule_data)
+        return outlet.current_schedule_entry_data()
+
+    def _write(self, report_nr, data):
+        if report_nr == 1:
+            self._id = codec.decode_id(data)
+        elif report_nr == 2:
+            self.buzzer_enabled = (data[0] & 0x04 == 0x04)
+        else:
+            outlet = self.outlets[int((report_nr - 3) / 3)]
+            report_type = (report_nr - 3) % 3
+            if report_type == 0:
+                outlet.switched_on = (data[0] & 0x01 == 0x01)
+            elif report_type == 1:
+                outlet.set_schedule(data)
+            else:
+                raise IOError("Report " + str(report_nr) + " can't be set")
+
+    def _report_length(self, report_nr):
+        if report_nr < 1 or report_nr > 2 + _NR_OUTLETS * 3:
+            raise IOError("Unknown report " + str(report_nr))
+        return codec.report_length(report_nr)
+
+    def ctrl_transfer(self, request_type, request, value=0, index=0, data_or_length=None, timeout=None):
+        """Execute a HID get (request type 0xa1, request 0x01) or set (request type 0x21, request 0x09) feature report.
+        """
+        if self.latency > 0:
+            time.sleep(self.latency)
+        report_nr = value & 0xFF
+        if value >> 8 != 0x03:
+            raise IOError("Only feature reports are supported")
+        length = self._report_length(report_nr)
+        with self._lock:
+            self.nr_transfers += 1
+            if request_type == 0xa1 and request == 0x01:
+                if data_or_length != length + 1:
+                    raise IOError("Report " + str(report_nr) + " has " + str(length) + " bytes, not " + str(data_or_length - 1))
+                self.nr_bytes += length + 1
+                return bytearray([report_nr]) + self._read(report_nr)
+            if request_type == 0x21 and request == 0x09:
+                if len(data_or_length) != length + 1 or data_or_length[0] != report_nr:
+                    raise IOError("Invalid data for report " + str(report_nr))
+                self.nr_bytes += len(data_or_length)
+                self._write(report_nr, bytearray(data_or_length[1:]))
+                return len(data_or_length)
+        raise IOError("Unsupported request")
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
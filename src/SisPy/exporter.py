@@ -0,0 +1,235 @@
+#! /usr/bin/env python
+"""Prometheus exporter for the Energenie power strips.
+
+   A background thread reads a snapshot of every power strip at a fixed interval and renders the metrics.
+   Scrapes are answered with the last rendered metrics, so they never cause USB transfers and take the same time
+   whatever the number of power strips.
+
+   Start the exporter with: python -m SisPy.exporter [--address ADDRESS] [--port PORT] [--interval SECONDS]
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import http.server
+import sys
+import threading
+import time
+
+DEFAULT_PORT = 9750
+DEFAULT_INTERVAL = 15.0
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# name, help text, function giving the value for an OutletSnapshot (None to leave it out)
+_OUTLET_METRICS = (
+    ('sispy_outlet_switched_on', 'Whether the outlet is switched on.',
+     lambda outlet: int(outlet.switched_on)),
+    ('sispy_outlet_voltage_present', 'Whether there is voltage on the outlet.',
+     lambda outlet: int(outlet.voltage_present)),
+    ('sispy_outlet_schedule_rampup', 'Whether the schedule of the outlet is waiting for its first entry.',
+     lambda outlet: int(outlet.current_schedule_entry.sequence_rampup)),
+    ('sispy_outlet_schedule_next_entry', 'Number of the next schedule entry of the outlet.',
+     lambda outlet: outlet.current_schedule_entry.current_schedule_nr),
+    ('sispy_outlet_schedule_minutes_to_next_entry', 'Minutes until the next schedule entry of the outlet starts.',
+     lambda outlet: outlet.current_schedule_entry.minutes_to_next_schedule_entry),
+    ('sispy_outlet_schedule_done', 'Whether the schedule of the outlet finished.',
+     lambda outlet: int(outlet.current_schedule_entry.sequence_done)),
+    ('sispy_outlet_timing_error', 'Whether the power strip lost track of the time of the schedule of the outlet.',
+     lambda outlet: int(outlet.current_schedule_entry.timing_error)),
+)
+
+
+class SisPyExporter(object):
+    """Keep the Prometheus metrics of all power strips of a SisPyPool up to date.
+
+       refresh() reads a snapshot of all power strips (in parallel) and renders the metrics, start() does this
+       every interval seconds in a background thread. metrics() returns the last rendered metrics.
+       serve() answers HTTP scrapes on /metrics.
+    """
+    def __init__(self, pool, interval=DEFAULT_INTERVAL):
+        self._pool = pool
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self._refreshes = 0
+        self._errors = dict((strip_id, 0) for strip_id in pool.ids)
+        self._refresh_seconds_last = 0.0
+        self._refresh_seconds_sum = 0.0
+        self._metrics = self._render().encode('utf-8')
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+        self._server_thread = None
+
+    def refresh(self):
+        """Read a snapshot of all power strips and render the metrics.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            futures = [(strip_id, self._pool.submit(strip_id, lambda sispy: sispy.snapshot())) for strip_id in self._pool.ids]
+            snapshots = {}
+            for strip_id, future in futures:
+                try:
+                    snapshots[strip_id] = future.result()
+                except Exception:
+                    self._errors[strip_id] = self._errors.get(strip_id, 0) + 1
+            seconds = time.perf_counter() - start
+            self._snapshots = snapshots
+            self._refreshes += 1
+            self._refresh_seconds_last = seconds
+            self._refresh_seconds_sum += seconds
+            metrics = self._render().encode('utf-8')
+            # a scrape gets either the old or the new metrics
+            self._metrics = metrics
+
+    def metrics(self):
+        """The last rendered metrics, in the Prometheus text exposition format (bytes).
+        """
+        return self._metrics
+
+    def _render(self):
+        lines = []
+        ids = self._pool.ids
+
+        lines.append('# HELP sispy_strip_up Whether the last snapshot of the power strip succeeded.')
+        lines.append('# TYPE sispy_strip_up gauge')
+        for strip_id in ids:
+            lines.append('sispy_strip_up{strip="%d"} %d' % (strip_id, int(strip_id in self._snapshots)))
+        lines.append('# HELP sispy_strip_snapshot_timestamp_seconds When the last snapshot of the power strip was taken.')
+        lines.append('# TYPE sispy_strip_snapshot_timestamp_seconds gauge')
+        for strip_id in ids:
+            if strip_id in self._snapshots:
+                lines.append('sispy_strip_snapshot_timestamp_seconds{strip="%d"} %r' % (strip_id, self._snapshots[strip_id]._epoch_taken))
+        lines.append('# HELP sispy_strip_buzzer_enabled Whether the buzzer of the power strip is enabled.')
+        lines.append('# TYPE sispy_strip_buzzer_enabled gauge')
+        for strip_id in ids:
+            if strip_id in self._snapshots:
+                lines.append('sispy_strip_buzzer_enabled{strip="%d"} %d' % (strip_id, int(self._snapshots[strip_id].buzzer_enabled)))
+
+        for name, help_text, value in _OUTLET_METRICS:
+            lines.append('# HELP ' + name + ' ' + help_text)
+            lines.append('# TYPE ' + name + ' gauge')
+            for strip_id in ids:
+                if strip_id not in self._snapshots:
+                    continue
+                for outlet in self._snapshots[strip_id].outlets:
+                    v = value(outlet)
+                    if v is not None:
+                        lines.append('%s{strip="%d",outlet="%d"} %d' % (name, strip_id, outlet.nr, v))
+
+        lines.append('# HELP sispy_exporter_refreshes_total Refreshes of the snapshots of all power strips.')
+        lines.append('# TYPE sispy_exporter_refreshes_total counter')
+        lines.append('sispy_exporter_refreshes_total %d' % self._refreshes)
+        lines.append('# HELP sispy_exporter_refresh_errors_total Snapshots of a power strip that failed.')
+        lines.append('# TYPE sispy_exporter_refresh_errors_total counter')
+        for strip_id in ids:
+            lines.append('sispy_exporter_refresh_errors_total{strip="%d"} %d' % (strip_id, self._errors.get(strip_id, 0)))
+        lines.append('# HELP sispy_exporter_last_refresh_seconds Duration of the last refresh.')
+        lines.append('# TYPE sispy_exporter_last_refresh_seconds gauge')
+        lines.append('sispy_exporter_last_refresh_seconds %r' % self._refresh_seconds_last)
+        lines.append('# HELP sispy_exporter_refresh_seconds Duration of the refreshes.')
+        lines.append('# TYPE sispy_exporter_refresh_seconds summary')
+        lines.append('sispy_exporter_refresh_seconds_sum %r' % self._refresh_seconds_sum)
+        lines.append('sispy_exporter_refresh_seconds_count %d' % self._refreshes)
+        return '\n'.join(lines) + '\n'
+
+    def start(self):
+        """Refresh the metrics every interval seconds in a background thread, starting now.
+        """
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            self.refresh()
+            self._stop.wait(max(self._interval - (time.monotonic() - start), 0))
+
+    def serve(self, address='', port=DEFAULT_PORT):
+        """Answer HTTP scrapes on /metrics in a background thread.
+
+           Returns the (address, port) the server listens on, useful with port 0.
+        """
+        self._server = http.server.ThreadingHTTPServer((address, port), _MetricsHandler)
+        self._server.daemon_threads = True
+        self._server.exporter = self
+        self._server_thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.1})
+        self._server_thread.daemon = True
+        self._server_thread.start()
+        return self._server.server_address[:2]
+
+    def close(self):
+        """Stop refreshing and serving.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server_thread.join()
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.exporter.metrics()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # don't log every scrape
+        pass
+
+
+def main(argv=None):  # pragma: no cover
+    from SisPy.pool import SisPyPool
+
+    parser = argparse.ArgumentParser(description="Export the state of the Energenie power strips to Prometheus.")
+    parser.add_argument('--address', default='', help="address to listen on (default: all)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="port to listen on (default: %(default)s)")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help="seconds between snapshots (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    with SisPyPool() as pool:
+        if len(pool) == 0:
+            print("No Energenie products found")
+            return 1
+        exporter = SisPyExporter(pool, args.interval)
+        exporter.start()
+        address, port = exporter.serve(args.address, args.port)
+        print("Exporting power strips " + ", ".join(str(i) for i in pool.ids) + " on port " + str(port))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        exporter.close()
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -20,10 +20,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import struct
+# Only import what's really needed: this module is used by short-lived scripts, where the import time matters.
+# The usb module (and libusb) is only loaded when a power strip is looked for, array when a schedule is. The lock
+# and the thread ids come from _thread: threading (and array) import collections, which takes longer than the rest.
+import _thread
+import bisect
+import sys
 import time
-import calendar
-import usb
+
+from SisPy import codec
 
 
 def _min2human(minutes):
@@ -40,62 +45,352 @@ def _min2human(minutes):
     return string
 
 
+def _timegm(t):
+    """Same as calendar.timegm(), without the import time of the calendar module."""
+    year, month, day, hour, minute, second = t[:6]
+    # number of days since 1970-01-01 in the proleptic Gregorian calendar, with years starting in March
+    y = year - 1 if month <= 2 else year
+    era = y // 400
+    year_of_era = y - era * 400
+    day_of_year = (153 * (month - 3 if month > 2 else month + 9) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    days = era * 146097 + day_of_era - 719468
+    return ((days * 24 + hour) * 60 + minute) * 60 + second
+
+
+# False until looked for, then the numpy module or None when it isn't installed
+_numpy = False
+
+
+def _import_numpy():
+    """The numpy module, None if it isn't installed. Like usb, only imported when needed."""
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+
+def _find_devices():  # pragma: no cover
+    """List all the Energenie USB devices connected to the computer."""
+    import usb.core
+    return list(usb.core.find(find_all=True, idVendor=0x04b4))
+
+
 class SisPy(object):
     """Represent the power supply.
 
-       Currently, on the first USB power supply is detected.
+       Without a device given, the first USB power supply detected is used.
+       Use SisPy.pool.SisPyPool to work with all connected power supplies.
+
+       With lazy=True, looking for the device, reading its id and creating the outlets is postponed until they are needed.
     """
     _ID = 1
+    _BUZZER = 2
     _OUTLET_STATUS = 3
     _OUTLET_SCHEDULE = 4
     _OUTLET_CURRENT_SCHEDULE_ENTRY = 5
 
-    def __init__(self):
-        self._dev = self._get_device()
-        self._id = self._usb_read(SisPy._ID)
-        self._outlets = []
-        for i in range(4):
-            self._outlets.append(Outlet(i, self))
+    # (report nr, length) of all the reports needed for a snapshot: the buzzer, followed by the status
+    # and current schedule entry of each outlet
+    _SNAPSHOT_REPORTS = ((0x02, 1 + 1),) + tuple(r for i in range(4) for r in ((0x03 + i * 3, 1 + 1), (0x05 + i * 3, 3 + 1)))
+
+    def __init__(self, dev=None, lazy=False):
+        if dev is None and lazy is False:
+            dev = self._get_device()
+        self._metrics = None
+        self._policy = None
+        self._io_worker = None
+        self._lock = _thread.allocate_lock()
+        self._set_device(dev)
+        self._cache_ttl = {}
+        self._cache = {}
+        self._schedule_max_age = None
+        # seconds between verifications of the predicted current schedule entries, None when not predicting
+        self._prediction_interval = None
+        self._prediction_max_drift = 2
+        # the batch of every thread that has one
+        self._batches = {}
+        self._id = None
+        self._outlets = None
+        if lazy is False:
+            self._ensure_id()
+            self.outlets
 
     def _get_device(self):  # pragma: no cover
-        devs = usb.core.find(find_all=True, idVendor=0x04b4)
-        if devs is None:
+        devs = _find_devices()
+        if len(devs) == 0:
             print("No Energenie products found")
             sys.exit(0)
-        return next(devs)
+        return devs[0]
+
+    def _set_device(self, dev):
+        self._dev = dev
+        if dev is None:
+            # look for the device on the first transfer
+            ctrl_transfer = self._open_device
+        else:
+            ctrl_transfer = getattr(dev, 'ctrl_transfer', None)
+            if self._metrics is not None and ctrl_transfer is not None:
+                ctrl_transfer = self._metrics.instrument(self._id, ctrl_transfer)
+            if self._policy is not None and ctrl_transfer is not None:
+                # every attempt is recorded in the metrics
+                ctrl_transfer = self._policy.wrap(ctrl_transfer)
+        if self._io_worker is not None and ctrl_transfer is not None:
+            ctrl_transfer = self._io_worker.wrap(ctrl_transfer)
+        self._ctrl_transfer = ctrl_transfer
+
+    def _open_device(self, *args):
+        self._set_device(self._get_device())
+        return self._ctrl_transfer(*args)
+
+    def _ensure_id(self):
+        # the id doesn't change, only read it once
+        if self._id is None:
+            self._id = codec.decode_id(self._usb_read(SisPy._ID))
+        return self._id
+
+    def enable_metrics(self, registry=None):
+        """Record every USB transfer with this power strip in the given SisPy.metrics.MetricsRegistry (by default SisPy.metrics.REGISTRY).
+        """
+        if registry is None:
+            from SisPy.metrics import REGISTRY as registry
+        # the transfers are recorded by strip id
+        self._ensure_id()
+        self._metrics = registry
+        self._set_device(self._dev)
+
+    def disable_metrics(self):
+        """Stop recording the USB transfers with this power strip.
+        """
+        self._metrics = None
+        self._set_device(self._dev)
+
+    def set_transfer_policy(self, policy=None):
+        """Use the given SisPy.policy.TransferPolicy for the timeouts, retries and circuit breaking of every USB transfer
+           with this power strip. None goes back to a fixed timeout without retries.
+        """
+        if self._policy is not None:
+            self._policy.close()
+        self._policy = policy
+        self._set_device(self._dev)
+
+    def enable_io_worker(self):
+        """Do all USB transfers with this power strip on a single thread of its own, taking them from a priority queue:
+           switching outlets first, then storing schedules, then reads. See SisPy.worker.
+           Only the transfers are serialized, this doesn't make the SisPy object thread-safe. Switching outlets and
+           reading from several threads is fine: cached values are replaced whole. The kept schedules, their dirty
+           flags and the predictions of the outlets are not locked: use a schedule and its outlet from one thread
+           at a time, or hold a lock of your own around them.
+
+           Returns the SisPy.worker.IOWorker, its stats() tell how long transfers wait.
+        """
+        if self._io_worker is None:
+            from SisPy.worker import IOWorker
+            self._io_worker = IOWorker("SisPy I/O " + str(self._id))
+            self._set_device(self._dev)
+        return self._io_worker
+
+    def disable_io_worker(self):
+        """Do the USB transfers on the calling thread again, after the waiting ones are done.
+        """
+        if self._io_worker is not None:
+            worker = self._io_worker
+            self._io_worker = None
+            self._set_device(self._dev)
+            worker.close()
+
+    def watch(self, callback, min_interval=1.0, max_interval=60.0, error_callback=None):
+        """Call callback(event) with a SisPy.watch.OutletEvent for every change of the outlets, from a background thread.
+
+           The power strip is polled every max_interval seconds, and every min_interval seconds in the minute before
+           a schedule entry ends. See SisPy.watch.WatcherThread for error_callback.
+
+           Returns the started SisPy.watch.WatcherThread, use its stop() method to stop watching.
+        """
+        from SisPy.watch import WatcherThread
+        watcher = WatcherThread(self, callback, min_interval, max_interval, error_callback)
+        watcher.start()
+        return watcher
+
+    def _get_monotonic_time(self):  # pragma: no cover
+        return time.monotonic()
+
+    def set_cache_ttl(self, outlet_status=0, outlet_current_schedule_entry=0, id=0):
+        """Enable (or disable) caching the values read from the power strip.
+
+           Give for each type of report the number of seconds the read value can be reused. 0 disables the cache for that report.
+           Switching an outlet or applying a schedule automatically invalidates the affected values.
+           Use refresh() to throw away all cached values.
+        """
+        self._cache_ttl = {}
+        for command, ttl in ((SisPy._OUTLET_STATUS, outlet_status), (SisPy._OUTLET_CURRENT_SCHEDULE_ENTRY, outlet_current_schedule_entry), (SisPy._ID, id)):
+            if ttl < 0:
+                raise ValueError("Can't use a negative time to live for the cache")
+            if ttl > 0:
+                self._cache_ttl[command] = ttl
+        self.refresh()
+
+    def set_schedule_max_age(self, max_age=None):
+        """Set how long (in seconds) the schedules read from the power strip are used without checking them.
+
+           An older schedule is checked against the current schedule entry the power strip reports (a 3 byte report).
+           Only when they don't match, the complete schedule is read again. 0 checks on every access.
+           None (the default) never checks, the schedule is read only once.
+        """
+        if max_age is not None and max_age < 0:
+            raise ValueError("Can't use a negative max age for the schedules")
+        self._schedule_max_age = max_age
+
+    def set_schedule_prediction(self, verify_interval=None, max_drift=2):
+        """Compute the current schedule entries of the outlets from their kept schedules and the clock of the computer,
+           instead of reading them from the power strip.
+
+           Every verify_interval seconds, the power strip is read to verify the prediction. The drift between the
+           minutes left it reports and the predicted ones is measured (see Outlet.prediction_drift_minutes) and taken
+           into account for the next predictions. When the drift is more than max_drift minutes or the power strip
+           reports a timing error, the current schedule entry is read from the power strip on every access, until it
+           fits the schedule again. An outlet with schedule changes that aren't applied is always read.
+           Snapshots verify the predictions as well.
+           None (the default) disables the prediction.
+        """
+        if verify_interval is not None and verify_interval < 0:
+            raise ValueError("Can't use a negative interval to verify the predictions")
+        if max_drift < 0:
+            raise ValueError("Can't use a negative max drift")
+        self._prediction_interval = verify_interval
+        self._prediction_max_drift = max_drift
+        self._refresh_predictions()
+
+    def refresh(self, outlet_nr=None):
+        """Throw away the cached values, for all outlets or only for the given outlet number.
+           The next read will go to the power strip again.
+        """
+        if outlet_nr is None:
+            self._cache = {}
+        else:
+            for key in [k for k in list(self._cache) if k[1] == outlet_nr]:
+                # another thread may have thrown it away meanwhile
+                self._cache.pop(key, None)
+        self._refresh_predictions(outlet_nr)
+
+    def _refresh_predictions(self, outlet_nr=None):
+        if self._outlets is None:
+            return
+        for outlet in self._outlets:
+            if outlet_nr is None or outlet._nr == outlet_nr:
+                outlet._prediction_checked = None
+
+    def _cache_store(self, command, outlet_nr, data):
+        ttl = self._cache_ttl.get(command)
+        if ttl is not None:
+            self._cache[(command, outlet_nr)] = (self._get_monotonic_time() + ttl, data)
+
+    def batch(self):
+        """Queue the switching of the outlets until the end of the with statement.
+
+           E.g.
+           with sispy.batch() as batch:
+               sispy.outlets[0].switched_on = True
+               sispy.outlets[1].switched_on = False
+               sispy.outlets[0].switched_on = False
+           print(batch.changed)
+
+           Only the last value assigned to an outlet is written. Values the cache (see set_cache_ttl()) shows the
+           outlet already has are not written at all. The remaining writes are done back-to-back at the end of the
+           with statement, nothing is written when it ends with an exception.
+           Reading an outlet inside the with statement reads the power strip, not the queued value.
+           A batch only queues the switches of the thread that started it. A batch inside a batch is written with
+           the outer one.
+
+           Returns a WriteBatch, telling which outlets were written.
+        """
+        return WriteBatch(self)
+
+    def set_states(self, states):
+        """Switch the outlets in one batch, see batch(). states has a value for every outlet, from outlet 0 onwards:
+           True to switch it on, False to switch it off, None to leave it alone.
+
+           Returns the sorted list of the outlet numbers that were written. Inside another batch, nothing is written
+           yet: returns the sorted list of the outlet numbers that were queued, the outer batch tells which of them
+           it wrote.
+        """
+        if len(states) > len(self.outlets):
+            raise ValueError("There are only " + str(len(self.outlets)) + " outlets")
+        with self.batch() as batch:
+            for nr, state in enumerate(states):
+                if state is not None:
+                    self.outlets[nr].switched_on = state
+        if batch._outer is not None:
+            return [nr for nr, state in enumerate(states) if state is not None]
+        return batch.changed
+
+    def _write_status(self, outlet_nr, value):
+        batch = self._batches.get(_thread.get_ident())
+        if batch is not None:
+            # last write wins
+            batch._pending[outlet_nr] = value
+            return
+        self._usb_write(SisPy._OUTLET_STATUS, outlet_nr, codec.encode_status(value))
+
+    def _write_batch(self, batch):
+        now = self._get_monotonic_time()
+        for outlet_nr in sorted(batch._pending):
+            value = batch._pending[outlet_nr]
+            cached = self._cache.get((SisPy._OUTLET_STATUS, outlet_nr))
+            if cached is not None and cached[0] > now and codec.decode_status(cached[1])[0] == value:
+                batch.unchanged.append(outlet_nr)
+                continue
+            self._usb_write(SisPy._OUTLET_STATUS, outlet_nr, codec.encode_status(value))
+            batch.changed.append(outlet_nr)
 
     def _usb_read(self, command, outlet_nr=None):
-        request_type = 0xa1
-        request = 0x01
-        report_nr = None
-        if command == SisPy._ID:
-            report_nr = 0x01
-            data = self._dev.ctrl_transfer(request_type, request, 0x0300 + report_nr, 0, 4 + 1, 500)
-        if command == SisPy._OUTLET_STATUS:
-            report_nr = 0x03 + outlet_nr * 3
-            data = self._dev.ctrl_transfer(request_type, request, 0x0300 + report_nr, 0, 1 + 1, 500)
-        if command == SisPy._OUTLET_SCHEDULE:
-            report_nr = 0x04 + outlet_nr * 3
-            data = self._dev.ctrl_transfer(request_type, request, 0x0300 + report_nr, 0, 38 + 1, 500)
-        if command == SisPy._OUTLET_CURRENT_SCHEDULE_ENTRY:
-            report_nr = 0x05 + outlet_nr * 3
-            data = self._dev.ctrl_transfer(request_type, request, 0x0300 + report_nr, 0, 3 + 1, 500)
+        if command in self._cache_ttl:
+            cached = self._cache.get((command, outlet_nr))
+            if cached is not None and cached[0] > self._get_monotonic_time():
+                return cached[1]
+            data = self._usb_read_device(command, outlet_nr)
+            self._cache_store(command, outlet_nr, data)
+            return data
+        return self._usb_read_device(command, outlet_nr)
+
+    def _usb_read_device(self, command, outlet_nr=None):
+        # the commands are the report numbers of the first outlet
+        report_nr = codec.report_nr(command, outlet_nr)
+        data = self._ctrl_transfer(0xa1, 0x01, 0x0300 + report_nr, 0, codec.REPORT_LENGTHS[command] + 1, 500)
         assert data[0] == report_nr
-        return data[1:]
+        # a view without the report nr, the data is decoded where it was received
+        return memoryview(data)[1:]
+
+    def _usb_read_reports(self, reports):
+        """Read the given (report nr, length) reports back-to-back and return their data (without report nr)."""
+        ctrl_transfer = self._ctrl_transfer
+        raw = [ctrl_transfer(0xa1, 0x01, 0x0300 + report_nr, 0, length, 500) for report_nr, length in reports]
+        result = []
+        for (report_nr, length), data in zip(reports, raw):
+            assert data[0] == report_nr
+            result.append(memoryview(data)[1:])
+        return result
 
     def _usb_write(self, command, outlet_nr, data):
-        request_type = 0x21
-        request = 0x09
-        report_nr = None
-        if command == SisPy._OUTLET_STATUS:
-            assert len(data) == 1
-            report_nr = 0x03 + outlet_nr * 3
-        if command == SisPy._OUTLET_SCHEDULE:
-            assert len(data) == 38
-            report_nr = 0x04 + outlet_nr * 3
-        data.insert(0, report_nr)
-        bytes_written = self._dev.ctrl_transfer(request_type, request, 0x0300 + report_nr, 0, data, 500)
-        assert bytes_written == len(data)
+        # whatever we cached for this outlet is outdated now
+        self._cache.pop((SisPy._OUTLET_STATUS, outlet_nr), None)
+        self._cache.pop((SisPy._OUTLET_CURRENT_SCHEDULE_ENTRY, outlet_nr), None)
+        return self._usb_write_device(command, outlet_nr, data)
+
+    def _usb_write_device(self, command, outlet_nr, data):
+        assert command in (SisPy._OUTLET_STATUS, SisPy._OUTLET_SCHEDULE)
+        assert len(data) == codec.REPORT_LENGTHS[command]
+        report_nr = codec.report_nr(command, outlet_nr)
+        # a buffer per transfer, with the report nr in front of the data: threads can write at the same time
+        buffer = bytearray(len(data) + 1)
+        buffer[0] = report_nr
+        buffer[1:] = data
+        bytes_written = self._ctrl_transfer(0x21, 0x09, 0x0300 + report_nr, 0, buffer, 500)
+        assert bytes_written == len(buffer)
         return bytes_written - 1
 
     @property
@@ -104,8 +399,7 @@ class SisPy(object):
 
            A (large) integer.
         """
-        data = self._usb_read(SisPy._ID)
-        self._id = struct.unpack('<L', data)[0]
+        self._id = codec.decode_id(self._usb_read(SisPy._ID))
         return self._id
 
     @property
@@ -115,25 +409,168 @@ class SisPy(object):
 
            An integer.
         """
-        return len(self._outlets)
+        return len(self.outlets)
 
     @property
     def outlets(self):
         """List of Outlet objects that repesent the state of each programmable outlet.
         """
+        if self._outlets is None:
+            with self._lock:
+                # another thread may have created them meanwhile
+                if self._outlets is None:
+                    self._outlets = [Outlet(i, self) for i in range(4)]
+        return self._outlets
+
+    def snapshot(self):
+        """Read the complete state of the power strip in one go.
+
+           All reports are read back-to-back, so the result is as consistent as the power strip allows.
+           This always reads from the power strip, and refreshes the cached values if caching is enabled.
+
+           A SisPySnapshot object.
+        """
+        data = self._usb_read_reports(SisPy._SNAPSHOT_REPORTS)
+        if len(self._cache_ttl) > 0:
+            for i in range(self.nr_outlets):
+                self._cache_store(SisPy._OUTLET_STATUS, i, data[1 + i * 2])
+                self._cache_store(SisPy._OUTLET_CURRENT_SCHEDULE_ENTRY, i, data[2 + i * 2])
+        if self._prediction_interval is not None:
+            for i, outlet in enumerate(self.outlets):
+                if outlet._schedule is not None:
+                    outlet._verify_prediction(data[2 + i * 2])
+        return SisPySnapshot(self._ensure_id(), data, time.time())
+
+
+class WriteBatch(object):
+    """The outlet switches queued by SisPy.batch().
+
+       After the with statement, changed is the sorted list of the outlet numbers that were written and unchanged the
+       ones that weren't, because the cache showed they had the requested value already.
+    """
+    __slots__ = ('_sispy', '_pending', '_outer', 'changed', 'unchanged')
+
+    def __init__(self, sispy):
+        self._sispy = sispy
+        self._pending = {}
+        self._outer = None
+        self.changed = []
+        self.unchanged = []
+
+    def __enter__(self):
+        self._outer = self._sispy._batches.get(_thread.get_ident())
+        if self._outer is None:
+            self._sispy._batches[_thread.get_ident()] = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._outer is not None:
+            # the outer batch writes
+            return False
+        del self._sispy._batches[_thread.get_ident()]
+        if exc_type is None:
+            self._sispy._write_batch(self)
+        return False
+
+
+class SisPySnapshot(object):
+    """The state of a power strip and all its outlets at a given moment. Nothing can be set.
+    """
+    __slots__ = ('_strip_id', '_epoch_taken', '_buzzer_enabled', '_outlets')
+
+    def __init__(self, strip_id, data, epoch_taken):
+        self._strip_id = strip_id
+        self._epoch_taken = epoch_taken
+        self._buzzer_enabled = (data[0][0] & 0x04 == 0x04)
+        self._outlets = tuple(OutletSnapshot(i, data[1 + i * 2], data[2 + i * 2]) for i in range(int((len(data) - 1) / 2)))
+
+    @property
+    def strip_id(self):
+        """The internal identifier of the power strip.
+
+           A (large) integer.
+        """
+        return self._strip_id
+
+    @property
+    def time_taken(self):
+        """The time the snapshot was taken.
+
+           The time is given by a time UTC tuple.
+        """
+        return time.gmtime(self._epoch_taken)
+
+    @property
+    def buzzer_enabled(self):
+        """Indicate whether the buzzer of the power strip is enabled.
+
+           True if the buzzer is enabled, False otherwise.
+        """
+        return self._buzzer_enabled
+
+    @property
+    def outlets(self):
+        """Tuple of OutletSnapshot objects, one for each programmable outlet.
+        """
         return self._outlets
 
 
+class OutletSnapshot(object):
+    """The state of a single outlet at a given moment. Nothing can be set.
+    """
+    __slots__ = ('_nr', '_switched_on', '_voltage_present', '_current_schedule_entry')
+
+    def __init__(self, nr, status_data, current_schedule_entry_data):
+        self._nr = nr
+        self._switched_on, self._voltage_present = codec.decode_status(status_data)
+        self._current_schedule_entry = OutletCurrentScheduleEntry(current_schedule_entry_data)
+
+    @property
+    def nr(self):
+        """The number of the outlet on the power strip, from 0 onwards.
+        """
+        return self._nr
+
+    @property
+    def switched_on(self):
+        """Indicate whether the outlet is switched on (control bit).
+
+           True if the outlet is switched on, False otherwise.
+        """
+        return self._switched_on
+
+    @property
+    def voltage_present(self):
+        """Indicate whether voltage is present on the outlet.
+
+           True if voltage is present, False otherwise.
+        """
+        return self._voltage_present
+
+    @property
+    def current_schedule_entry(self):
+        """The OutletCurrentScheduleEntry object with the schedule entry that was being executed.
+        """
+        return self._current_schedule_entry
+
+
 class Outlet(object):
     """Represent the state of single outlet.
 
        With this classe, you can check where the outlet is in executing a hardware schedule,
        examine or set the mentioned hardware schedule, check the power state of the outlet.
     """
+    __slots__ = ('_nr', '_sispy', '_schedule', '_schedule_checked', '_prediction_checked', '_drift_minutes')
+
     def __init__(self, nr, sispy):
         self._nr = nr
         self._sispy = sispy
         self._schedule = None
+        # monotonic time the schedule was last read or checked
+        self._schedule_checked = None
+        # monotonic time the predicted current schedule entry last fitted the power strip, None to read it
+        self._prediction_checked = None
+        self._drift_minutes = None
 
     @property
     def switched_on(self):
@@ -148,30 +585,141 @@ class Outlet(object):
 
     @switched_on.setter
     def switched_on(self, value):
-        if value is True:
-            self._sispy._usb_write(SisPy._OUTLET_STATUS, self._nr, bytearray([1]))
-            return
-        if value is False:
-            self._sispy._usb_write(SisPy._OUTLET_STATUS, self._nr, bytearray([0]))
+        if isinstance(value, bool):
+            self._sispy._write_status(self._nr, value)
             return
         raise TypeError("Can't assign a " + value.__class__.__name__ + " to a boolean property.")
 
     @property
     def schedule(self):
         """Represent the hardware schedule of the outlet.
+
+           The schedule is read once and kept. See SisPy.set_schedule_max_age() to check whether the kept schedule
+           still matches the one on the power strip. A schedule with changes that aren't applied is never read again.
         """
         if self._schedule is None:
-            data = self._sispy._usb_read(SisPy._OUTLET_SCHEDULE, self._nr)
-            self._schedule = OutletSchedule(data, self._sispy, self._nr)
+            return self.refresh_schedule()
+        max_age = self._sispy._schedule_max_age
+        if max_age is not None and self._schedule._dirty is False:
+            now = self._sispy._get_monotonic_time()
+            if self._schedule_checked is None or now - self._schedule_checked >= max_age:
+                if self._schedule_is_current() is False:
+                    return self.refresh_schedule()
+                self._schedule_checked = now
+        return self._schedule
+
+    def refresh_schedule(self):
+        """Read the hardware schedule from the power strip again, throwing away the kept one (and any changes to it).
+
+           Returns the new OutletSchedule object.
+        """
+        data = self._sispy._usb_read(SisPy._OUTLET_SCHEDULE, self._nr)
+        self._schedule = OutletSchedule(data, self._sispy, self._nr)
+        self._schedule_checked = self._sispy._get_monotonic_time()
+        self._prediction_checked = None
         return self._schedule
 
+    def _store_schedule(self, schedule, data, force=False):
+        """Store the schedule, constructed in data, on this outlet. The schedule can belong to any outlet.
+
+           Like OutletSchedule.apply(), the write is skipped if the outlet already has an equivalent schedule, unless forced.
+           Returns True if the schedule was written, False otherwise.
+        """
+        if schedule._sispy is self._sispy and schedule._nr == self._nr:
+            if force is False and schedule._dirty is False:
+                return False
+            if schedule._store(data, force) is False:
+                return False
+            self._schedule = schedule
+        else:
+            kept = self._schedule
+            if force is False and kept is not None and schedule._equivalent(data, kept._data):
+                return False
+            self._sispy._usb_write(SisPy._OUTLET_SCHEDULE, self._nr, data)
+            self._schedule = OutletSchedule(data, self._sispy, self._nr)
+        self._schedule_checked = self._sispy._get_monotonic_time()
+        # the power strip starts the new schedule when it's written, that's only known after reading it
+        self._prediction_checked = None
+        return True
+
+    def _apply_schedule(self, schedule, force=False):
+        """Store the schedule, which can be one of any outlet, on this outlet. Like OutletSchedule.apply() for its own schedule."""
+        if schedule._sispy is self._sispy and schedule._nr == self._nr:
+            return schedule.apply(force)
+        if force is False and self._can_skip_store(schedule):
+            return False
+        return self._store_schedule(schedule, schedule._construct_data(schedule._get_current_time()), force)
+
+    def _can_skip_store(self, schedule):
+        """Whether storing the schedule on this outlet would be skipped by _store_schedule() without force, found
+           without constructing it. Its own schedule without real changes is marked clean, as OutletSchedule.apply() does."""
+        if schedule._sispy is self._sispy and schedule._nr == self._nr:
+            if schedule._dirty is False:
+                return True
+            if schedule._matches_stored():
+                schedule._keep_stored()
+                return True
+            return False
+        kept = self._schedule
+        return kept is not None and schedule._matches_stored(kept._data)
+
+    def _schedule_is_current(self):
+        # always ask the power strip, but keep the answer for current_schedule_entry
+        data = self._sispy._usb_read_device(SisPy._OUTLET_CURRENT_SCHEDULE_ENTRY, self._nr)
+        self._sispy._cache_store(SisPy._OUTLET_CURRENT_SCHEDULE_ENTRY, self._nr, data)
+        schedule = self._schedule
+        return schedule._matches_current_entry(data, _timegm(schedule._get_current_time()))
+
+    def refresh(self):
+        """Throw away the cached values of this outlet, so the next read goes to the power strip.
+        """
+        self._sispy.refresh(self._nr)
+
     @property
     def current_schedule_entry(self):
         """Represent the current schedule entry that's being executed.
+
+           See SisPy.set_schedule_prediction() to compute it from the kept schedule instead of reading it.
         """
+        if self._sispy._prediction_interval is not None:
+            return self._predicted_schedule_entry()
         data = self._sispy._usb_read(SisPy._OUTLET_CURRENT_SCHEDULE_ENTRY, self._nr)
         return OutletCurrentScheduleEntry(data)
 
+    @property
+    def prediction_drift_minutes(self):
+        """The number of minutes the power strip was ahead of the predicted current schedule entry (negative when
+           behind) at the last verification, see SisPy.set_schedule_prediction().
+
+           None if it wasn't verified yet or didn't fit the schedule.
+        """
+        return self._drift_minutes
+
+    def _predicted_schedule_entry(self):
+        if self._schedule is None:
+            self.refresh_schedule()
+        schedule = self._schedule
+        checked = self._prediction_checked
+        if schedule._dirty is False and checked is not None and \
+                self._sispy._get_monotonic_time() - checked < self._sispy._prediction_interval:
+            epoch = _timegm(schedule._get_current_time()) + self._drift_minutes * 60
+            return OutletCurrentScheduleEntry(codec.CURRENT_SCHEDULE_ENTRY.pack(*schedule._expected_current_entry(epoch)))
+        # verify the prediction, and use what the power strip reports meanwhile
+        data = self._sispy._usb_read_device(SisPy._OUTLET_CURRENT_SCHEDULE_ENTRY, self._nr)
+        self._sispy._cache_store(SisPy._OUTLET_CURRENT_SCHEDULE_ENTRY, self._nr, data)
+        self._verify_prediction(data)
+        return OutletCurrentScheduleEntry(data)
+
+    def _verify_prediction(self, data):
+        """Compare the current schedule entry report with the kept schedule."""
+        schedule = self._schedule
+        self._drift_minutes = None
+        self._prediction_checked = None
+        if schedule._dirty is False:
+            self._drift_minutes = schedule._drift_minutes(data, _timegm(schedule._get_current_time()), self._sispy._prediction_max_drift)
+            if self._drift_minutes is not None:
+                self._prediction_checked = self._sispy._get_monotonic_time()
+
 
 class OutletCurrentScheduleEntry(object):
     """Indicates where the outlet currently is in the execution of the schedule.
@@ -182,25 +730,15 @@ class OutletCurrentScheduleEntry(object):
 
        The latter can happen when the power strip is set without current for a long time.
     """
-    def __init__(self, data):
-        self._data = data
-
-        self._timing_error = (data[0] & 0x80 == 0x80)
-        self._current_schedule_nr = (data[0] & 0x7f)
-        value = struct.unpack('<H', data[1:])[0]
+    # only the two raw fields are kept, everything else is derived from them
+    __slots__ = ('_flags', '_value')
 
-        if self._current_schedule_nr == 0x10:
-            # We're still waiting for the initial delay to finish
-            self._current_schedule_nr = None
-            self._sequence_rampup = True
-            self._minutes_to_next_schedule_entry = value
-        else:
-            self._current_schedule_nr = (data[0] & 0x7f)
-            self._sequence_rampup = False
-            self._minutes_to_next_schedule_entry = (value & 0x3FFF)
+    def __init__(self, data):
+        self._flags, self._value = codec.decode_current_schedule_entry(data)
 
-        self._switched_it_on = (value & 0x8000 == 0x8000)
-        self._sequence_done = (self._minutes_to_next_schedule_entry == 0)
+    @property
+    def _data(self):
+        return bytearray(codec.CURRENT_SCHEDULE_ENTRY.pack(self._flags, self._value))
 
     @property
     def timing_error(self):
@@ -208,7 +746,7 @@ class OutletCurrentScheduleEntry(object):
 
            True for a detected error, False otherwise.
         """
-        return self._timing_error
+        return (self._flags & 0x80 == 0x80)
 
     @property
     def sequence_rampup(self):
@@ -216,7 +754,8 @@ class OutletCurrentScheduleEntry(object):
 
            True if this is the case, False otherwise.
         """
-        return self._sequence_rampup
+        # We're still waiting for the initial delay to finish
+        return (self._flags & 0x7f == 0x10)
 
     @property
     def current_schedule_nr(self):
@@ -225,7 +764,9 @@ class OutletCurrentScheduleEntry(object):
            An integer from 0 onwards.
            None if we're still in rampup state.
         """
-        return self._current_schedule_nr
+        if self.sequence_rampup is True:
+            return None
+        return (self._flags & 0x7f)
 
     @property
     def switched_it_on(self):
@@ -234,7 +775,7 @@ class OutletCurrentScheduleEntry(object):
 
            True if the outlet was switched on.
         """
-        return self._switched_it_on
+        return (self._value & 0x8000 == 0x8000)
 
     @property
     def minutes_to_next_schedule_entry(self):
@@ -243,7 +784,9 @@ class OutletCurrentScheduleEntry(object):
 
            An integer with the number of minutes.
         """
-        return self._minutes_to_next_schedule_entry
+        if self.sequence_rampup is True:
+            return self._value
+        return (self._value & 0x3FFF)
 
     @property
     def sequence_done(self):
@@ -252,7 +795,7 @@ class OutletCurrentScheduleEntry(object):
 
            True if the sequence is finished.
         """
-        return self._sequence_done
+        return (self.minutes_to_next_schedule_entry == 0)
 
 
 class OutletScheduleEntry(object):
@@ -274,26 +817,25 @@ class OutletScheduleEntry(object):
        - if the wait time is 15 minutes and the start time is set at 09:15, the end time will be 09:30.
 
        The start time will always take into account the wait times if the previous entries (if any).
+
+       An entry is a view on the raw entries of its OutletSchedule, it doesn't hold any data itself.
     """
-    def __init__(self, data, schedule, entry_nr):
-        self._data = data
+    __slots__ = ('_schedule', '_entry_nr')
+
+    def __init__(self, schedule, entry_nr):
         self._schedule = schedule
         self._entry_nr = entry_nr
 
-        self._parse_data(self._data)
+    def _value(self):
+        """The raw value of the entry, as stored on the power strip."""
+        return self._schedule._values[self._entry_nr]
 
-    def _parse_data(self, data):
-        value = struct.unpack('<H', data)[0]
-        self._switch_on = (value & 0x8000 == 0x8000)
-        self._minutes_to_next_schedule_entry = (value & 0x3FFF)
+    def _minutes(self):
+        return self._schedule._values[self._entry_nr] & codec.ENTRY_MINUTES
 
     def _construct_data(self):
-        value = self._minutes_to_next_schedule_entry
-        if self._switch_on is True:
-            value |= 0x8000
-        data = bytearray([0, 0])
-        struct.pack_into('<H', data, 0, value)
-        return data
+        value = self._value()
+        return bytearray([value & 0xFF, value >> 8])
 
     @property
     def switch_on(self):
@@ -301,15 +843,33 @@ class OutletScheduleEntry(object):
 
            Beware, the current status could be different due to other manipulations after that time.
         """
-        return self._switch_on
+        return (self._value() & codec.ENTRY_SWITCH_ON == codec.ENTRY_SWITCH_ON)
 
     @switch_on.setter
     def switch_on(self, new_setting):
         if isinstance(new_setting, bool):
-            self._switch_on = new_setting
+            if new_setting != self.switch_on:
+                self._schedule._dirty = True
+                self._schedule._values[self._entry_nr] ^= codec.ENTRY_SWITCH_ON
         else:
             raise TypeError("Can't set the switch status in schedule entry with a " + new_setting.__class__.__name__)
 
+    @property
+    def delay_only(self):
+        """True when this schedule entry doesn't switch the outlet, it only waits ("delay without switching").
+           Chaining such entries makes waits longer than 0x3FFF minutes possible. False otherwise.
+        """
+        return (self._value() & codec.ENTRY_DELAY == codec.ENTRY_DELAY)
+
+    @delay_only.setter
+    def delay_only(self, new_setting):
+        if isinstance(new_setting, bool):
+            if new_setting != self.delay_only:
+                self._schedule._dirty = True
+                self._schedule._values[self._entry_nr] ^= codec.ENTRY_DELAY
+        else:
+            raise TypeError("Can't set the delay flag in schedule entry with a " + new_setting.__class__.__name__)
+
     @property
     def minutes_to_next_schedule_entry(self):
         """The set wait time in minutes after this schedule entry was started to start the next one.
@@ -318,7 +878,7 @@ class OutletScheduleEntry(object):
 
            This is always an int indicating the number of minutes.
         """
-        return self._minutes_to_next_schedule_entry
+        return self._minutes()
 
     @minutes_to_next_schedule_entry.setter
     def minutes_to_next_schedule_entry(self, new_minutes):
@@ -328,13 +888,18 @@ class OutletScheduleEntry(object):
             if new_minutes > 0x3FFF:
                 raise ValueError("Number of minutes to set too big (> 16383 (~ 273+ hours or ~ 11+ days))")
 
-            self._minutes_to_next_schedule_entry = new_minutes
+            self._set_minutes(new_minutes)
         else:
             raise TypeError("Can't use a " + new_minutes.__class__.__name__ + " to set the number of minutes.")
 
+    def _set_minutes(self, new_minutes):
+        values = self._schedule._values
+        delta = new_minutes - (values[self._entry_nr] & codec.ENTRY_MINUTES)
+        values[self._entry_nr] = (values[self._entry_nr] & ~codec.ENTRY_MINUTES) | new_minutes
+        self._schedule._shift_cumulative_minutes(self._entry_nr, delta)
+
     def _start_epoch(self):
-        delay_minutes = self._schedule._add_schedule_minutes(self._schedule._entries[:self._entry_nr])
-        return self._schedule._start_epoch() + delay_minutes * 60
+        return self._schedule._start_epoch() + self._schedule._cumulative_minutes[self._entry_nr] * 60
 
     @property
     def start_time(self):
@@ -351,13 +916,14 @@ class OutletScheduleEntry(object):
         """Set the new start time. This also shifts the end time with as much time.
         """
         if isinstance(new_time, time.struct_time):
-            new_start_epoch = calendar.timegm(new_time)
+            new_start_epoch = _timegm(new_time)
         else:
             raise TypeError("Can't us a " + new_time.__class__.__name__ + " type to set the time.")
 
         if self._entry_nr == 0:
             if new_start_epoch < self._schedule._epoch_activated:
                 raise ValueError("Start time of first schedule entry needs to be after the start time of the outlet schedule.")
+            self._schedule._dirty = True
             self._schedule._rampup_minutes = int((new_start_epoch - self._schedule._start_epoch()) / 60)
             # ensure there is always a whole number of minutes between the times.
             self._schedule._epoch_activated = new_start_epoch - self._schedule._rampup_minutes * 60
@@ -365,7 +931,7 @@ class OutletScheduleEntry(object):
             prev_entry = self._schedule.entries[self._entry_nr - 1]
             if new_start_epoch < prev_entry._start_epoch():
                 raise ValueError("Start time of a schedule entry needs to be after the start time of the previous schedule entry.")
-            prev_entry._minutes_to_next_schedule_entry = int((new_start_epoch - prev_entry._start_epoch()) / 60)
+            prev_entry._set_minutes(int((new_start_epoch - prev_entry._start_epoch()) / 60))
 
     @property
     def end_time(self):
@@ -376,7 +942,7 @@ class OutletScheduleEntry(object):
 
            This is a time UTC tuple.
         """
-        return self._schedule._epoch_to_time(self._start_epoch() + self._minutes_to_next_schedule_entry * 60)
+        return self._schedule._epoch_to_time(self._start_epoch() + self._minutes() * 60)
 
     @end_time.setter
     def end_time(self, new_time):
@@ -384,7 +950,7 @@ class OutletScheduleEntry(object):
         """
         end_epoch = None
         if isinstance(new_time, time.struct_time):
-            end_epoch = calendar.timegm(new_time)
+            end_epoch = _timegm(new_time)
         else:
             raise TypeError("Can't us a " + new_time.__class__.__name__ + " type to set the time.")
 
@@ -394,10 +960,13 @@ class OutletScheduleEntry(object):
         self.minutes_to_next_schedule_entry = int((end_epoch - self._start_epoch()) / 60)
 
     def __str__(self):
-        return "switch on: " + str(self.switch_on) + \
-               ", start time: " + time.strftime("%Y-%m-%d %H:%M:%S UTC", self.start_time) + \
-               ", time to next schedule entry: " + _min2human(self.minutes_to_next_schedule_entry) + \
-               ", end time: " + time.strftime("%Y-%m-%d %H:%M:%S UTC", self.end_time)
+        description = "switch on: " + str(self.switch_on) + \
+                      ", start time: " + time.strftime("%Y-%m-%d %H:%M:%S UTC", self.start_time) + \
+                      ", time to next schedule entry: " + _min2human(self.minutes_to_next_schedule_entry) + \
+                      ", end time: " + time.strftime("%Y-%m-%d %H:%M:%S UTC", self.end_time)
+        if self.delay_only:
+            return "delay only, " + description
+        return description
 
 
 class OutletSchedule(object):
@@ -405,85 +974,223 @@ class OutletSchedule(object):
        schedule (rampup time) and when the schedule will start to run.
 
        A schedule can be executed once or periodically.
+
+       The raw entries are kept in a single array, the OutletScheduleEntry objects are views on it.
+       With 16 entries, a schedule takes about 500 bytes.
     """
+    __slots__ = ('_data', '_sispy', '_nr', '_dirty', '_periodic', '_epoch_activated', '_rampup_minutes',
+                 '_values', '_cumulative_minutes', '_get_current_time')
+
+    # difference in minutes allowed between the current schedule entry reported by the power strip and the one expected,
+    # for the clocks drifting apart and the power strip rounding the minutes
+    _MAX_DRIFT_MINUTES = 2
+
     def __init__(self, data, sispy, outlet_nr=0):
+        # as stored on the power strip, as it was received
         self._data = data
         self._sispy = sispy
         self._nr = outlet_nr
+        self._get_current_time = time.gmtime
 
         self._parse_data(self._data)
+        self._dirty = False
 
     def _parse_data(self, data):
-        self._entries = []
+        from array import array
         self._periodic = True
 
-        self._epoch_activated = struct.unpack('<L', data[0:4])[0]
-        self._rampup_minutes = struct.unpack('<H', data[36:38])[0]
+        self._epoch_activated, values, self._rampup_minutes = codec.decode_schedule(data)
 
-        for i in range(4, 36, 2):
-            value = struct.unpack('<H', data[i:i + 2])[0]
-            if value == 0x0:
-                self._periodic = False
-            elif value != 0x3FFF:
-                self._entries.append(OutletScheduleEntry(data[i:i + 2], self, int((i - 4) / 2)))
+        if codec.ENTRY_END in values:
+            self._periodic = False
+        self._values = array('H', [value for value in values if value != codec.ENTRY_END and value != codec.ENTRY_UNUSED])
 
-        if len(self._entries) == 0:
+        if len(self._values) == 0:
             self._periodic = False
             self._rampup_minutes = 0
 
+        self._build_cumulative_minutes()
+
+    def _build_cumulative_minutes(self):
+        # _cumulative_minutes[i] is the number of minutes between the schedule start and the start of entry i,
+        # the last element is the total length of the schedule
+        from array import array
+        cumulative_minutes = [0]
+        for value in self._values:
+            cumulative_minutes.append(cumulative_minutes[-1] + (value & codec.ENTRY_MINUTES))
+        self._cumulative_minutes = array('I', cumulative_minutes)
+
+    def _shift_cumulative_minutes(self, entry_nr, delta):
+        if delta == 0:
+            return
+        self._dirty = True
+        cumulative_minutes = self._cumulative_minutes
+        for i in range(entry_nr + 1, len(cumulative_minutes)):
+            cumulative_minutes[i] += delta
+
     def _construct_data(self, activation_time):
-        new_epoch_activated = calendar.timegm(activation_time)
-        if len(self._entries) > 0:
-            start_epoch = self._entries[0]._start_epoch()
-            self._rampup_minutes = int((start_epoch - new_epoch_activated) / 60)
-            self._epoch_activated = new_epoch_activated
+        """The report storing this schedule, activated at the given time. The schedule itself isn't changed.
+           A periodic schedule that started already is anchored at a later entry, see _anchored().
+        """
+        new_epoch_activated = _timegm(activation_time)
+        anchored = self._anchored(new_epoch_activated)
+        if anchored is None:
+            raise ValueError("The schedule isn't periodic and started already, it can't be activated again")
+        values, start_epoch = anchored
+        if len(values) == 0:
+            return codec.encode_schedule(int(self._epoch_activated), codec.schedule_entries(values, self.periodic), 0)
+        rampup_minutes = int((start_epoch - new_epoch_activated) / 60)
+        if rampup_minutes > 0xFFFF:
+            raise ValueError("The schedule starts too long (> 65535 minutes) after it's activated")
+        return codec.encode_schedule(int(new_epoch_activated), codec.schedule_entries(values, self.periodic), rampup_minutes)
+
+    def _anchored(self, epoch):
+        """The raw entries and the start epoch to store this schedule with, when it can't start before the given epoch.
+
+           A periodic schedule that started already starts again with the first entry that starts at or after the epoch,
+           followed by the others in turn: the outlet keeps switching at the same times. None for a non-periodic
+           schedule that started already.
+        """
+        values = self._values
+        start_epoch = self._start_epoch()
+        if len(values) == 0 or epoch <= start_epoch:
+            return (list(values), start_epoch)
+        cumulative_minutes = self._cumulative_minutes
+        total_seconds = cumulative_minutes[-1] * 60
+        if self._periodic is False or total_seconds == 0:
+            return None
+        cycles, seconds = divmod(epoch - start_epoch, total_seconds)
+        entry_nr = bisect.bisect_left(cumulative_minutes, seconds / 60)
+        if entry_nr == len(values):
+            # the first entry of the next cycle
+            cycles += 1
+            entry_nr = 0
+        return (list(values[entry_nr:]) + list(values[:entry_nr]),
+                start_epoch + cycles * total_seconds + cumulative_minutes[entry_nr] * 60)
+
+    def _expected_current_entry(self, epoch):
+        """The (entry number and flags, raw entry) the power strip reports at the given epoch when executing this schedule."""
+        nr_entries = len(self._values)
+        if nr_entries == 0:
+            return (0, 0)
+        start_epoch = self._start_epoch()
+        if epoch < start_epoch:
+            # rampup, the minutes left use all bits
+            return (0x10, int((start_epoch - epoch + 59) // 60) & 0xFFFF)
+        cumulative_minutes = self._cumulative_minutes
+        seconds = epoch - start_epoch
+        if self._periodic is True and cumulative_minutes[-1] > 0:
+            seconds %= cumulative_minutes[-1] * 60
+        elif seconds >= cumulative_minutes[-1] * 60:
+            # a non-periodic schedule that finished
+            return (nr_entries, self._values[-1] & 0xC000)
+        entry_nr = bisect.bisect_right(cumulative_minutes, seconds // 60) - 1
+        minutes_left = int((cumulative_minutes[entry_nr + 1] * 60 - seconds + 59) // 60)
+        # the power strip reports the number of the next entry
+        next_entry_nr = (entry_nr + 1) % nr_entries if self._periodic is True else entry_nr + 1
+        return (next_entry_nr, (self._values[entry_nr] & 0xC000) | minutes_left)
+
+    def _drift_minutes(self, data, epoch, max_drift):
+        """The number of minutes the power strip is ahead of this schedule at the given epoch (negative when behind),
+           judging by the current schedule entry report: the report is the one expected that many minutes later.
+
+           None if the report doesn't fit within max_drift minutes, also around the start of the next or previous entry.
+           A report with the timing error flag never fits, the schedule can't be followed anymore.
+        """
+        flags, value = codec.decode_current_schedule_entry(data)
+        if flags & 0x80 == 0x80:
+            return None
+        # the smallest drift first
+        for minutes in sorted(range(-max_drift, max_drift + 1), key=abs):
+            if self._expected_current_entry(epoch + minutes * 60) == (flags, value):
+                return minutes
+        return None
+
+    def _matches_current_entry(self, data, epoch):
+        """Whether the current schedule entry report fits this schedule at the given epoch, within the allowed drift.
+        """
+        return self._drift_minutes(data, epoch, self._MAX_DRIFT_MINUTES) is not None
+
+    def _equivalent(self, data, other_data):
+        # the power strip only cares about the entries and when the first entry starts, not when it was activated
+        epoch_activated, values, rampup_minutes = codec.decode_schedule(data)
+        other_epoch_activated, other_values, other_rampup_minutes = codec.decode_schedule(other_data)
+        if values != other_values:
+            return False
+        if len(self._values) == 0:
+            return True
+        return epoch_activated + rampup_minutes * 60 == other_epoch_activated + other_rampup_minutes * 60
+
+    def _matches_stored(self, stored_data=None):
+        """Whether the schedule stored on the power strip (by default the one this schedule was read from) has the same
+           entries, with the first one starting at the same time, or is this schedule anchored when it was stored (see
+           _anchored()). Unlike _equivalent(), this needs no constructed data.
+           The rampup is a whole number of minutes from the moment the schedule was stored, so the stored schedule can
+           start up to a minute early."""
+        epoch_activated, values, rampup_minutes = codec.decode_schedule(self._data if stored_data is None else stored_data)
+        stored_start_epoch = epoch_activated + rampup_minutes * 60
+        anchored = self._anchored(stored_start_epoch)
+        if anchored is None or values != tuple(codec.schedule_entries(anchored[0], self._periodic)):
+            return False
+        return len(self._values) == 0 or 0 <= anchored[1] - stored_start_epoch < 60
+
+    def _keep_stored(self):
+        # take over the schedule as it is stored on the power strip, which may be anchored at a later entry
+        if len(self._values) > 0:
+            self._parse_data(self._data)
         else:
+            self._epoch_activated = codec.decode_schedule(self._data)[0]
             self._rampup_minutes = 0
+        self._dirty = False
+
+    def apply(self, force=False):
+        """Store the schedule on the power strip.
+
+           The write is skipped if the schedule wasn't changed, or if the power strip already contains an equivalent schedule.
+           Use force=True to always write the schedule.
+           A periodic schedule that started already keeps its phase: it's stored starting with its next entry, and this
+           schedule then has the entries in that order. A non-periodic one that started already raises ValueError.
+
+           Returns True if the schedule was written, False otherwise.
+        """
+        if force is False:
+            if self._dirty is False:
+                return False
+            if self._matches_stored():
+                self._keep_stored()
+                return False
+        return self._store(self._construct_data(self._get_current_time()), force)
+
+    def _store(self, data, force=False):
+        # data is this schedule constructed with _construct_data()
+        if force is False and self._equivalent(data, self._data):
+            self._keep_stored()
+            return False
 
-        data = bytearray(range(38))
-        struct.pack_into('<L', data, 0, int(self._epoch_activated))
-        struct.pack_into('<H', data, 36, self._rampup_minutes)
-
-        # write out the schedule entries
-        i = 0
-        while i < 15 and i < len(self._entries):
-            data[4 + i * 2] = self._entries[i]._construct_data()[0]
-            data[5 + i * 2] = self._entries[i]._construct_data()[1]
-            i += 1
-        if self.periodic is False:
-            data[4 + i * 2] = 0
-            data[5 + i * 2] = 0
-            i += 1
-        while i < 16:
-            data[4 + i * 2] = 0xff
-            data[5 + i * 2] = 0x3f
-            i += 1
-        return data
-
-    def _get_current_time(self):  # pragma no cover
-        return time.gmtime()
-
-    def apply(self):
-        data = self._construct_data(self._get_current_time())
         self._sispy._usb_write(SisPy._OUTLET_SCHEDULE, self._nr, data)
+        self._sispy._refresh_predictions(self._nr)
+        self._data = bytes(data)
+        self._keep_stored()
+        return True
+
+    @property
+    def dirty(self):
+        """Indicates whether the schedule was changed since it was read from or written to the power strip.
+
+           True if the schedule was changed, False otherwise.
+        """
+        return self._dirty
 
     def reset(self):
-        self._entries = []
+        from array import array
+        self._dirty = True
+        self._values = array('H')
+        self._cumulative_minutes = array('I', [0])
         self._periodic = True
 
     def _epoch_to_time(self, epoch):
         return time.gmtime(epoch)
 
-    def _add_schedule_minutes(self, schedules):
-        if len(schedules) > 0:
-            min_to_next_schedule = 0
-            for s in schedules:
-                min_to_next_schedule = min_to_next_schedule + s._minutes_to_next_schedule_entry
-
-            return min_to_next_schedule
-        else:
-            return 0
-
     @property
     def time_activated(self):
         """The time the schedule was activated (stored on the power strip).
@@ -514,6 +1221,8 @@ class OutletSchedule(object):
     def periodic(self, value):
         if not isinstance(value, bool):
             raise TypeError("Peridioc flag should be a boolean, not a " + value.__class__.__name__)
+        if value != self._periodic:
+            self._dirty = True
         self._periodic = value
 
     @property
@@ -524,7 +1233,7 @@ class OutletSchedule(object):
            This is an integer with the number of minutes.
         """
         if self.periodic is True:
-            return self._add_schedule_minutes(self._entries)
+            return self._cumulative_minutes[-1]
         else:
             return None
 
@@ -538,7 +1247,7 @@ class OutletSchedule(object):
         if self.periodic is True:
             return None
         else:
-            return self._add_schedule_minutes(self._entries)
+            return self._cumulative_minutes[-1]
 
     def _start_epoch(self):
         return self._epoch_activated + self._rampup_minutes * 60
@@ -563,14 +1272,92 @@ class OutletSchedule(object):
         else:
             return self._epoch_to_time(self._start_epoch() + self.schedule_minutes * 60)
 
+    def _timeline(self, initial_state):
+        """The tables state_at() looks up in: the start of every entry and the end of the schedule in seconds after the
+           start, and for every entry number (and the number of entries, once a non-periodic schedule is done) the state
+           of the outlet in the first cycle and in the later cycles."""
+        values = self._values
+
+        def states_after(state):
+            states = []
+            for nr in range(len(values) + 1):
+                value = values[min(nr, len(values) - 1)]
+                # entries with the "delay without switching" flag leave the outlet as it is
+                if value & codec.ENTRY_DELAY == 0:
+                    state = value & codec.ENTRY_SWITCH_ON == codec.ENTRY_SWITCH_ON
+                states.append(state)
+            return states
+
+        first_cycle = states_after(initial_state)
+        # the later cycles start with the state at the end of the previous one
+        later_cycles = states_after(first_cycle[-1])
+        return ([minutes * 60 for minutes in self._cumulative_minutes], first_cycle, later_cycles)
+
+    def state_at(self, times, initial_state=False):
+        """The state of the outlet when the power strip executes this schedule, at many times at once.
+
+           times is a sequence (e.g. a numpy array) of times in seconds since the epoch. initial_state is the state of the
+           outlet before the schedule switches it for the first time, e.g. during the rampup.
+
+           Returns a tuple with the states (True when switched on) and the numbers of the entries running at the times.
+           The entry number is -1 before the schedule starts (during the rampup) and the number of entries once a
+           non-periodic schedule is done.
+
+           With numpy installed, both are numpy arrays with the shape of times, computed without a loop over the times:
+           every time costs a binary search in the (at most 17) entry starts. Otherwise, they are lists.
+        """
+        initial_state = bool(initial_state)
+        nr_entries = len(self._values)
+        if nr_entries == 0:
+            cumulative_seconds, first_cycle, later_cycles = ([0], [initial_state], [initial_state])
+        else:
+            cumulative_seconds, first_cycle, later_cycles = self._timeline(initial_state)
+        start_epoch = self._start_epoch()
+        total_seconds = cumulative_seconds[-1]
+        periodic = self._periodic is True and total_seconds > 0
+
+        numpy = _import_numpy()
+        if numpy is None:
+            states = []
+            entry_nrs = []
+            for epoch in times:
+                seconds = epoch - start_epoch
+                if nr_entries == 0 or seconds < 0:
+                    states.append(initial_state)
+                    entry_nrs.append(-1)
+                    continue
+                cycle = 0
+                if periodic:
+                    cycle, seconds = divmod(seconds, total_seconds)
+                entry_nr = bisect.bisect_right(cumulative_seconds, seconds) - 1
+                states.append(later_cycles[entry_nr] if cycle > 0 else first_cycle[entry_nr])
+                entry_nrs.append(entry_nr)
+            return (states, entry_nrs)
+
+        seconds = numpy.asarray(times, dtype=numpy.float64) - start_epoch
+        before = seconds < 0
+        if nr_entries == 0:
+            return (numpy.full(seconds.shape, initial_state), numpy.full(seconds.shape, -1, dtype=numpy.int64))
+        if periodic:
+            cycles, seconds = numpy.divmod(seconds, total_seconds)
+        else:
+            cycles = numpy.zeros(seconds.shape)
+        entry_nrs = numpy.searchsorted(numpy.asarray(cumulative_seconds, dtype=numpy.float64), seconds, side='right') - 1
+        # only negative before the start, which is handled below
+        entry_nrs = numpy.maximum(entry_nrs, 0)
+        states = numpy.where(cycles > 0, numpy.asarray(later_cycles)[entry_nrs], numpy.asarray(first_cycle)[entry_nrs])
+        states = numpy.where(before, initial_state, states)
+        entry_nrs = numpy.where(before, -1, entry_nrs).astype(numpy.int64)
+        return (states, entry_nrs)
+
     @property
     def entries(self):
         """List of the OutletScheduleEntry objects linked with the timer.
 
-           Do not manipulate the list itself directly (e.g. adding or removing entries) because this will lead to unpredictable results.
+           Manipulating the list itself (e.g. adding or removing entries) has no effect on the schedule.
            Use the add_entry() and remove_entry() methods for this.
         """
-        return self._entries
+        return [OutletScheduleEntry(self, i) for i in range(len(self._values))]
 
     def add_entry(self):
         """Add an extra OutletScheduleEntry object to the list at the last position.
@@ -578,13 +1365,16 @@ class OutletSchedule(object):
            This entry will have a length of 0 minutes.
            This entry will set the outlet off.
         """
-        new_entry = OutletScheduleEntry(bytearray([0, 0]), self, len(self._entries))
-        self._entries.append(new_entry)
+        self._values.append(0)
+        self._dirty = True
+        self._cumulative_minutes.append(self._cumulative_minutes[-1])
 
     def remove_entry(self):
         """Removes the last entry from the list.
         """
-        self._entries.pop()
+        self._values.pop()
+        self._dirty = True
+        self._cumulative_minutes.pop()
 
     def __str__(self):
         string = "Time activated: " + time.strftime("%Y-%m-%d %H:%M:%S UTC", self.time_activated) + \
@@ -595,8 +1385,8 @@ class OutletSchedule(object):
         else:
             string += ", total time: " + _min2human(self.schedule_minutes) + " min." + \
                 ", end time: " + time.strftime("%Y-%m-%d %H:%M:%S UTC", self.end_time)
-        for i in range(len(self.entries)):
-            string += ", Entry " + str(i) + ": [" + str(self.entries[i]) + "]"
+        for i, entry in enumerate(self.entries):
+            string += ", Entry " + str(i) + ": [" + str(entry) + "]"
         return string
 
 # vim: set ai tabstop=4 shiftwidth=4 expandtab :
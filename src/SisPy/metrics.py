@@ -0,0 +1,181 @@
+#! /usr/bin/env python
+"""Metrics on the USB transfers with the Energenie power strips.
+
+   Enable them per power strip with SisPy.enable_metrics(). Every transfer is then counted per power strip,
+   report number and direction, with the number of bytes, errors, timeouts and a latency histogram.
+   When metrics are not enabled, the transfers are not touched at all.
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import errno
+import json
+import logging
+import threading
+import time
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+READ = 'read'
+WRITE = 'write'
+
+_log = logging.getLogger(__name__)
+
+
+def _is_timeout(e):
+    # pyusb raises USBTimeoutError in recent versions, a USBError with errno ETIMEDOUT in older ones
+    return e.__class__.__name__ == 'USBTimeoutError' or getattr(e, 'errno', None) == errno.ETIMEDOUT
+
+
+class TransferStats(object):
+    """Statistics of the transfers of one report in one direction on one power strip.
+    """
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latency_sum = 0.0
+        # one more bucket for everything above the last bound
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'bytes': self.bytes,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'latency_sum': self.latency_sum,
+            'latency_buckets': list(self.latency_buckets),
+        }
+
+
+class MetricsRegistry(object):
+    """Collects the transfer statistics of all power strips that have metrics enabled.
+
+       Statistics are indexed by (strip id, report nr, direction), direction being READ or WRITE.
+       Listeners added with add_listener() are called after every transfer.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback(strip_id, report_nr, direction, nr_bytes, seconds, exception) after every transfer.
+           exception is None for successful transfers. Exceptions raised by callback are logged and otherwise ignored.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """Stop calling the given callback.
+        """
+        self._listeners.remove(callback)
+
+    def record(self, strip_id, report_nr, direction, nr_bytes, seconds, exception=None):
+        """Account for a single transfer.
+        """
+        key = (strip_id, report_nr, direction)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = TransferStats()
+            stats.count += 1
+            stats.bytes += nr_bytes
+            stats.latency_sum += seconds
+            stats.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            if exception is not None:
+                stats.errors += 1
+                if _is_timeout(exception):
+                    stats.timeouts += 1
+        for listener in list(self._listeners):
+            # a broken listener mustn't fail the transfer it is told about
+            try:
+                listener(strip_id, report_nr, direction, nr_bytes, seconds, exception)
+            except Exception:
+                _log.exception("Metrics listener %r failed", listener)
+
+    def instrument(self, strip_id, ctrl_transfer):
+        """Wrap the ctrl_transfer function of a USB device so every transfer is recorded.
+        """
+        def instrumented(request_type, request, value=0, index=0, data_or_length=None, timeout=None):
+            direction = READ if request_type & 0x80 else WRITE
+            start = time.perf_counter()
+            try:
+                result = ctrl_transfer(request_type, request, value, index, data_or_length, timeout)
+            except Exception as e:
+                self.record(strip_id, value & 0xFF, direction, 0, time.perf_counter() - start, e)
+                raise
+            nr_bytes = len(result) if direction == READ else result
+            self.record(strip_id, value & 0xFF, direction, nr_bytes, time.perf_counter() - start)
+            return result
+        return instrumented
+
+    def stats(self):
+        """Copy of all statistics, as a dictionary indexed by (strip id, report nr, direction) with TransferStats.as_dict() values.
+        """
+        with self._lock:
+            return dict((key, stats.as_dict()) for key, stats in self._stats.items())
+
+    def reset(self):
+        """Throw away all collected statistics.
+        """
+        with self._lock:
+            self._stats = {}
+
+    def to_json(self):
+        """All statistics as a JSON string.
+        """
+        stats = self.stats()
+        return json.dumps({
+            'latency_buckets': list(LATENCY_BUCKETS),
+            'transfers': [dict(strip_id=k[0], report_nr=k[1], direction=k[2], **v) for k, v in sorted(stats.items())],
+        }, sort_keys=True)
+
+    def prometheus_text(self):
+        """All statistics in the Prometheus text exposition format.
+        """
+        stats = sorted(self.stats().items())
+        lines = []
+        for name, field, help_text in (('sispy_usb_transfers_total', 'count', 'USB transfers'),
+                                       ('sispy_usb_transfer_bytes_total', 'bytes', 'Bytes transferred'),
+                                       ('sispy_usb_transfer_errors_total', 'errors', 'Failed USB transfers'),
+                                       ('sispy_usb_transfer_timeouts_total', 'timeouts', 'Timed out USB transfers')):
+            lines.append('# HELP ' + name + ' ' + help_text + '.')
+            lines.append('# TYPE ' + name + ' counter')
+            for (strip_id, report_nr, direction), s in stats:
+                lines.append('%s{strip="%d",report="%d",direction="%s"} %d' % (name, strip_id, report_nr, direction, s[field]))
+        name = 'sispy_usb_transfer_seconds'
+        lines.append('# HELP ' + name + ' Latency of the USB transfers.')
+        lines.append('# TYPE ' + name + ' histogram')
+        for (strip_id, report_nr, direction), s in stats:
+            labels = 'strip="%d",report="%d",direction="%s"' % (strip_id, report_nr, direction)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), s['latency_buckets']):
+                cumulative += count
+                lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+            lines.append('%s_sum{%s} %r' % (name, labels, s['latency_sum']))
+            lines.append('%s_count{%s} %d' % (name, labels, s['count']))
+        return '\n'.join(lines) + '\n'
+
+
+# the default registry
+REGISTRY = MetricsRegistry()
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -0,0 +1,161 @@
+#! /usr/bin/env python
+"""Timeouts, retries and a circuit breaker for the USB transfers with a power strip.
+
+   A TransferPolicy wraps the ctrl_transfer function of the USB device of one power strip:
+   - the timeout follows the latency of the last successful transfers: a percentile of them times a factor,
+     between min_timeout and max_timeout (in ms). Until enough transfers are seen, max_timeout is used.
+   - reads are tried again after a failure, at most retries times, after a backoff with jitter. Writes are not
+     retried, a failed write may have been executed anyway.
+   - after failure_threshold failed calls in a row, the circuit opens: calls fail immediately with
+     CircuitOpenError, without a transfer. A background thread reads the id of the power strip every
+     probe_interval seconds and closes the circuit again when that succeeds.
+
+   Use SisPy.set_transfer_policy() or SisPyPool.set_transfer_policy() to use it.
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import random
+import threading
+import time
+
+from SisPy import codec
+
+CLOSED = 'closed'
+OPEN = 'open'
+
+# transfers needed before the timeout adapts
+_MIN_SAMPLES = 8
+
+
+class CircuitOpenError(IOError):
+    """A call failed immediately because the power strip kept failing."""
+    pass
+
+
+class TransferPolicy(object):
+    """Timeouts, retries and circuit breaker for one power strip. See the module documentation.
+
+       Don't share a TransferPolicy between power strips, it keeps the latency and failures of one power strip.
+    """
+    def __init__(self, min_timeout=20, max_timeout=500, percentile=0.99, timeout_factor=4.0, window=64,
+                 retries=2, backoff=0.01, failure_threshold=3, probe_interval=5.0):
+        if not 0 < min_timeout <= max_timeout:
+            raise ValueError("Need 0 < min_timeout <= max_timeout")
+        if not 0 < percentile <= 1:
+            raise ValueError("Need a percentile between 0 and 1")
+        if retries < 0 or failure_threshold < 1:
+            raise ValueError("Need retries >= 0 and failure_threshold >= 1")
+        self._min_timeout = min_timeout
+        self._max_timeout = max_timeout
+        self._percentile = percentile
+        self._timeout_factor = timeout_factor
+        self._retries = retries
+        self._backoff = backoff
+        self._failure_threshold = failure_threshold
+        self._probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._timeout = max_timeout
+        self._failures = 0
+        self._state = CLOSED
+        self._probe_thread = None
+        self._stop = threading.Event()
+        # can be replaced by the tests
+        self._sleep = time.sleep
+        self._random = random.random
+
+    @property
+    def timeout(self):
+        """The timeout used for the next transfer, in ms.
+        """
+        return self._timeout
+
+    @property
+    def state(self):
+        """CLOSED while transfers are tried, OPEN while they fail immediately.
+        """
+        return self._state
+
+    def _observe(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+            self._failures = 0
+            if len(self._latencies) >= _MIN_SAMPLES:
+                ordered = sorted(self._latencies)
+                latency = ordered[min(int(len(ordered) * self._percentile), len(ordered) - 1)]
+                self._timeout = int(min(max(latency * 1000 * self._timeout_factor, self._min_timeout), self._max_timeout))
+
+    def _fail(self, ctrl_transfer):
+        with self._lock:
+            self._failures += 1
+            if self._failures < self._failure_threshold or self._state == OPEN:
+                return
+            self._state = OPEN
+            self._stop.clear()
+            self._probe_thread = threading.Thread(target=self._probe, args=(ctrl_transfer,))
+            self._probe_thread.daemon = True
+            self._probe_thread.start()
+
+    def _probe(self, ctrl_transfer):
+        while not self._stop.wait(self._probe_interval):
+            try:
+                ctrl_transfer(0xa1, 0x01, 0x0300 + codec.report_nr(1), 0, codec.report_length(1) + 1, self._max_timeout)
+            except IOError:
+                continue
+            with self._lock:
+                self._failures = 0
+                self._state = CLOSED
+            return
+
+    def wrap(self, ctrl_transfer):
+        """Wrap the ctrl_transfer function of a USB device. The timeout given to the wrapped function is ignored.
+        """
+        def transfer(request_type, request, value=0, index=0, data_or_length=None, timeout=None):
+            if self._state == OPEN:
+                raise CircuitOpenError("Power strip keeps failing, not trying for now")
+            attempts = 1 + (self._retries if request_type & 0x80 else 0)
+            for attempt in range(attempts):
+                if attempt > 0:
+                    # exponential backoff, with jitter so strips on one hub don't retry in lockstep
+                    self._sleep(self._backoff * (2 ** (attempt - 1)) * (0.5 + self._random()))
+                start = time.perf_counter()
+                try:
+                    result = ctrl_transfer(request_type, request, value, index, data_or_length, self._timeout)
+                except IOError as e:
+                    error = e
+                    if time.perf_counter() - start >= self._timeout / 1000.0:
+                        # timed out, maybe the latency went up: give the next attempts more time
+                        with self._lock:
+                            self._timeout = min(self._timeout * 2, self._max_timeout)
+                    continue
+                self._observe(time.perf_counter() - start)
+                return result
+            self._fail(ctrl_transfer)
+            raise error
+        return transfer
+
+    def close(self):
+        """Stop the background probe.
+        """
+        self._stop.set()
+        if self._probe_thread is not None:
+            self._probe_thread.join()
+            self._probe_thread = None
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -0,0 +1,275 @@
+#! /usr/bin/env python
+"""Work with all the Energenie power strips connected to the computer at once.
+
+   Each power strip gets its own worker thread. Operations on different power strips run in parallel,
+   operations on the same power strip are executed one after the other.
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from SisPy.aio import AsyncSisPy
+from SisPy.lib import _find_devices
+from SisPy.lib import SisPy
+
+
+class ScheduleResult(object):
+    """The result of storing a schedule on a single outlet with SisPyPool.apply_schedules().
+    """
+    __slots__ = ('_key', '_written', '_error', '_time_started', '_seconds')
+
+    def __init__(self, key, written, error, time_started, seconds):
+        self._key = key
+        self._written = written
+        self._error = error
+        self._time_started = time_started
+        self._seconds = seconds
+
+    @property
+    def key(self):
+        """The (strip id, outlet nr) tuple of the outlet.
+        """
+        return self._key
+
+    @property
+    def written(self):
+        """True if the schedule was written, False if it was skipped (the outlet has an equivalent schedule) or failed.
+        """
+        return self._written
+
+    @property
+    def error(self):
+        """The exception raised while writing the schedule, None if it succeeded.
+        """
+        return self._error
+
+    @property
+    def time_started(self):
+        """When writing the schedule started, in seconds since the epoch.
+        """
+        return self._time_started
+
+    @property
+    def seconds(self):
+        """How long writing the schedule took, in seconds.
+        """
+        return self._seconds
+
+
+class SisPyPool(object):
+    """Represent all the connected power strips, indexed by their id.
+
+       A power strip is addressed by its id, an outlet by a (strip id, outlet nr) tuple.
+       E.g. pool[(67305985, 2)].switched_on = True
+
+       Use submit() or map() to run code on the worker thread of a power strip.
+
+       Without devices given, all connected power strips are used. When a power strip fails to open, its exception
+       is raised after all of them were tried, and the USB resources of the ones that did open are released.
+    """
+    def __init__(self, devices=None):
+        found = devices is None
+        if found:
+            devices = self._find_devices()
+        self._strips = {}
+        self._workers = {}
+
+        # opening a power strip reads its id, do this for all of them in parallel
+        futures = []
+        if len(devices) > 0:
+            with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+                futures = [executor.submit(self._open, dev) for dev in devices]
+        strips = []
+        errors = []
+        for future in futures:
+            if future.exception() is None:
+                strips.append(future.result())
+            else:
+                errors.append(future.exception())
+        for strip_id, sispy in strips:
+            if strip_id in self._strips:
+                errors.append(ValueError("Found multiple power strips with id " + str(strip_id)))
+            self._strips[strip_id] = sispy
+        if len(errors) > 0:
+            # nobody can close the power strips that did open
+            self._strips = {}
+            if found:
+                for strip_id, sispy in strips:
+                    self._dispose_device(sispy._dev)
+            raise errors[0]
+
+        for strip_id in self._strips:
+            self._workers[strip_id] = ThreadPoolExecutor(max_workers=1)
+
+    def _find_devices(self):  # pragma: no cover
+        return _find_devices()
+
+    def _dispose_device(self, dev):  # pragma: no cover
+        import usb.util
+        usb.util.dispose_resources(dev)
+
+    def _create_sispy(self, dev):
+        return SisPy(dev)
+
+    def _open(self, dev):
+        sispy = self._create_sispy(dev)
+        # read when the SisPy object was created
+        return (sispy._ensure_id(), sispy)
+
+    def _resolve(self, key):
+        if isinstance(key, tuple):
+            strip_id, outlet_nr = key
+            return (strip_id, self._strips[strip_id].outlets[outlet_nr])
+        return (key, self._strips[key])
+
+    @property
+    def ids(self):
+        """Sorted list with the ids of all the power strips in the pool.
+        """
+        return sorted(self._strips.keys())
+
+    @property
+    def strips(self):
+        """Dictionary of the SisPy objects in the pool, indexed by their id.
+        """
+        return dict(self._strips)
+
+    def outlet(self, strip_id, outlet_nr):
+        """The Outlet object of outlet outlet_nr on the power strip with id strip_id.
+        """
+        return self._strips[strip_id].outlets[outlet_nr]
+
+    def submit(self, key, func, *args, **kwargs):
+        """Schedule func to be executed on the worker thread of a power strip.
+
+           key is either a power strip id, in which case func is called with the SisPy object as first argument,
+           or a (strip id, outlet nr) tuple, in which case func is called with the Outlet object as first argument.
+
+           Returns a concurrent.futures.Future with the result of func.
+        """
+        strip_id, target = self._resolve(key)
+        return self._workers[strip_id].submit(func, target, *args, **kwargs)
+
+    def map(self, func, keys=None, *args, **kwargs):
+        """Execute func on all given keys (by default all power strips) in parallel and wait for the results.
+
+           See submit() for the meaning of the keys.
+
+           Returns a dictionary with the result for each key.
+           If func raised an exception for one of the keys, that exception is raised again.
+        """
+        if keys is None:
+            keys = self.ids
+        futures = [(key, self.submit(key, func, *args, **kwargs)) for key in keys]
+        return dict((key, future.result()) for key, future in futures)
+
+    def apply_schedules(self, schedules, force=False, activation_time=None):
+        """Store schedules on many outlets at once.
+
+           schedules is a dictionary with an OutletSchedule for each (strip id, outlet nr) tuple.
+           A schedule can be one of another outlet and the same schedule can be given for several outlets.
+           All schedules get the same activation time (a time UTC tuple, by default now), each distinct schedule is
+           constructed once. The power strips are written in parallel. Like OutletSchedule.apply(), writing an outlet
+           is skipped if it already has an equivalent schedule, unless force is True. The skipped outlets are found
+           before constructing. A periodic schedule that is running already keeps its phase: it's stored starting with
+           its first entry that starts at or after the activation time. The schedules themselves aren't changed.
+
+           Unknown outlets and schedules to write that can't be constructed (e.g. a non-periodic schedule that started
+           already) raise an exception before anything is written.
+           Returns a dictionary with a ScheduleResult for each (strip id, outlet nr) tuple. A failed write doesn't stop
+           the other writes, the exception is given in the result.
+        """
+        if activation_time is None:
+            activation_time = time.gmtime()
+        constructed = {}
+        per_strip = {}
+        results = {}
+        for key, schedule in schedules.items():
+            if not isinstance(key, tuple):
+                raise TypeError("Schedules are stored on outlets, use a (strip id, outlet nr) tuple instead of a " + key.__class__.__name__)
+            strip_id, outlet = self._resolve(key)
+            if force is False and outlet._can_skip_store(schedule):
+                results[key] = ScheduleResult(key, False, None, time.time(), 0.0)
+                continue
+            if id(schedule) not in constructed:
+                constructed[id(schedule)] = schedule._construct_data(activation_time)
+            per_strip.setdefault(strip_id, []).append((key, outlet, schedule, constructed[id(schedule)]))
+
+        futures = [self._workers[strip_id].submit(self._apply_schedules, items, force) for strip_id, items in per_strip.items()]
+        for future in futures:
+            for result in future.result():
+                results[result.key] = result
+        return results
+
+    def _apply_schedules(self, items, force):
+        results = []
+        for key, outlet, schedule, data in items:
+            time_started = time.time()
+            start = time.perf_counter()
+            error = None
+            try:
+                written = outlet._store_schedule(schedule, data, force)
+            except Exception as e:
+                written = False
+                error = e
+            results.append(ScheduleResult(key, written, error, time_started, time.perf_counter() - start))
+        return results
+
+    def set_transfer_policy(self, **options):
+        """Give every power strip its own SisPy.policy.TransferPolicy with the given options.
+
+           A power strip that keeps failing then fails immediately, instead of slowing down the operations on all
+           power strips.
+        """
+        from SisPy.policy import TransferPolicy
+        for sispy in self._strips.values():
+            sispy.set_transfer_policy(TransferPolicy(**options))
+
+    def async_strips(self):
+        """Dictionary of AsyncSisPy objects for the power strips in the pool, indexed by their id.
+
+           These share the worker threads of the pool.
+        """
+        return dict((strip_id, AsyncSisPy(sispy, self._workers[strip_id])) for strip_id, sispy in self._strips.items())
+
+    def close(self):
+        """Stop the worker threads after they finished the outstanding work.
+        """
+        for worker in self._workers.values():
+            worker.shutdown(wait=True)
+        for sispy in self._strips.values():
+            if sispy._policy is not None:
+                sispy._policy.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getitem__(self, key):
+        return self._resolve(key)[1]
+
+    def __contains__(self, strip_id):
+        return strip_id in self._strips
+
+    def __len__(self):
+        return len(self._strips)
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
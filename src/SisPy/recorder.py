@@ -0,0 +1,301 @@
+#! /usr/bin/env python
+"""Record the state history of the outlets of a power strip in a compact file.
+
+   The file is a ring of fixed-width binary records after a small header, accessed through mmap. A record is a run
+   of samples in which nothing changed: the first and last time, the number of samples and the state of every
+   outlet at the first sample. Sampling every minute with the hardware schedules switching a few times a day
+   takes a few records a day. When the ring is full, the oldest records are overwritten.
+
+   The minutes to the next schedule entry count down while nothing else changes. They are stored as they were at
+   the first sample of a run, so the countdown doesn't start a new record. Neither does the minute the next entry
+   starts being one off, as the power strip counts its minutes on its own.
+
+   E.g.
+   with StateRecorder('strip.rec', strip_id=sispy.id) as recorder:
+       recorder.record(sispy.snapshot())
+
+   with StateRecorder('strip.rec', readonly=True) as recorder:
+       for run in recorder.runs(start, end):
+           print(run.time_first, run.time_last, [outlet.switched_on for outlet in run.outlets])
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import mmap
+import os
+import struct
+
+from SisPy import codec
+from SisPy.lib import OutletSnapshot
+
+MAGIC = b'SPRR'
+VERSION = 1
+
+# about 1.8MB for 4 outlets
+DEFAULT_CAPACITY = 65536
+# seconds between samples after which a new record is started, so the gap shows
+DEFAULT_MAX_GAP = 180
+
+# magic, version, nr of outlets, strip id, capacity in records, next record slot, nr of records
+HEADER = struct.Struct('<4sHHLLLL')
+# time of the first and last sample, nr of samples
+RECORD_RUN = struct.Struct('<LLL')
+# per outlet: status, current schedule entry flags, current schedule entry value (at the first sample)
+RECORD_OUTLET = 'BBH'
+
+
+def _record_struct(nr_outlets):
+    return struct.Struct(RECORD_RUN.format + RECORD_OUTLET * nr_outlets)
+
+
+def _counting_down(flags, value):
+    # the minutes count down, except when done or when the power strip lost track of time
+    if flags & 0x80 == 0x80:
+        return False
+    if flags & 0x7f == 0x10:
+        return value != 0
+    return value & codec.ENTRY_MINUTES != 0
+
+
+def _minutes(flags, value):
+    if flags & 0x7f == 0x10:
+        return value
+    return value & codec.ENTRY_MINUTES
+
+
+def _run_key(outlets, minute):
+    """What has to stay the same for a sample to be added to a run: the outlets without the minutes to the next
+       schedule entry, and the minutes the next schedule entries start (None when not counting down)."""
+    key = []
+    minutes_next = []
+    for status, flags, value in outlets:
+        if _counting_down(flags, value):
+            key.append((status, flags, value - _minutes(flags, value)))
+            minutes_next.append(minute + _minutes(flags, value))
+        else:
+            key.append((status, flags, value))
+            minutes_next.append(None)
+    return (tuple(key), tuple(minutes_next))
+
+
+def _same_run(key, run_key):
+    """Whether a sample with the given key belongs to the run with run_key, the key of its first sample.
+
+       The power strip counts its minutes from the start of the schedule, not with the minutes of the clock of the
+       computer: sampling a few seconds earlier or later can make the minute the next schedule entry starts one off.
+    """
+    if key[0] != run_key[0]:
+        return False
+    for minute, run_minute in zip(key[1], run_key[1]):
+        if minute is None or run_minute is None:
+            if minute is not run_minute:
+                return False
+        elif abs(minute - run_minute) > 1:
+            return False
+    return True
+
+
+def _outlet_at(nr, status, flags, value, elapsed_minutes):
+    if _counting_down(flags, value):
+        value -= min(elapsed_minutes, _minutes(flags, value))
+    return OutletSnapshot(nr, bytearray([status]), codec.CURRENT_SCHEDULE_ENTRY.pack(flags, value))
+
+
+class RecordedRun(object):
+    """Samples of a power strip in which nothing changed. Nothing can be set.
+    """
+    __slots__ = ('_time_first', '_time_last', '_nr_samples', '_outlets')
+
+    def __init__(self, time_first, time_last, nr_samples, outlets):
+        self._time_first = time_first
+        self._time_last = time_last
+        self._nr_samples = nr_samples
+        self._outlets = outlets
+
+    @property
+    def time_first(self):
+        """Time of the first sample, in seconds since the epoch.
+        """
+        return self._time_first
+
+    @property
+    def time_last(self):
+        """Time of the last sample, in seconds since the epoch.
+        """
+        return self._time_last
+
+    @property
+    def nr_samples(self):
+        """Number of samples in the run.
+        """
+        return self._nr_samples
+
+    @property
+    def outlets(self):
+        """Tuple of OutletSnapshot objects with the state at the first sample.
+        """
+        return self.outlets_at(self._time_first)
+
+    def outlets_at(self, epoch):
+        """Tuple of OutletSnapshot objects with the state at the given time (between the first and the last sample).
+           Only the minutes to the next schedule entry differ from outlets.
+        """
+        elapsed_minutes = epoch // 60 - self._time_first // 60
+        return tuple(_outlet_at(nr, status, flags, value, elapsed_minutes) for nr, (status, flags, value) in enumerate(self._outlets))
+
+    def __repr__(self):
+        return "RecordedRun(" + str(self._time_first) + ", " + str(self._time_last) + ", " + str(self._nr_samples) + ")"
+
+
+class StateRecorder(object):
+    """Append snapshots of a power strip to a ring file and read back time ranges of it.
+
+       An existing file is opened as is, otherwise a file for capacity records is created, which needs the strip id.
+       With readonly, the file can be read while another process records in it.
+    """
+    def __init__(self, path, strip_id=None, nr_outlets=4, capacity=DEFAULT_CAPACITY, max_gap=DEFAULT_MAX_GAP, readonly=False):
+        self._max_gap = max_gap
+        self._readonly = readonly
+        if readonly is False and not os.path.exists(path):
+            if strip_id is None:
+                raise ValueError("Need the strip id to create " + path)
+            if capacity < 1:
+                raise ValueError("Need a capacity of at least 1 record")
+            size = HEADER.size + capacity * _record_struct(nr_outlets).size
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, nr_outlets, strip_id, capacity, 0, 0))
+                f.truncate(size)
+
+        self._file = open(path, 'rb' if readonly else 'r+b')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+            magic, version, self._nr_outlets, self._strip_id, self._capacity = HEADER.unpack_from(self._map)[:5]
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(path + " is not a state recording")
+            if strip_id is not None and strip_id != self._strip_id:
+                raise ValueError(path + " is the recording of power strip " + str(self._strip_id))
+            self._record = _record_struct(self._nr_outlets)
+            if len(self._map) != HEADER.size + self._capacity * self._record.size:
+                raise ValueError(path + " is truncated")
+        except Exception:
+            self.close()
+            raise
+        self._last_key = None
+
+    @property
+    def strip_id(self):
+        """The internal identifier of the recorded power strip.
+        """
+        return self._strip_id
+
+    @property
+    def capacity(self):
+        """The number of records the file can keep.
+        """
+        return self._capacity
+
+    def __len__(self):
+        """The number of records in the file.
+        """
+        return HEADER.unpack_from(self._map)[6]
+
+    def _offset(self, index):
+        """Offset of the record with the given index, 0 being the oldest record."""
+        head, count = HEADER.unpack_from(self._map)[5:]
+        return HEADER.size + ((head - count + index) % self._capacity) * self._record.size
+
+    def _read(self, index):
+        values = self._record.unpack_from(self._map, self._offset(index))
+        outlets = tuple(values[i:i + 3] for i in range(3, len(values), 3))
+        return (values[0], values[1], values[2], outlets)
+
+    def record(self, snapshot):
+        """Add a SisPySnapshot of the power strip.
+
+           Returns True if a new record was started, False if the snapshot was added to the last record.
+        """
+        if snapshot.strip_id != self._strip_id:
+            raise ValueError("The snapshot is of power strip " + str(snapshot.strip_id) + ", not " + str(self._strip_id))
+        epoch = int(snapshot._epoch_taken)
+        outlets = tuple((int(outlet._switched_on) | int(outlet._voltage_present) << 1,
+                         outlet._current_schedule_entry._flags, outlet._current_schedule_entry._value) for outlet in snapshot.outlets)
+        key = _run_key(outlets, epoch // 60)
+
+        count = len(self)
+        if count > 0:
+            time_first, time_last, nr_samples, last_outlets = self._read(count - 1)
+            if self._last_key is None:
+                self._last_key = _run_key(last_outlets, time_first // 60)
+            if _same_run(key, self._last_key) and 0 <= epoch - time_last <= self._max_gap and nr_samples < 0xFFFFFFFF:
+                RECORD_RUN.pack_into(self._map, self._offset(count - 1), time_first, epoch, nr_samples + 1)
+                return False
+
+        # write the record before making it part of the ring
+        head = HEADER.unpack_from(self._map)[5]
+        offset = HEADER.size + head * self._record.size
+        self._record.pack_into(self._map, offset, epoch, epoch, 1, *[v for outlet in outlets for v in outlet])
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, self._nr_outlets, self._strip_id, self._capacity,
+                         (head + 1) % self._capacity, min(count + 1, self._capacity))
+        self._last_key = key
+        return True
+
+    def _first_index(self, start):
+        """Index of the first record with samples at or after start."""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if RECORD_RUN.unpack_from(self._map, self._offset(middle))[1] < start:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def runs(self, start=None, end=None):
+        """Iterate over the RecordedRun objects with samples between start and end (seconds since the epoch,
+           both included, None for no limit), oldest first.
+
+           Only the records in the range are read.
+        """
+        index = 0 if start is None else self._first_index(start)
+        count = len(self)
+        while index < count:
+            time_first, time_last, nr_samples, outlets = self._read(index)
+            if end is not None and time_first > end:
+                return
+            yield RecordedRun(time_first, time_last, nr_samples, outlets)
+            index += 1
+
+    def flush(self):
+        """Write the changes to disk.
+        """
+        if self._readonly is False:
+            self._map.flush()
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self.flush()
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -0,0 +1,252 @@
+#! /usr/bin/env python
+"""Keep track of the power strips while they are unplugged and plugged in again.
+
+   A DeviceRegistry knows the power strips by their id. The SisPy objects it hands out don't hold the USB device
+   directly, but a handle that the registry points to the current USB device of the power strip. When a power
+   strip comes back after it was unplugged or its bus was reset, the handle is pointed to the new USB device and
+   the existing SisPy and Outlet objects keep working.
+
+   Arrival and removal are found by enumerating the USB devices again: scan(), or start() to do that in a
+   background thread. Only USB devices at a new (bus, port path, address) are opened to read their id, the known
+   ones cost nothing. A transfer that fails because the USB device is gone scans once and is retried on the new USB
+   device. A power strip that isn't connected fails with DisconnectedError, scanning at most once every
+   rescan_interval seconds, so polling a missing power strip doesn't keep enumerating the USB devices.
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+from SisPy.lib import _find_devices
+from SisPy.lib import SisPy
+
+
+class DisconnectedError(IOError):
+    """A transfer failed immediately because the power strip isn't connected."""
+    pass
+
+
+def _token(dev):
+    """What identifies a USB device as long as it stays plugged in: its bus and port path, and the address it got
+       there. A USB device at the address of a known one, but at another port, is new."""
+    return _location(dev) + (getattr(dev, 'address', id(dev)),)
+
+
+def _location(dev):
+    """The bus and port path of a USB device, which stays the same when it's plugged in the same port again."""
+    port_numbers = getattr(dev, 'port_numbers', None)
+    return (getattr(dev, 'bus', None), tuple(port_numbers) if port_numbers is not None else None)
+
+
+class _DeviceHandle(object):
+    """Stands in for the USB device of a power strip in its SisPy object."""
+    __slots__ = ('_registry', '_strip_id', 'dev', '_rescanned')
+
+    def __init__(self, registry, strip_id, dev):
+        self._registry = registry
+        self._strip_id = strip_id
+        self.dev = dev
+        # monotonic time of the last scan after a failed transfer, None if there wasn't any
+        self._rescanned = None
+
+    def ctrl_transfer(self, *args, **kwargs):
+        dev = self.dev
+        error = None
+        if dev is not None:
+            try:
+                return dev.ctrl_transfer(*args, **kwargs)
+            except IOError as e:
+                error = e
+        new_dev = self._registry._reconnect(self._strip_id, dev)
+        if new_dev is None:
+            if error is not None:
+                raise error
+            raise DisconnectedError("Power strip " + str(self._strip_id) + " is not connected")
+        return new_dev.ctrl_transfer(*args, **kwargs)
+
+
+class DeviceRegistry(object):
+    """All the power strips seen since the registry was created, indexed by their id.
+
+       find_devices is the function listing the USB devices, by default all connected Energenie devices.
+       listeners are called with (strip id, connected) when a power strip arrives or is removed.
+       A failed transfer scans for its power strip at most once every rescan_interval seconds.
+    """
+    def __init__(self, find_devices=None, rescan_interval=1.0):
+        self._find_devices = _find_devices if find_devices is None else find_devices
+        self._rescan_interval = rescan_interval
+        self._lock = threading.RLock()
+        self._strips = {}
+        self._handles = {}
+        self._locations = {}
+        # token of the USB device -> strip id, for the connected power strips
+        self._tokens = {}
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def ids(self):
+        """Sorted list with the ids of all the power strips seen, connected or not.
+        """
+        with self._lock:
+            return sorted(self._strips.keys())
+
+    @property
+    def strips(self):
+        """Dictionary of the SisPy objects of all the power strips seen, indexed by their id.
+        """
+        with self._lock:
+            return dict(self._strips)
+
+    def connected(self, strip_id):
+        """Whether the power strip with the given id is connected.
+        """
+        with self._lock:
+            return self._handles[strip_id].dev is not None
+
+    def location(self, strip_id):
+        """The (bus, port numbers) where the power strip was seen last.
+        """
+        with self._lock:
+            return self._locations[strip_id]
+
+    def add_listener(self, callback):
+        """Call callback(strip id, connected) when a power strip arrives or is removed.
+        """
+        self._listeners.append(callback)
+
+    def _get_monotonic_time(self):  # pragma: no cover
+        return time.monotonic()
+
+    def scan(self):
+        """Enumerate the USB devices and update the power strips.
+
+           The USB devices are enumerated and the new ones opened without holding up the transfers with the power
+           strips that are connected.
+
+           Returns a tuple with the list of ids of the power strips that arrived and the list of the ones removed.
+        """
+        devs = [(_token(dev), dev) for dev in self._find_devices()]
+        with self._lock:
+            new_devs = [(token, dev) for token, dev in devs if token not in self._tokens]
+        new_ids = {}
+        for token, dev in new_devs:
+            try:
+                new_ids[token] = SisPy(dev, lazy=True).id
+            except IOError:
+                # gone again or not answering, try again in the next scan
+                pass
+
+        events = []
+        with self._lock:
+            seen = set()
+            for token, dev in devs:
+                strip_id = self._tokens.get(token)
+                if strip_id is None:
+                    strip_id = new_ids.get(token)
+                    if strip_id is None:
+                        continue
+                    self._attach(strip_id, dev, token)
+                    events.append((strip_id, True))
+                seen.add(strip_id)
+            for token, strip_id in list(self._tokens.items()):
+                if strip_id not in seen:
+                    del self._tokens[token]
+                    self._handles[strip_id].dev = None
+                    events.append((strip_id, False))
+        for strip_id, connected in events:
+            for listener in self._listeners:
+                listener(strip_id, connected)
+        return ([i for i, connected in events if connected], [i for i, connected in events if not connected])
+
+    def _attach(self, strip_id, dev, token):
+        self._locations[strip_id] = _location(dev)
+        if strip_id in self._handles:
+            handle = self._handles[strip_id]
+            # a power strip can only be at one place
+            for old_token, old_id in list(self._tokens.items()):
+                if old_id == strip_id:
+                    del self._tokens[old_token]
+            handle.dev = dev
+        else:
+            handle = _DeviceHandle(self, strip_id, dev)
+            sispy = SisPy(handle, lazy=True)
+            # the id was read already
+            sispy._id = strip_id
+            self._handles[strip_id] = handle
+            self._strips[strip_id] = sispy
+        self._tokens[token] = strip_id
+
+    def _reconnect(self, strip_id, dev):
+        """The USB device to use after a transfer with dev (None if it wasn't connected) failed, None if the power
+           strip isn't connected."""
+        with self._lock:
+            handle = self._handles[strip_id]
+            if handle.dev is not dev:
+                # another thread reconnected already
+                return handle.dev
+            now = self._get_monotonic_time()
+            if handle._rescanned is not None and now - handle._rescanned < self._rescan_interval:
+                return None
+            handle._rescanned = now
+        self.scan()
+        with self._lock:
+            if handle.dev is dev:
+                # still there (then it's not a reconnection problem) or still gone
+                return None
+            return handle.dev
+
+    def start(self, interval=5.0):
+        """Scan every interval seconds in a background thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except Exception:
+                # enumerating can fail while a bus resets, the next scan will tell
+                pass
+            self._stop.wait(interval)
+
+    def stop(self):
+        """Stop the background scans.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __getitem__(self, strip_id):
+        with self._lock:
+            return self._strips[strip_id]
+
+    def __contains__(self, strip_id):
+        with self._lock:
+            return strip_id in self._strips
+
+    def __len__(self):
+        with self._lock:
+            return len(self._strips)
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
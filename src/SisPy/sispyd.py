@@ -0,0 +1,416 @@
+#! /usr/bin/env python
+"""Broker daemon that owns the Energenie power strips and shares them with other processes.
+
+   Only one process can claim the USB interface of a power strip. sispyd opens all of them once and serves
+   requests over a Unix domain socket. SisPyClient is a drop-in replacement for SisPy that talks to sispyd.
+
+   Start the daemon with: python -m SisPy.sispyd [socket path]
+
+   Protocol: every request is a header (request id, opcode, strip id, payload length) followed by the payload.
+   Every response is a header (request id, status, payload length) followed by the payload.
+   A client can send several requests without waiting for the responses (pipelining). Requests for different
+   power strips can be answered out of order, the request id links a response to its request.
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+from concurrent.futures import Future
+
+from SisPy import codec
+from SisPy.lib import SisPy
+
+DEFAULT_SOCKET_PATH = '/tmp/sispyd.sock'
+# only the user running sispyd can connect
+DEFAULT_SOCKET_MODE = 0o600
+
+# request id, opcode, strip id, payload length
+_REQUEST = struct.Struct('<HBLH')
+# request id, status, payload length
+_RESPONSE = struct.Struct('<HBH')
+
+# payload: none. response: the ids of all power strips ('<L' each)
+_OP_LIST = 0
+# payload: command, outlet nr (0xFF for none). response: the data of the report
+_OP_READ = 1
+# payload: command, outlet nr, data. response: the number of bytes written ('<H')
+_OP_WRITE = 2
+# payload: (report nr, length) pairs. response: the data of all reports, concatenated
+_OP_READ_REPORTS = 3
+
+_STATUS_OK = 0
+_STATUS_ERROR = 1
+
+_NO_OUTLET = 0xFF
+
+# the reports a client can read and write
+_READ_COMMANDS = (SisPy._ID, SisPy._BUZZER, SisPy._OUTLET_STATUS, SisPy._OUTLET_SCHEDULE, SisPy._OUTLET_CURRENT_SCHEDULE_ENTRY)
+_WRITE_COMMANDS = (SisPy._OUTLET_STATUS, SisPy._OUTLET_SCHEDULE)
+
+
+def _check_report(sispy, command, outlet_nr, commands):
+    """The outlet nr (None for the reports of the power strip itself) of a report a client asked for.
+       Raises ValueError unless the command is one of commands, for an outlet the power strip has."""
+    if command not in commands:
+        raise ValueError("Unsupported command " + str(command))
+    if command in (SisPy._ID, SisPy._BUZZER):
+        if outlet_nr != _NO_OUTLET:
+            raise ValueError("Command " + str(command) + " is not for an outlet")
+        return None
+    if outlet_nr >= sispy.nr_outlets:
+        raise ValueError("Power strip " + str(sispy._id) + " has no outlet " + str(outlet_nr))
+    return outlet_nr
+
+
+def _error_payload(e):
+    """The message of the exception, encoded in UTF-8 and cut at a character to fit in a response."""
+    payload = (e.__class__.__name__ + ": " + str(e)).encode('utf-8')
+    if len(payload) > 0xFFFF:
+        payload = payload[:0xFFFF].decode('utf-8', 'ignore').encode('utf-8')
+    return payload
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        write_lock = threading.Lock()
+        while True:
+            header = self.rfile.read(_REQUEST.size)
+            if len(header) < _REQUEST.size:
+                return
+            request_id, opcode, strip_id, length = _REQUEST.unpack(header)
+            payload = self.rfile.read(length)
+            future = self.server.broker._dispatch(opcode, strip_id, payload)
+            future.add_done_callback(functools.partial(self._respond, write_lock, request_id))
+
+    def _respond(self, write_lock, request_id, future):
+        try:
+            payload = bytes(future.result())
+            status = _STATUS_OK
+        except Exception as e:
+            payload = _error_payload(e)
+            status = _STATUS_ERROR
+        with write_lock:
+            try:
+                self.wfile.write(_RESPONSE.pack(request_id, status, len(payload)) + payload)
+                self.wfile.flush()
+            except (OSError, ValueError):
+                # the client went away
+                pass
+
+
+class _BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _remove_stale_socket(path):
+    """Remove the socket at path if nothing listens on it anymore."""
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise IOError(path + " exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        # stale, the broker that made it stopped
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise IOError("sispyd is running on " + path + " already")
+
+
+class SisPyBroker(object):
+    """Serve the power strips of a SisPyPool over a Unix domain socket.
+
+       Requests for a power strip are executed on the worker thread of that power strip in the pool,
+       so different clients never interleave their USB transfers.
+
+       The socket gets the given permissions. If another broker answers on the path, IOError is raised. A socket
+       left behind by a broker that stopped is replaced, anything else at the path is left alone with an IOError.
+    """
+    def __init__(self, pool, path=DEFAULT_SOCKET_PATH, mode=DEFAULT_SOCKET_MODE):
+        self._pool = pool
+        self._path = path
+        _remove_stale_socket(path)
+        self._server = _BrokerServer(path, _BrokerHandler)
+        try:
+            os.chmod(path, mode)
+        except OSError:
+            self._server.server_close()
+            os.unlink(path)
+            raise
+        self._server.broker = self
+        self._serving = False
+        self._thread = None
+
+    @property
+    def path(self):
+        """The path of the Unix domain socket.
+        """
+        return self._path
+
+    def _dispatch(self, opcode, strip_id, payload):
+        if opcode == _OP_LIST:
+            future = Future()
+            future.set_result(b''.join(struct.pack('<L', i) for i in self._pool.ids))
+            return future
+        if strip_id not in self._pool:
+            future = Future()
+            future.set_exception(KeyError("Unknown power strip " + str(strip_id)))
+            return future
+        return self._pool.submit(strip_id, self._execute, opcode, bytearray(payload))
+
+    def _execute(self, sispy, opcode, payload):
+        # only what the clients of SisPyClient ask for is passed on to the power strip
+        if opcode == _OP_READ:
+            if len(payload) != 2:
+                raise ValueError("A read needs a command and an outlet nr")
+            command = payload[0]
+            outlet_nr = _check_report(sispy, command, payload[1], _READ_COMMANDS)
+            if command == SisPy._ID:
+                # known since the power strip was opened
+                return struct.pack('<L', sispy._id)
+            return sispy._usb_read(command, outlet_nr)
+        if opcode == _OP_WRITE:
+            if len(payload) < 2:
+                raise ValueError("A write needs a command and an outlet nr")
+            command = payload[0]
+            outlet_nr = _check_report(sispy, command, payload[1], _WRITE_COMMANDS)
+            if len(payload) - 2 != codec.REPORT_LENGTHS[command]:
+                raise ValueError("Command " + str(command) + " needs " + str(codec.REPORT_LENGTHS[command]) + " bytes of data")
+            return struct.pack('<H', sispy._usb_write(command, outlet_nr, payload[2:]))
+        if opcode == _OP_READ_REPORTS:
+            if len(payload) % 2 != 0:
+                raise ValueError("Reports are read by (report nr, length) pairs")
+            reports = [(payload[i], payload[i + 1]) for i in range(0, len(payload), 2)]
+            for report_nr, length in reports:
+                # the buzzer and the reports of the outlets
+                if not SisPy._BUZZER <= report_nr < SisPy._OUTLET_STATUS + 3 * sispy.nr_outlets:
+                    raise ValueError("Unsupported report " + str(report_nr))
+                if length != codec.report_length(report_nr) + 1:
+                    raise ValueError("Report " + str(report_nr) + " has " + str(codec.report_length(report_nr) + 1) + " bytes")
+            return b''.join(bytes(data) for data in sispy._usb_read_reports(reports))
+        raise ValueError("Unknown opcode " + str(opcode))
+
+    def serve_forever(self):
+        """Handle requests until close() is called.
+        """
+        self._serving = True
+        self._server.serve_forever(poll_interval=0.1)
+
+    def start(self):
+        """Handle requests in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """Stop handling requests and remove the socket.
+        """
+        if self._serving is True:
+            self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+
+class BrokerConnection(object):
+    """A connection to sispyd.
+
+       Can be shared between threads. Use submit() to send several requests before waiting for their result().
+    """
+    def __init__(self, path=DEFAULT_SOCKET_PATH):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._rfile = self._sock.makefile('rb')
+        self._send_lock = threading.Lock()
+        self._receive_lock = threading.Lock()
+        self._next_request_id = 0
+        self._responses = {}
+
+    def submit(self, opcode, strip_id, payload=b''):
+        """Send a request without waiting for the response.
+
+           Returns the request id to get the result() with.
+        """
+        with self._send_lock:
+            request_id = self._next_request_id
+            self._next_request_id = (request_id + 1) & 0xFFFF
+            self._sock.sendall(_REQUEST.pack(request_id, opcode, strip_id, len(payload)) + bytes(payload))
+        return request_id
+
+    def result(self, request_id):
+        """Wait for the response on the given request.
+
+           Returns the payload of the response as a bytearray. Raises IOError if the daemon reported an error.
+        """
+        with self._receive_lock:
+            while request_id not in self._responses:
+                header = self._rfile.read(_RESPONSE.size)
+                if len(header) < _RESPONSE.size:
+                    raise IOError("Connection to sispyd closed")
+                response_id, status, length = _RESPONSE.unpack(header)
+                self._responses[response_id] = (status, self._rfile.read(length))
+            status, payload = self._responses.pop(request_id)
+        if status != _STATUS_OK:
+            raise IOError(payload.decode('utf-8', 'replace'))
+        return bytearray(payload)
+
+    def call(self, opcode, strip_id, payload=b''):
+        """Send a request and wait for its result.
+        """
+        return self.result(self.submit(opcode, strip_id, payload))
+
+    def strip_ids(self):
+        """List with the ids of all the power strips served by the daemon.
+        """
+        data = self.call(_OP_LIST, 0)
+        return [struct.unpack_from('<L', data, i)[0] for i in range(0, len(data), 4)]
+
+    def close(self):
+        """Close the connection.
+        """
+        self._rfile.close()
+        self._sock.close()
+
+
+def _command(report_nr):
+    """The (command, outlet nr) of a report nr, the reverse of SisPy.codec.report_nr()."""
+    if report_nr < SisPy._OUTLET_STATUS:
+        return (report_nr, None)
+    return (SisPy._OUTLET_STATUS + (report_nr - SisPy._OUTLET_STATUS) % 3, (report_nr - SisPy._OUTLET_STATUS) // 3)
+
+
+class _BrokerDevice(object):
+    """Stands in for the USB device of a power strip in a SisPyClient: every transfer is a request to sispyd."""
+    __slots__ = ('_connection', '_strip_id')
+
+    def __init__(self, connection, strip_id):
+        self._connection = connection
+        self._strip_id = strip_id
+
+    def ctrl_transfer(self, request_type, request, value=0, index=0, data_or_length=None, timeout=None):
+        # sispyd uses its own timeouts
+        report_nr = value & 0xFF
+        command, outlet_nr = _command(report_nr)
+        if request_type & 0x80:
+            data = self._connection.call(_OP_READ, self._strip_id, bytearray([command, _NO_OUTLET if outlet_nr is None else outlet_nr]))
+            return bytearray([report_nr]) + data
+        result = self._connection.call(_OP_WRITE, self._strip_id, bytearray([command, outlet_nr]) + data_or_length[1:])
+        # with the report nr, like the USB device
+        return struct.unpack('<H', result)[0] + 1
+
+
+class SisPyClient(SisPy):
+    """Represent a power supply served by sispyd. This can be used in the same way as SisPy.
+
+       Its transfers are requests to sispyd, which does the USB transfers with the settings of its own SisPyPool.
+       enable_metrics(), set_transfer_policy() and enable_io_worker() apply to these requests, e.g. the metrics
+       record the time a request takes. snapshot() is a single request, which isn't recorded in the metrics, retried
+       or queued.
+
+       Without a strip id, the first power strip of the daemon is used.
+       With lazy=True, connecting to sispyd, reading the id and creating the outlets is postponed until they are needed.
+    """
+    def __init__(self, strip_id=None, path=DEFAULT_SOCKET_PATH, connection=None, lazy=False):
+        self._path = path
+        self._strip_id = strip_id
+        self._connection = connection
+        # the device is a _BrokerDevice, made on the first transfer
+        SisPy.__init__(self, None, lazy=True)
+        if lazy is False:
+            try:
+                self._ensure_id()
+                self.outlets
+            except Exception:
+                if connection is None:
+                    self.close()
+                raise
+
+    def _broker(self):
+        """The connection to sispyd and the id of the power strip, connecting on first use."""
+        if self._connection is None:
+            with self._lock:
+                if self._connection is None:
+                    self._connection = BrokerConnection(self._path)
+        if self._strip_id is None:
+            ids = self._connection.strip_ids()
+            if len(ids) == 0:
+                raise IOError("sispyd doesn't serve any power strip")
+            self._strip_id = ids[0]
+        return (self._connection, self._strip_id)
+
+    def _get_device(self):
+        return _BrokerDevice(*self._broker())
+
+    def _usb_read_reports(self, reports):
+        payload = bytearray()
+        for report_nr, length in reports:
+            payload += bytearray([report_nr, length])
+        connection, strip_id = self._broker()
+        data = memoryview(connection.call(_OP_READ_REPORTS, strip_id, payload))
+        result = []
+        offset = 0
+        for report_nr, length in reports:
+            result.append(data[offset:offset + length - 1])
+            offset += length - 1
+        return result
+
+    def close(self):
+        """Close the connection to the daemon.
+        """
+        if self._connection is not None:
+            self._connection.close()
+
+
+def main(argv=None):  # pragma: no cover
+    from SisPy.pool import SisPyPool
+
+    if argv is None:
+        argv = sys.argv[1:]
+    path = argv[0] if len(argv) > 0 else DEFAULT_SOCKET_PATH
+    with SisPyPool() as pool:
+        if len(pool) == 0:
+            print("No Energenie products found")
+            return 1
+        broker = SisPyBroker(pool, path)
+        print("Serving power strips " + ", ".join(str(i) for i in pool.ids) + " on " + path)
+        try:
+            broker.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        broker.close()
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+"""Watch the outlets of an Energenie power strip for changes.
+
+   The power strip can't notify changes, so it has to be polled. A Watcher polls slowly while nothing is expected
+   and fast around the moments the hardware schedules switch, as told by the current schedule entries.
+   Only changes are reported, as OutletEvent objects.
+
+   Use SisPy.watch() for a background thread calling a function for every event, or AsyncSisPy.watch() for an
+   asynchronous iterator over the events.
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+# the kinds of events
+SWITCHED_ON = 'switched_on'
+SWITCHED_OFF = 'switched_off'
+VOLTAGE_LOST = 'voltage_lost'
+VOLTAGE_RESTORED = 'voltage_restored'
+TIMING_ERROR = 'timing_error'
+SEQUENCE_DONE = 'sequence_done'
+
+
+class OutletEvent(object):
+    """A change of the state of an outlet. Nothing can be set.
+    """
+    __slots__ = ('_strip_id', '_outlet_nr', '_kind', '_time_detected')
+
+    def __init__(self, strip_id, outlet_nr, kind, time_detected):
+        self._strip_id = strip_id
+        self._outlet_nr = outlet_nr
+        self._kind = kind
+        self._time_detected = time_detected
+
+    @property
+    def strip_id(self):
+        """The internal identifier of the power strip.
+        """
+        return self._strip_id
+
+    @property
+    def outlet_nr(self):
+        """The number of the outlet on the power strip, from 0 onwards.
+        """
+        return self._outlet_nr
+
+    @property
+    def kind(self):
+        """What changed: SWITCHED_ON, SWITCHED_OFF, VOLTAGE_LOST, VOLTAGE_RESTORED, TIMING_ERROR or SEQUENCE_DONE.
+        """
+        return self._kind
+
+    @property
+    def time_detected(self):
+        """When the change was seen, in seconds since the epoch. The change happened since the previous poll.
+        """
+        return self._time_detected
+
+    def __repr__(self):
+        return "OutletEvent(" + str(self._strip_id) + ", " + str(self._outlet_nr) + ", " + self._kind + ")"
+
+
+def _changes(old, new):
+    """The OutletEvent objects for the differences between two SisPySnapshot objects."""
+    events = []
+    for old_outlet, new_outlet in zip(old.outlets, new.outlets):
+        kinds = []
+        if new_outlet.switched_on != old_outlet.switched_on:
+            kinds.append(SWITCHED_ON if new_outlet.switched_on else SWITCHED_OFF)
+        elif new_outlet.switched_on is True and new_outlet.voltage_present != old_outlet.voltage_present:
+            # there's only voltage on a switched on outlet
+            kinds.append(VOLTAGE_RESTORED if new_outlet.voltage_present else VOLTAGE_LOST)
+        old_entry = old_outlet.current_schedule_entry
+        new_entry = new_outlet.current_schedule_entry
+        if new_entry.timing_error is True and old_entry.timing_error is False:
+            kinds.append(TIMING_ERROR)
+        if new_entry.sequence_done is True and old_entry.sequence_done is False:
+            kinds.append(SEQUENCE_DONE)
+        for kind in kinds:
+            events.append(OutletEvent(new.strip_id, new_outlet.nr, kind, new._epoch_taken))
+    return events
+
+
+class Watcher(object):
+    """Poll a power strip and compute the changes.
+
+       Every poll() reads a snapshot of the power strip (one burst of USB transfers) and returns the changes since
+       the previous poll. next_interval is the number of seconds to wait for the next poll: max_interval while no
+       schedule switches, min_interval in the minute before a schedule entry ends.
+    """
+    def __init__(self, sispy, min_interval=1.0, max_interval=60.0):
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError("Need 0 < min_interval <= max_interval")
+        self._sispy = sispy
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._snapshot = None
+        self._next_interval = min_interval
+
+    @property
+    def snapshot(self):
+        """The SisPySnapshot of the last poll, None before the first poll.
+        """
+        return self._snapshot
+
+    @property
+    def next_interval(self):
+        """Seconds to wait before the next poll.
+        """
+        return self._next_interval
+
+    def _interval(self, snapshot):
+        interval = self._max_interval
+        for outlet in snapshot.outlets:
+            entry = outlet.current_schedule_entry
+            if entry.timing_error is True or entry.sequence_done is True:
+                continue
+            # the power strip rounds up, the entry ends in (minutes - 1, minutes] minutes
+            interval = min(interval, (entry.minutes_to_next_schedule_entry - 1) * 60)
+        return max(interval, self._min_interval)
+
+    def poll(self):
+        """Read the power strip and return a list with an OutletEvent for every change since the previous poll.
+           The first poll only reads the initial state.
+        """
+        snapshot = self._sispy.snapshot()
+        events = [] if self._snapshot is None else _changes(self._snapshot, snapshot)
+        self._snapshot = snapshot
+        self._next_interval = self._interval(snapshot)
+        return events
+
+
+class WatcherThread(Watcher):
+    """Poll a power strip in a background thread and call callback(event) for every OutletEvent.
+
+       If polling fails, error_callback(exception) is called and polling continues after max_interval. If callback
+       raises an exception, error_callback gets it too and the remaining events are still passed on.
+       Without error_callback, the thread stops and the exception is kept in error.
+    """
+    def __init__(self, sispy, callback, min_interval=1.0, max_interval=60.0, error_callback=None):
+        Watcher.__init__(self, sispy, min_interval, max_interval)
+        self._callback = callback
+        self._error_callback = error_callback
+        self._stop = threading.Event()
+        self._thread = None
+        self.error = None
+
+    def start(self):
+        """Start polling.
+        """
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                events = self.poll()
+            except Exception as e:
+                if not self._handle_error(e):
+                    return
+                self._next_interval = self._max_interval
+                events = []
+            for event in events:
+                try:
+                    self._callback(event)
+                except Exception as e:
+                    if not self._handle_error(e):
+                        return
+            self._stop.wait(self._next_interval)
+
+    def _handle_error(self, e):
+        """Pass e to error_callback, or keep it in error. Returns whether to keep polling."""
+        if self._error_callback is None:
+            self.error = e
+            return False
+        self._error_callback(e)
+        return True
+
+    def stop(self):
+        """Stop polling and wait for the thread to finish.
+        """
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
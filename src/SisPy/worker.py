@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+"""A single I/O thread per power strip, taking the USB transfers from a priority queue.
+
+   With SisPy.enable_io_worker(), every USB transfer with the power strip is handed to its IOWorker and done by
+   its thread, whatever thread asked for it. The caller waits for the result. Waiting transfers are done in order of
+   priority, and in order of arrival within a priority:
+   - INTERACTIVE: switching an outlet
+   - SCHEDULE: storing a schedule
+   - MONITORING: all reads
+   So switching an outlet off doesn't wait behind a sweep reading all power strips.
+"""
+
+# Python library for controlling the Energenie power switch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+import queue
+import threading
+import time
+
+INTERACTIVE = 0
+SCHEDULE = 1
+MONITORING = 2
+
+PRIORITY_NAMES = ('interactive', 'schedule', 'monitoring')
+
+
+def transfer_priority(request_type, value):
+    """The priority of a ctrl_transfer call."""
+    if request_type & 0x80:
+        return MONITORING
+    report_nr = value & 0xFF
+    if report_nr >= 3 and (report_nr - 3) % 3 == 1:
+        return SCHEDULE
+    return INTERACTIVE
+
+
+class _Request(object):
+    __slots__ = ('func', 'args', 'time_queued', 'done', 'result', 'error')
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.time_queued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class IOWorker(object):
+    """The thread doing the USB transfers of one power strip, see the module documentation.
+
+       stats() tells how busy it is: the number of waiting transfers and, per priority, how long they waited.
+    """
+    def __init__(self, name=None):
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._max_queue_depth = 0
+        self._counts = [0] * len(PRIORITY_NAMES)
+        self._wait_sum = [0.0] * len(PRIORITY_NAMES)
+        self._wait_max = [0.0] * len(PRIORITY_NAMES)
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        """The number of transfers waiting.
+        """
+        return self._queue.qsize()
+
+    def call(self, priority, func, *args):
+        """Call func(*args) on the worker thread with the given priority, wait for it and return its result.
+        """
+        if threading.current_thread() is self._thread:
+            return func(*args)
+        request = _Request(func, args)
+        with self._lock:
+            if self._closed:
+                raise IOError("The I/O worker is closed")
+            self._queue.put((priority, next(self._sequence), request))
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def wrap(self, ctrl_transfer):
+        """Wrap the ctrl_transfer function of a USB device so the transfers are done on the worker thread.
+        """
+        def transfer(request_type, request, value=0, index=0, data_or_length=None, timeout=None):
+            return self.call(transfer_priority(request_type, value), ctrl_transfer, request_type, request, value, index, data_or_length, timeout)
+        return transfer
+
+    def _run(self):
+        while True:
+            priority, sequence, request = self._queue.get()
+            if request is None:
+                return
+            waited = time.perf_counter() - request.time_queued
+            with self._lock:
+                self._counts[priority] += 1
+                self._wait_sum[priority] += waited
+                self._wait_max[priority] = max(self._wait_max[priority], waited)
+            try:
+                request.result = request.func(*request.args)
+            except BaseException as e:
+                request.error = e
+            request.done.set()
+
+    def stats(self):
+        """Dictionary with the current and maximum queue depth, and per priority name the number of transfers done,
+           the total and the maximum number of seconds they waited in the queue.
+        """
+        with self._lock:
+            result = {'queue_depth': self._queue.qsize(), 'max_queue_depth': self._max_queue_depth}
+            for priority, name in enumerate(PRIORITY_NAMES):
+                result[name] = {'count': self._counts[priority], 'wait_sum': self._wait_sum[priority], 'wait_max': self._wait_max[priority]}
+            return result
+
+    def close(self):
+        """Stop the thread after the waiting transfers are done.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            # after everything else
+            self._queue.put((len(PRIORITY_NAMES), next(self._sequence), None))
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+
+# Fixtures and helpers shared by the test scripts.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy.emulator import EmulatedDevice
+from SisPy.lib import SisPy
+
+import pytest
+import time
+
+# 2016-01-05 17:10:00 UTC, a Tuesday
+EPOCH = 1452013800
+
+
+@pytest.fixture
+def emulated_device():
+    return EmulatedDevice(dev_id=7, epoch=EPOCH)
+
+
+@pytest.fixture
+def emulated_sispy(emulated_device):
+    return SisPy(emulated_device)
+
+
+# test scripts with mock devices of their own override these
+
+@pytest.fixture
+def device(emulated_device):
+    return emulated_device
+
+
+@pytest.fixture
+def sispy(emulated_sispy):
+    return emulated_sispy
+
+
+def _program(sispy, outlet_nr, periodic=True, entries=((True, 3), (False, 2)), rampup_minutes=1):
+    """Write a schedule starting rampup_minutes after the current time of the emulated device."""
+    schedule = sispy.outlets[outlet_nr].schedule
+    now = sispy._dev.now
+    schedule._get_current_time = lambda: time.gmtime(now)
+    schedule.reset()
+    schedule.periodic = periodic
+    schedule.add_entry()
+    schedule._epoch_activated = now
+    schedule.entries[0].start_time = time.gmtime(now + rampup_minutes * 60)
+    for i, (switch_on, minutes) in enumerate(entries):
+        if i > 0:
+            schedule.add_entry()
+        schedule.entries[i].switch_on = switch_on
+        schedule.entries[i].minutes_to_next_schedule_entry = minutes
+    assert schedule.apply() is True
+    return schedule
+
+
+def _follow(schedule, device):
+    """Let the schedule take the current time from the emulated device."""
+    schedule._get_current_time = lambda: time.gmtime(device.now)
+    return schedule
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -21,8 +21,8 @@ SCRIPT_DIR=$(realpath "$TEST_DIR/../src")
 export PYTHONPATH="$SCRIPT_DIR:$PYTHONPATH"
 
 func=''
-src_files=( "$SCRIPT_DIR/SisPy/lib.py" )
-test_files=( "$TEST_DIR/sispy_lib.py" )
+src_files=( "$SCRIPT_DIR/SisPy/lib.py" "$SCRIPT_DIR/SisPy/pool.py" "$SCRIPT_DIR/SisPy/aio.py" "$SCRIPT_DIR/SisPy/sispyd.py" "$SCRIPT_DIR/SisPy/emulator.py" "$SCRIPT_DIR/SisPy/metrics.py" "$SCRIPT_DIR/SisPy/codec.py" "$SCRIPT_DIR/SisPy/watch.py" "$SCRIPT_DIR/SisPy/exporter.py" "$SCRIPT_DIR/SisPy/recorder.py" "$SCRIPT_DIR/SisPy/registry.py" "$SCRIPT_DIR/SisPy/policy.py" "$SCRIPT_DIR/SisPy/worker.py" "$SCRIPT_DIR/SisPy/compiler.py" )
+test_files=( "$TEST_DIR/sispy_lib.py" "$TEST_DIR/sispy_pool.py" "$TEST_DIR/sispy_aio.py" "$TEST_DIR/sispy_sispyd.py" "$TEST_DIR/sispy_emulator.py" "$TEST_DIR/sispy_metrics.py" "$TEST_DIR/sispy_codec.py" "$TEST_DIR/sispy_watch.py" "$TEST_DIR/sispy_exporter.py" "$TEST_DIR/sispy_recorder.py" "$TEST_DIR/sispy_registry.py" "$TEST_DIR/sispy_policy.py" "$TEST_DIR/sispy_worker.py" "$TEST_DIR/sispy_compiler.py" )
 
 error=0
 for file in $src_files
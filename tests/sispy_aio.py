@@ -0,0 +1,205 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.aio.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy import codec
+from SisPy.aio import AsyncSisPy
+from SisPy.aio import AsyncOutlet
+from SisPy.lib import OutletCurrentScheduleEntry
+from SisPy.lib import OutletSchedule
+from SisPy.lib import SisPySnapshot
+from SisPy.pool import SisPyPool
+
+from sispy_pool import MockDevice
+
+import asyncio
+import pytest
+import struct
+import threading
+import time
+
+
+#####
+# some mock objects to be able to inject test data
+#####
+
+class FullMockDevice(MockDevice):
+    """Also knows about the buzzer, schedules and current schedule entries, and checks transfers never overlap."""
+    def __init__(self, dev_id, barrier=None):
+        MockDevice.__init__(self, dev_id, barrier)
+        self.schedules = [bytearray(38) for i in range(4)]
+        self.busy = False
+        self.overlap = False
+
+    def ctrl_transfer(self, request_type, request, value=0, index=0, data_or_length=None, timeout=None):
+        if self.busy is True:
+            self.overlap = True
+        self.busy = True
+        try:
+            time.sleep(0.001)
+            report_nr = value & 0xFF
+            if request_type & 0x80:
+                if report_nr == 2:
+                    return bytearray([report_nr, 0])
+                if report_nr in (4, 7, 10, 13):
+                    return bytearray([report_nr]) + self.schedules[(report_nr - 4) // 3]
+                if report_nr in (5, 8, 11, 14):
+                    return bytearray([report_nr, 0x01, 0x02, 0x80])
+            elif report_nr in (4, 7, 10, 13):
+                self.schedules[(report_nr - 4) // 3] = bytearray(data_or_length[1:])
+                return len(data_or_length)
+            return MockDevice.ctrl_transfer(self, request_type, request, value, index, data_or_length, timeout)
+        finally:
+            self.busy = False
+
+
+@pytest.fixture
+def device():
+    return FullMockDevice(42)
+
+
+####
+# Actual test code
+####
+
+def test_async_sispy(device):
+    async def run():
+        sispy = await AsyncSisPy.open(device)
+        assert await sispy.get_id() == 42
+        assert sispy.nr_outlets == 4
+        assert len(sispy.outlets) == 4
+        assert isinstance(sispy.outlets[0], AsyncOutlet)
+        snapshot = await sispy.snapshot()
+        assert isinstance(snapshot, SisPySnapshot)
+        assert snapshot.strip_id == 42
+        await sispy.close()
+
+    asyncio.run(run())
+
+
+def test_async_outlet(device):
+    async def run():
+        sispy = await AsyncSisPy.open(device)
+        outlet = sispy.outlets[1]
+        assert await outlet.get_switched_on() is False
+        await outlet.set_switched_on(True)
+        assert device.outlet_on[1] is True
+        assert await outlet.get_switched_on() is True
+        with pytest.raises(TypeError):
+            await outlet.set_switched_on(1)
+
+        entry = await outlet.get_current_schedule_entry()
+        assert isinstance(entry, OutletCurrentScheduleEntry)
+        assert entry.switched_it_on is True
+
+        schedule = await outlet.get_schedule()
+        assert isinstance(schedule, OutletSchedule)
+        assert schedule is await outlet.get_schedule()
+        assert await outlet.apply_schedule() is False
+        schedule._get_current_time = lambda: time.gmtime(1000000)
+        schedule.add_entry()
+        schedule.entries[0].start_time = time.gmtime(1000000 + 60)
+        schedule.entries[0].minutes_to_next_schedule_entry = 5
+        assert await outlet.apply_schedule() is True
+        assert struct.unpack('<L', device.schedules[1][0:4])[0] == 1000000
+        await sispy.close()
+
+    asyncio.run(run())
+
+
+def test_async_apply_template(device):
+    async def run():
+        sispy = await AsyncSisPy.open(device)
+        template = await sispy.outlets[0].get_schedule()
+        template._get_current_time = lambda: time.gmtime(1000000)
+        template.add_entry()
+        template.entries[0].start_time = time.gmtime(1000000 + 60)
+        template.entries[0].minutes_to_next_schedule_entry = 5
+        # stored on outlet 2, not on outlet 0 the template was read from
+        assert await sispy.outlets[2].apply_schedule(template) is True
+        assert struct.unpack('<L', device.schedules[2][0:4])[0] == 1000000
+        assert device.schedules[0] == bytearray(38)
+        assert await sispy.outlets[2].apply_schedule(template) is False
+        assert template.dirty is True
+        await sispy.close()
+
+    asyncio.run(run())
+
+
+def test_async_apply_running_template(device):
+    async def run():
+        sispy = await AsyncSisPy.open(device)
+        template = await sispy.outlets[0].get_schedule()
+        template._get_current_time = lambda: time.gmtime(1000000)
+        template.periodic = True
+        template.add_entry()
+        template.entries[0].start_time = time.gmtime(1000000 + 60)
+        template.entries[0].switch_on = True
+        template.entries[0].minutes_to_next_schedule_entry = 3
+        template.add_entry()
+        template.entries[1].minutes_to_next_schedule_entry = 2
+        assert await sispy.outlets[0].apply_schedule() is True
+        # 7 minutes after the start: in the first entry of the second cycle, the copy starts with the second entry
+        template._get_current_time = lambda: time.gmtime(1000000 + 60 + 7 * 60)
+        assert await sispy.outlets[2].apply_schedule(template) is True
+        assert codec.decode_schedule(device.schedules[2]) == (1000000 + 60 + 7 * 60, (0x0002, 0x8003) + (codec.ENTRY_UNUSED,) * 14, 1)
+        assert await sispy.outlets[2].apply_schedule(template) is False
+        assert template.start_time == time.gmtime(1000000 + 60)
+        await sispy.close()
+
+    asyncio.run(run())
+
+
+def test_async_same_strip_serialized(device):
+    async def run():
+        sispy = await AsyncSisPy.open(device)
+        await asyncio.gather(*[outlet.get_switched_on() for outlet in sispy.outlets for i in range(5)])
+        await asyncio.gather(sispy.snapshot(), sispy.outlets[0].set_switched_on(True), sispy.get_id())
+        await sispy.close()
+
+    asyncio.run(run())
+    assert device.overlap is False
+
+
+def test_async_strips_parallel():
+    barrier = threading.Barrier(3)
+    devices = [FullMockDevice(i, barrier) for i in (1, 2, 3)]
+
+    async def run():
+        strips = [await AsyncSisPy.open(dev) for dev in devices]
+        # this would time out on the barrier if the power strips were read one after the other
+        result = await asyncio.gather(*[strip.outlets[0].get_switched_on() for strip in strips])
+        for strip in strips:
+            await strip.close()
+        return result
+
+    assert asyncio.run(run()) == [False, False, False]
+
+
+def test_async_pool():
+    devices = [FullMockDevice(i) for i in (1, 2)]
+    with SisPyPool(devices) as pool:
+        strips = pool.async_strips()
+        assert sorted(strips.keys()) == [1, 2]
+
+        async def run():
+            return await asyncio.gather(*[strips[i].get_id() for i in (1, 2)])
+
+        assert asyncio.run(run()) == [1, 2]
+        assert strips[1]._executor is pool._workers[1]
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
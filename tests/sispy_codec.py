@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.codec.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy import codec
+from SisPy.emulator import EmulatedDevice
+from SisPy.lib import OutletSchedule
+from SisPy.lib import SisPy
+
+import pytest
+import time
+
+# schedule reports to decode per second, at least
+DECODE_THROUGHPUT = 20000
+
+# 2016-01-05 17:10:00 UTC
+EPOCH = 1452013800
+
+
+def schedule_data():
+    """Time activated 2016-01-05 17:10:35 UTC, 3 entries, non-periodic, 1 minute rampup."""
+    return bytearray([0x9b, 0xf9, 0x8b, 0x56,
+                      0x03, 0x80, 0x02, 0x00, 0x05, 0x80, 0x00, 0x00] + [0xff, 0x3f] * 12 + [0x01, 0x00])
+
+
+####
+# Actual test code
+####
+
+def test_report_nr():
+    assert codec.report_nr(1) == 1
+    assert codec.report_nr(2) == 2
+    assert codec.report_nr(3, 0) == 3
+    assert codec.report_nr(4, 2) == 10
+    assert codec.report_nr(5, 3) == 14
+
+
+def test_report_length():
+    assert [codec.report_length(nr) for nr in range(1, 15)] == [4, 1] + [1, 38, 3] * 4
+
+
+def test_decode_id():
+    assert codec.decode_id(bytearray([0x01, 0x02, 0x03, 0x04])) == 0x04030201
+    # with the report nr in front
+    assert codec.decode_id(bytearray([0x01, 0x01, 0x02, 0x03, 0x04]), 1) == 0x04030201
+
+
+def test_decode_status():
+    assert codec.decode_status(bytearray([0x00])) == (False, False)
+    assert codec.decode_status(bytearray([0x01])) == (True, False)
+    assert codec.decode_status(bytearray([0x03])) == (True, True)
+    assert codec.decode_status([0x03, 0x02], 1) == (False, True)
+
+
+def test_status_round_trip():
+    assert codec.decode_status(codec.encode_status(True)) == (True, False)
+    assert codec.decode_status(codec.encode_status(False)) == (False, False)
+
+
+def test_decode_current_schedule_entry():
+    assert codec.decode_current_schedule_entry(bytearray([0x81, 0x02, 0x80])) == (0x81, 0x8002)
+
+
+def test_decode_schedule():
+    epoch_activated, values, rampup_minutes = codec.decode_schedule(schedule_data())
+    assert epoch_activated == 1452013979
+    assert values == (0x8003, 0x0002, 0x8005, 0x0000) + (0x3FFF,) * 12
+    assert rampup_minutes == 1
+
+
+def test_decode_schedule_memoryview():
+    # decode a report as it was received, report nr included, without copying it
+    raw = bytearray([0x04]) + schedule_data()
+    assert codec.decode_schedule(memoryview(raw), 1) == codec.decode_schedule(schedule_data())
+
+
+def test_schedule_round_trip():
+    data = schedule_data()
+    assert codec.encode_schedule(*codec.decode_schedule(data)) == data
+
+
+def test_encode_schedule_buffer():
+    buffer = bytearray(1 + codec.SCHEDULE.size)
+    buffer[0] = 0x04
+    result = codec.encode_schedule(*codec.decode_schedule(schedule_data()), buffer=buffer, offset=1)
+    assert result is buffer
+    assert buffer == bytearray([0x04]) + schedule_data()
+
+
+def test_schedule_entries():
+    assert codec.schedule_entries([0x8003], True) == [0x8003] + [0x3FFF] * 15
+    assert codec.schedule_entries([0x8003], False) == [0x8003, 0x0000] + [0x3FFF] * 14
+    assert codec.schedule_entries([], False) == [0x0000] + [0x3FFF] * 15
+    assert codec.schedule_entries([0x8001] * 16, True) == [0x8001] * 16
+    assert codec.schedule_entries([0x8001] * 15, False) == [0x8001] * 15 + [0x0000]
+    with pytest.raises(ValueError):
+        codec.schedule_entries([0x8001] * 17, True)
+    with pytest.raises(ValueError):
+        codec.schedule_entries([0x8001] * 16, False)
+
+
+def test_schedule_16_entries():
+    sispy = SisPy(EmulatedDevice(epoch=EPOCH))
+    schedule = sispy.outlets[0].schedule
+    schedule._get_current_time = lambda: time.gmtime(EPOCH)
+    schedule.reset()
+    for i in range(16):
+        schedule.add_entry()
+        schedule.entries[i].switch_on = (i % 2 == 0)
+        schedule.entries[i].minutes_to_next_schedule_entry = i + 1
+    schedule._epoch_activated = EPOCH
+    schedule.entries[0].start_time = time.gmtime(EPOCH)
+    assert schedule.apply() is True
+
+    sispy.outlets[0]._schedule = None
+    schedule = sispy.outlets[0].schedule
+    assert len(schedule.entries) == 16
+    assert schedule.periodic is True
+    assert [e.minutes_to_next_schedule_entry for e in schedule.entries] == list(range(1, 17))
+
+    schedule.periodic = False
+    with pytest.raises(ValueError):
+        schedule.apply()
+
+
+def test_outlet_schedule_round_trip():
+    data = schedule_data()
+    schedule = OutletSchedule(data, None)
+    assert schedule._construct_data(schedule.time_activated) == data
+
+
+def test_decode_throughput():
+    nr_reports = DECODE_THROUGHPUT // 10
+    reports = bytearray()
+    for i in range(nr_reports):
+        reports += codec.encode_schedule(EPOCH + i, [0x8000 | (i % 0x3FFF)] + [0x3FFF] * 15, i % 60)
+    view = memoryview(reports)
+    size = codec.SCHEDULE.size
+
+    # best of a few runs, a busy machine shouldn't fail the test
+    best = None
+    for run in range(3):
+        start = time.perf_counter()
+        for i in range(nr_reports):
+            codec.decode_schedule(view, i * size)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    assert codec.decode_schedule(view, (nr_reports - 1) * size)[0] == EPOCH + nr_reports - 1
+    assert nr_reports / best > DECODE_THROUGHPUT
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
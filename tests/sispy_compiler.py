@@ -0,0 +1,214 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.compiler.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy import codec
+from SisPy.compiler import compile_intervals
+from SisPy.compiler import compile_periodic
+from SisPy.compiler import compile_weekly
+from SisPy.lib import OutletSchedule
+
+from conftest import EPOCH
+
+import pytest
+import time
+
+# weekly calendars to compile per second, at least
+COMPILE_THROUGHPUT = 2000
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# Monday to Friday, 08:00 to 18:00 UTC
+OFFICE_HOURS = [(day, hour, 0, hour == 8) for day in range(5) for hour in (8, 18)]
+
+
+def _check_run(sispy, device, expected, until, step=30 * 60):
+    """Let the emulated power strip run until the given epoch and compare outlet 0 with expected(epoch) every step.
+       Samples are taken in the middle of the steps, away from the switch points."""
+    device.advance(step // 2)
+    while device.now < until:
+        assert sispy.outlets[0].switched_on is expected(device.now), time.strftime("%Y-%m-%d %H:%M", time.gmtime(device.now))
+        device.advance(step)
+
+
+def _in_intervals(intervals):
+    return lambda epoch: any(start <= epoch < end for start, end in intervals)
+
+
+def _weekly(switch_points):
+    def expected(epoch):
+        t = time.gmtime(epoch)
+        minute = t.tm_wday * 24 * 60 + t.tm_hour * 60 + t.tm_min
+        points = sorted((d * 24 * 60 + h * 60 + m, state) for d, h, m, state in switch_points)
+        before = [state for m, state in points if m <= minute]
+        return before[-1] if len(before) > 0 else points[-1][1]
+    return expected
+
+
+####
+# Actual test code
+####
+
+def test_compile_intervals():
+    compiled = compile_intervals([(EPOCH + HOUR, EPOCH + 2 * HOUR), (EPOCH + 3 * HOUR, EPOCH + 4 * HOUR),
+                                  # overlapping and adjacent ones are merged
+                                  (EPOCH + 3 * HOUR + 600, EPOCH + 5 * HOUR), (EPOCH + 5 * HOUR, EPOCH + 6 * HOUR),
+                                  # in the past or empty
+                                  (EPOCH - 2 * HOUR, EPOCH - HOUR), (EPOCH + 9 * HOUR, EPOCH + 9 * HOUR)], EPOCH + 20)
+    assert compiled.epoch_activated == EPOCH
+    assert compiled.rampup_minutes == 60
+    assert compiled.entries == (0x8000 | 60, 60, 0x8000 | 180, 1)
+    assert compiled.periodic is False
+    assert compiled.state_at_activation is False
+    assert compiled.fits is True
+    assert compiled.nr_entries_needed == 4
+
+    compiled = compile_intervals([(EPOCH - HOUR, EPOCH + HOUR)], EPOCH)
+    assert (compiled.rampup_minutes, compiled.entries, compiled.state_at_activation) == (0, (0x8000 | 60, 1), True)
+    compiled = compile_intervals([], EPOCH)
+    assert compiled.entries == ()
+    assert compiled.data() == codec.encode_schedule(EPOCH, [codec.ENTRY_END] + [codec.ENTRY_UNUSED] * 15, 0)
+
+
+def test_compile_intervals_delay_chaining(sispy, device):
+    intervals = [(EPOCH + 50 * DAY, EPOCH + 50 * DAY + 2 * HOUR),
+                 (EPOCH + 62 * DAY, EPOCH + 82 * DAY),
+                 (EPOCH + 90 * DAY, EPOCH + 90 * DAY + HOUR)]
+    compiled = compile_intervals(intervals, EPOCH)
+    assert compiled.rampup_minutes == 0xFFFF
+    assert compiled.entries == (0x4000 | (50 * 24 * 60 - 0xFFFF),
+                                0x8000 | 120,
+                                0x3FFE, 0x4000 | (12 * 24 * 60 - 120 - 0x3FFE),
+                                0x8000 | 0x3FFF, 0xC000 | (20 * 24 * 60 - 0x3FFF),
+                                8 * 24 * 60, 0x8000 | 60, 1)
+    assert compiled.fits is True
+    assert compiled.apply(sispy.outlets[0]) is True
+    assert compiled.apply(sispy.outlets[0]) is False
+    _check_run(sispy, device, _in_intervals(intervals), EPOCH + 100 * DAY)
+    assert sispy.outlets[0].current_schedule_entry.sequence_done is True
+
+
+def test_compile_intervals_overflow(sispy, device):
+    intervals = [(EPOCH + (2 * i + 1) * HOUR, EPOCH + (2 * i + 2) * HOUR) for i in range(20)]
+    compiled = compile_intervals(intervals, EPOCH)
+    # 1 + 2 entries per interval and the final switch off in 15 entries
+    assert len(compiled.entries) == 14
+    assert compiled.fits is False
+    assert compiled.overflow == tuple((start, end, True) for start, end in intervals[7:])
+    assert compiled.nr_entries_needed == 1 + 2 * 19 + 1
+    compiled.apply(sispy.outlets[0])
+    _check_run(sispy, device, _in_intervals(intervals[:7]), EPOCH + 2 * DAY)
+
+
+def test_compile_weekly(sispy, device):
+    compiled = compile_weekly(OFFICE_HOURS, EPOCH)
+    assert compiled.periodic is True
+    assert compiled.fits is True
+    # Tuesday 17:10, the next switch point is at 18:00
+    assert compiled.rampup_minutes == 50
+    assert compiled.state_at_activation is True
+    assert len(compiled.entries) == 10
+    assert compiled.entries[0] == 14 * 60
+    assert compiled.entries[-1] == 0x8000 | 10 * 60
+    assert sum(e & codec.ENTRY_MINUTES for e in compiled.entries) == 7 * 24 * 60
+    sispy.outlets[0].switched_on = compiled.state_at_activation
+    compiled.apply(sispy.outlets[0])
+    _check_run(sispy, device, _weekly(OFFICE_HOURS), EPOCH + 15 * DAY, step=20 * 60)
+
+
+def test_compile_weekly_redundant():
+    compiled = compile_weekly([(0, 8, 0, True), (0, 9, 0, True), (0, 18, 0, False), (1, 0, 0, False), (1, 0, 0, False)], EPOCH)
+    assert len(compiled.entries) == 2
+    # the same state all week
+    compiled = compile_weekly([(0, 8, 0, True), (3, 8, 0, True)], EPOCH)
+    assert compiled.entries == (0x8000 | 7 * 24 * 60,)
+    assert compiled.state_at_activation is True
+
+
+def test_compile_weekly_overflow():
+    switch_points = [(day, hour, 0, hour % 2 == 0) for day in range(7) for hour in (6, 7, 12, 13, 18, 19)]
+    compiled = compile_weekly(switch_points, EPOCH)
+    assert compiled.fits is False
+    assert compiled.nr_entries_needed == 42
+    assert compiled.entries == ()
+    assert len(compiled.overflow) == 42 - 16
+    # the cycle starts on Tuesday 18:00, the 17th period on Friday 12:00
+    assert compiled.overflow[0] == (EPOCH + 50 * 60 + 2 * DAY + 18 * HOUR, EPOCH + 50 * 60 + 2 * DAY + 19 * HOUR, True)
+    assert compiled.overflow[-1][1] == EPOCH + 50 * 60 + 7 * DAY
+    with pytest.raises(ValueError):
+        compiled.data()
+
+
+def test_compile_periodic_long_period(sispy, device):
+    # 30 days on, 10 days off, the first time on from the activation on
+    compiled = compile_periodic([(0, True), (30 * 24 * 60, False)], 40 * 24 * 60, EPOCH, origin_epoch=EPOCH)
+    assert compiled.rampup_minutes == 0
+    assert [e & 0xC000 for e in compiled.entries] == [0x8000, 0xC000, 0xC000, 0x0000]
+    compiled.apply(sispy.outlets[0])
+    _check_run(sispy, device, lambda epoch: (epoch - EPOCH) % (40 * DAY) < 30 * DAY, EPOCH + 90 * DAY, step=6 * HOUR)
+
+
+def test_compile_invalid():
+    with pytest.raises(ValueError):
+        compile_weekly([(7, 0, 0, True)], EPOCH)
+    with pytest.raises(ValueError):
+        compile_weekly([(0, 24, 0, True)], EPOCH)
+    with pytest.raises(ValueError):
+        compile_weekly([], EPOCH)
+    with pytest.raises(ValueError):
+        compile_periodic([(10, True)], 5, EPOCH)
+    with pytest.raises(ValueError):
+        compile_periodic([(10, True)], 0, EPOCH)
+
+
+def test_compile_to_schedule(sispy):
+    compiled = compile_intervals([(EPOCH + HOUR, EPOCH + HOUR + 20 * DAY)], EPOCH)
+    schedule = compiled.to_schedule(sispy, 2)
+    assert isinstance(schedule, OutletSchedule)
+    assert [entry.delay_only for entry in schedule.entries] == [False, True, False]
+    assert schedule.entries[0].end_time == schedule.entries[1].start_time
+    assert str(schedule.entries[1]).startswith("delay only, switch on: True")
+
+
+def test_delay_only(sispy):
+    schedule = OutletSchedule(compile_intervals([(EPOCH + HOUR, EPOCH + 2 * HOUR)], EPOCH).data(), sispy)
+    entry = schedule.entries[0]
+    assert entry.delay_only is False
+    entry.delay_only = True
+    assert schedule._dirty is True
+    assert schedule._values[0] == 0xC000 | 60
+    assert entry.switch_on is True
+    assert entry.minutes_to_next_schedule_entry == 60
+    entry.delay_only = False
+    assert schedule._values[0] == 0x8000 | 60
+    with pytest.raises(TypeError):
+        entry.delay_only = 1
+
+
+def test_compile_throughput():
+    nr_calendars = COMPILE_THROUGHPUT // 4
+    best = None
+    for run in range(3):
+        start = time.perf_counter()
+        for i in range(nr_calendars):
+            compile_weekly(OFFICE_HOURS, EPOCH + i * 60).data()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    assert nr_calendars / best > COMPILE_THROUGHPUT
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -0,0 +1,161 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.emulator.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy.emulator import EmulatedDevice
+from SisPy.lib import SisPy
+
+from conftest import _program
+
+import pytest
+import time
+
+
+def _check(entry, nr, minutes, switched_it_on=False, rampup=False, done=False, timing_error=False):
+    assert entry.current_schedule_nr == nr
+    assert entry.minutes_to_next_schedule_entry == minutes
+    assert entry.switched_it_on is switched_it_on
+    assert entry.sequence_rampup is rampup
+    assert entry.sequence_done is done
+    assert entry.timing_error is timing_error
+
+
+####
+# Actual test code
+####
+
+def test_emulator_id(sispy, device):
+    assert sispy.id == 7
+    assert device.nr_transfers == 2
+    assert device.nr_bytes == 10
+
+
+def test_emulator_status(sispy, device):
+    outlet = sispy.outlets[1]
+    assert outlet.switched_on is False
+    outlet.switched_on = True
+    assert outlet.switched_on is True
+    assert device.outlets[1].switched_on is True
+
+    device.outlets[1].voltage_present = False
+    snapshot = sispy.snapshot()
+    assert snapshot.outlets[1].switched_on is True
+    assert snapshot.outlets[1].voltage_present is False
+    assert snapshot.buzzer_enabled is True
+
+
+def test_emulator_schedule_storage(sispy, device):
+    schedule = _program(sispy, 2)
+    assert device.outlets[2].schedule_data == schedule._data
+    # a new SisPy reads back what was written
+    schedule = SisPy(device).outlets[2].schedule
+    assert schedule.periodic is True
+    assert [(e.switch_on, e.minutes_to_next_schedule_entry) for e in schedule.entries] == [(True, 3), (False, 2)]
+    assert schedule.rampup_minutes == 1
+
+
+def test_emulator_vanilla(sispy):
+    _check(sispy.outlets[0].current_schedule_entry, 0, 0, done=True)
+
+
+def test_emulator_periodic(sispy, device):
+    _program(sispy, 0)
+    outlet = sispy.outlets[0]
+    _check(outlet.current_schedule_entry, None, 1, rampup=True)
+    assert outlet.switched_on is False
+
+    device.advance(60)
+    _check(outlet.current_schedule_entry, 1, 3, switched_it_on=True)
+    assert outlet.switched_on is True
+
+    device.advance(90)
+    _check(outlet.current_schedule_entry, 1, 2, switched_it_on=True)
+
+    device.advance(90)
+    _check(outlet.current_schedule_entry, 0, 2)
+    assert outlet.switched_on is False
+
+    # after a few periods, we're back in the first entry
+    device.advance(2 * 60 + 10 * 5 * 60)
+    _check(outlet.current_schedule_entry, 1, 3, switched_it_on=True)
+    assert outlet.switched_on is True
+
+
+def test_emulator_non_periodic(sispy, device):
+    _program(sispy, 3, periodic=False)
+    outlet = sispy.outlets[3]
+    device.advance(4 * 60)
+    _check(outlet.current_schedule_entry, 2, 2)
+    assert outlet.switched_on is False
+    device.advance(3600)
+    _check(outlet.current_schedule_entry, 2, 0, done=True)
+    assert outlet.switched_on is False
+
+
+def test_emulator_manual_override(sispy, device):
+    _program(sispy, 0)
+    outlet = sispy.outlets[0]
+    device.advance(60)
+    assert outlet.switched_on is True
+    outlet.switched_on = False
+    device.advance(60)
+    assert outlet.switched_on is False
+    # the next entry switches
+    device.advance(4 * 60)
+    assert outlet.switched_on is True
+
+
+def test_emulator_delay_without_switching(sispy, device):
+    _program(sispy, 0, entries=((True, 3), (False, 2)))
+    # set the "d" flag on the second entry
+    data = bytearray(device.outlets[0].schedule_data)
+    data[7] |= 0x40
+    device.outlets[0].set_schedule(data)
+    outlet = sispy.outlets[0]
+    device.advance(60)
+    assert outlet.switched_on is True
+    device.advance(3 * 60)
+    assert outlet.switched_on is True
+
+
+def test_emulator_power_failure(sispy, device):
+    _program(sispy, 0)
+    device.advance(60)
+    device.power_failure(3600)
+    # the schedule was paused
+    _check(sispy.outlets[0].current_schedule_entry, 1, 3, switched_it_on=True, timing_error=True)
+    # a new schedule clears the error
+    _program(sispy, 0, entries=((True, 5),))
+    assert sispy.outlets[0].current_schedule_entry.timing_error is False
+
+
+def test_emulator_errors(device):
+    with pytest.raises(IOError):
+        device.ctrl_transfer(0xa1, 0x01, 0x0300 + 3, 0, 5, 500)
+    with pytest.raises(IOError):
+        device.ctrl_transfer(0xa1, 0x01, 0x0300 + 15, 0, 2, 500)
+    with pytest.raises(IOError):
+        device.ctrl_transfer(0x21, 0x09, 0x0300 + 5, 0, bytearray([5, 0, 0, 0]), 500)
+
+
+def test_emulator_latency():
+    device = EmulatedDevice(latency=0.01)
+    start = time.time()
+    SisPy(device)
+    assert time.time() - start >= 0.01
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
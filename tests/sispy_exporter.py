@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.exporter.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy.emulator import EmulatedDevice
+from SisPy.exporter import CONTENT_TYPE
+from SisPy.exporter import SisPyExporter
+from SisPy.pool import SisPyPool
+
+from sispy_emulator import _program
+
+import pytest
+import time
+import urllib.error
+import urllib.request
+
+# 2016-01-05 17:10:00 UTC
+EPOCH = 1452013800
+
+
+class FailingDevice(EmulatedDevice):
+    def __init__(self, *args, **kwargs):
+        EmulatedDevice.__init__(self, *args, **kwargs)
+        self.failing = False
+
+    def ctrl_transfer(self, *args, **kwargs):
+        if self.failing:
+            raise IOError("gone")
+        return EmulatedDevice.ctrl_transfer(self, *args, **kwargs)
+
+
+@pytest.fixture
+def devices():
+    return [EmulatedDevice(dev_id=1, epoch=EPOCH), FailingDevice(dev_id=2, epoch=EPOCH)]
+
+
+@pytest.fixture
+def pool(devices):
+    pool = SisPyPool(devices)
+    yield pool
+    pool.close()
+
+
+def _samples(metrics):
+    samples = {}
+    for line in metrics.decode('utf-8').splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+####
+# Actual test code
+####
+
+def test_exporter_before_refresh(pool):
+    samples = _samples(SisPyExporter(pool).metrics())
+    assert samples['sispy_strip_up{strip="1"}'] == 0
+    assert samples['sispy_exporter_refreshes_total'] == 0
+    assert 'sispy_outlet_switched_on{strip="1",outlet="0"}' not in samples
+
+
+def test_exporter_refresh(pool, devices):
+    devices[0].outlets[2].switched_on = True
+    _program(pool[2], 1, periodic=False, entries=((True, 3), (False, 2)), rampup_minutes=1)
+    exporter = SisPyExporter(pool)
+    exporter.refresh()
+    samples = _samples(exporter.metrics())
+    assert samples['sispy_strip_up{strip="1"}'] == 1
+    assert samples['sispy_strip_up{strip="2"}'] == 1
+    assert [samples['sispy_outlet_switched_on{strip="1",outlet="%d"}' % i] for i in range(4)] == [0, 0, 1, 0]
+    assert samples['sispy_outlet_voltage_present{strip="1",outlet="2"}'] == 1
+    assert samples['sispy_outlet_schedule_rampup{strip="2",outlet="1"}'] == 1
+    assert samples['sispy_outlet_schedule_minutes_to_next_entry{strip="2",outlet="1"}'] == 1
+    assert samples['sispy_outlet_schedule_done{strip="2",outlet="1"}'] == 0
+    assert samples['sispy_outlet_timing_error{strip="2",outlet="1"}'] == 0
+    assert samples['sispy_exporter_refreshes_total'] == 1
+    assert samples['sispy_exporter_refresh_seconds_count'] == 1
+    assert samples['sispy_exporter_last_refresh_seconds'] > 0
+
+    devices[1].advance(60)
+    exporter.refresh()
+    samples = _samples(exporter.metrics())
+    assert samples['sispy_outlet_schedule_rampup{strip="2",outlet="1"}'] == 0
+    assert samples['sispy_outlet_schedule_next_entry{strip="2",outlet="1"}'] == 1
+    assert samples['sispy_outlet_switched_on{strip="2",outlet="1"}'] == 1
+    assert samples['sispy_exporter_refreshes_total'] == 2
+
+
+def test_exporter_errors(pool, devices):
+    exporter = SisPyExporter(pool)
+    devices[1].failing = True
+    exporter.refresh()
+    exporter.refresh()
+    samples = _samples(exporter.metrics())
+    assert samples['sispy_strip_up{strip="1"}'] == 1
+    assert samples['sispy_strip_up{strip="2"}'] == 0
+    assert 'sispy_outlet_switched_on{strip="2",outlet="0"}' not in samples
+    assert samples['sispy_exporter_refresh_errors_total{strip="1"}'] == 0
+    assert samples['sispy_exporter_refresh_errors_total{strip="2"}'] == 2
+
+    devices[1].failing = False
+    exporter.refresh()
+    samples = _samples(exporter.metrics())
+    assert samples['sispy_strip_up{strip="2"}'] == 1
+    assert samples['sispy_exporter_refresh_errors_total{strip="2"}'] == 2
+
+
+def test_exporter_scrape(pool, devices):
+    exporter = SisPyExporter(pool, interval=0.01)
+    exporter.start()
+    address, port = exporter.serve('127.0.0.1', 0)
+    try:
+        while _samples(exporter.metrics())['sispy_exporter_refreshes_total'] == 0:
+            time.sleep(0.001)
+        exporter._stop.set()
+        exporter._thread.join()
+
+        transfers = [device.nr_transfers for device in devices]
+        url = 'http://127.0.0.1:%d/metrics' % port
+        for i in range(20):
+            with urllib.request.urlopen(url, timeout=5) as response:
+                assert response.headers['Content-Type'] == CONTENT_TYPE
+                assert response.read() == exporter.metrics()
+        # scrapes are served from memory
+        assert [device.nr_transfers for device in devices] == transfers
+
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen('http://127.0.0.1:%d/' % port, timeout=5)
+    finally:
+        exporter.close()
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
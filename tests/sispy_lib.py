@@ -16,15 +16,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from SisPy import codec
+from SisPy.emulator import EmulatedDevice
 from SisPy.lib import _min2human
+from SisPy.lib import _timegm
 from SisPy.lib import SisPy
 from SisPy.lib import Outlet
 from SisPy.lib import OutletCurrentScheduleEntry
 from SisPy.lib import OutletSchedule
 from SisPy.lib import OutletScheduleEntry
+from SisPy.lib import OutletSnapshot
+from SisPy.lib import SisPySnapshot
+
+from conftest import EPOCH
+from conftest import _follow
+from conftest import _program
 
 import pytest
+import os
+import subprocess
+import sys
+import threading
 import time
+import tracemalloc
 import calendar
 
 # test data was obtained in CET
@@ -42,6 +56,8 @@ def device():
     class MockDevice:
         def __init__(self):
             self.outlet_on = [True, False, False, True]
+            self.buzzer = 0x04
+            self.nr_reads = 0
 
         def in_type(self, value):
             return (value & (1 << 7)) == (1 << 7)
@@ -61,14 +77,18 @@ def device():
             if report_nr == 1:
                 assert data_or_length == 5
                 data = id_data()
+            # get buzzer
+            if report_nr == 2:
+                assert data_or_length == 2
+                data = bytearray([self.buzzer])
             # get status outlet
             if (report_nr in (3, 6, 9, 12)):
                 assert data_or_length == 2
-                data = [self.get_outlet_status((report_nr - 3) / 3)]
+                data = bytearray([self.get_outlet_status((report_nr - 3) // 3)])
             # get full schedule outlet
             if (report_nr in (4, 7, 10, 13)):
                 assert data_or_length == 39
-                outlet = (report_nr - 4) / 3
+                outlet = (report_nr - 4) // 3
                 if outlet == 0:
                     data = outlet_schedule_data()
                 if outlet == 1:
@@ -80,7 +100,7 @@ def device():
             # get current schedule outlet
             if (report_nr in (5, 8, 11, 14)):
                 assert data_or_length == 4
-                outlet = (report_nr - 5) / 3
+                outlet = (report_nr - 5) // 3
                 if outlet == 0:
                     data = outlet_current_schedule_entry_data_ok_off()
                 if outlet == 1:
@@ -108,6 +128,7 @@ def device():
 
             if self.in_type(request_type) is True:
                 report_nr = value & (~ (3 << 8))
+                self.nr_reads += 1
                 return self.mock_read_data(report_nr, data_or_length)
             else:
                 self.send_meta = bytearray([request_type, request, value & 0xFF, int(value / 0xFF), index])
@@ -133,7 +154,6 @@ def sispy(device):
 # data that we can use for injection
 ####
 
-@pytest.fixture
 def outlet_current_schedule_entry_data_ok_off():
     """Executing the first schedule (second schedule is the next one).
        Time it will still execute is 2 minutes.
@@ -144,7 +164,6 @@ def outlet_current_schedule_entry_data_ok_off():
     return bytearray([0x01, 0x2, 0x0])
 
 
-@pytest.fixture
 def outlet_current_schedule_entry_data_ok_off_long_time():
     """Executing the first schedule (second schedule is the next one).
        Time it will still execute is a lot (0x3002).
@@ -155,7 +174,6 @@ def outlet_current_schedule_entry_data_ok_off_long_time():
     return bytearray([0x01, 0x2, 0x30])
 
 
-@pytest.fixture
 def outlet_current_schedule_entry_data_ok_on():
     """Executing the first schedule (second schedule is the next one).
        Time it will still execute is 2 minutes.
@@ -166,7 +184,6 @@ def outlet_current_schedule_entry_data_ok_on():
     return bytearray([0x01, 0x2, 0x80])
 
 
-@pytest.fixture
 def outlet_current_schedule_entry_data_error_off():
     """Executing the first schedule (second schedule is the next one).
        Time it will still execute is 2 minutes.
@@ -178,7 +195,6 @@ def outlet_current_schedule_entry_data_error_off():
     return bytearray([0x81, 0x2, 0x0])
 
 
-@pytest.fixture
 def outlet_current_schedule_entry_data_ok_off_rampup():
     """Still waiting to start the schedules (first schedule is the next one).
        Time it will still wait is 2 minutes.
@@ -186,7 +202,6 @@ def outlet_current_schedule_entry_data_ok_off_rampup():
     return bytearray([0x10, 0x2, 0x0])
 
 
-@pytest.fixture
 def outlet_current_schedule_entry_data_ok_off_done():
     """All schedules were executed.
        This also means that no looping was requested.
@@ -194,7 +209,6 @@ def outlet_current_schedule_entry_data_ok_off_done():
     return bytearray([0x02, 0x0, 0x0])
 
 
-@pytest.fixture
 def outlet_schedule_data():
     """Time activated is 2016-01-05 17:10:35 UTC
        Rampup time is 1 minute.
@@ -206,7 +220,6 @@ def outlet_schedule_data():
     return bytearray([0xb, 0xf9, 0x8b, 0x56, 0x3, 0x80, 0x2, 0x0, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0x1, 0x0])
 
 
-@pytest.fixture
 def outlet_schedule_data_non_periodic():
     """Time activated is 2016-01-05 17:10:35 UTC
        Rampup time is 1 minute.
@@ -218,7 +231,6 @@ def outlet_schedule_data_non_periodic():
     return bytearray([0xb, 0xf9, 0x8b, 0x56, 0x3, 0x80, 0x2, 0x0, 0x0, 0x0, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0x1, 0x0])
 
 
-@pytest.fixture
 def outlet_schedule_data_reset():
     """Time activated is 2016-01-05 17:10:35 UTC
        Rampup time is 1 minute.
@@ -227,7 +239,6 @@ def outlet_schedule_data_reset():
     return bytearray([0xb, 0xf9, 0x8b, 0x56, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0xff, 0x3f, 0x1, 0x0])
 
 
-@pytest.fixture
 def outlet_schedule_data_vanilla():
     """Entry as it should be after factory reset.
     """
@@ -239,6 +250,19 @@ def id_data():
     return bytearray([0x1, 0x2, 0x3, 0x4])
 
 
+# the data functions above are also used directly by the mock objects, so register them as fixtures separately
+outlet_current_schedule_entry_data_ok_off_fixture = pytest.fixture(name='outlet_current_schedule_entry_data_ok_off')(outlet_current_schedule_entry_data_ok_off)
+outlet_current_schedule_entry_data_ok_off_long_time_fixture = pytest.fixture(name='outlet_current_schedule_entry_data_ok_off_long_time')(outlet_current_schedule_entry_data_ok_off_long_time)
+outlet_current_schedule_entry_data_ok_on_fixture = pytest.fixture(name='outlet_current_schedule_entry_data_ok_on')(outlet_current_schedule_entry_data_ok_on)
+outlet_current_schedule_entry_data_error_off_fixture = pytest.fixture(name='outlet_current_schedule_entry_data_error_off')(outlet_current_schedule_entry_data_error_off)
+outlet_current_schedule_entry_data_ok_off_rampup_fixture = pytest.fixture(name='outlet_current_schedule_entry_data_ok_off_rampup')(outlet_current_schedule_entry_data_ok_off_rampup)
+outlet_current_schedule_entry_data_ok_off_done_fixture = pytest.fixture(name='outlet_current_schedule_entry_data_ok_off_done')(outlet_current_schedule_entry_data_ok_off_done)
+outlet_schedule_data_fixture = pytest.fixture(name='outlet_schedule_data')(outlet_schedule_data)
+outlet_schedule_data_non_periodic_fixture = pytest.fixture(name='outlet_schedule_data_non_periodic')(outlet_schedule_data_non_periodic)
+outlet_schedule_data_reset_fixture = pytest.fixture(name='outlet_schedule_data_reset')(outlet_schedule_data_reset)
+outlet_schedule_data_vanilla_fixture = pytest.fixture(name='outlet_schedule_data_vanilla')(outlet_schedule_data_vanilla)
+
+
 ####
 # Actual test code
 ####
@@ -256,6 +280,187 @@ def test_property_defaults(sispy):
     assert isinstance(sispy.outlets[0], Outlet)
 
 
+def test_snapshot(sispy):
+    sispy._dev.nr_reads = 0
+    snapshot = sispy.snapshot()
+    # buzzer + status and current schedule entry for each outlet
+    assert sispy._dev.nr_reads == 9
+
+    assert isinstance(snapshot, SisPySnapshot)
+    assert snapshot.strip_id == 67305985
+    assert snapshot.buzzer_enabled is True
+    assert isinstance(snapshot.time_taken, time.struct_time)
+    assert len(snapshot.outlets) == 4
+    assert [o.nr for o in snapshot.outlets] == [0, 1, 2, 3]
+    assert [o.switched_on for o in snapshot.outlets] == [True, False, False, True]
+    assert [o.voltage_present for o in snapshot.outlets] == [True, False, False, True]
+
+    entries = [o.current_schedule_entry for o in snapshot.outlets]
+    assert all(isinstance(e, OutletCurrentScheduleEntry) for e in entries)
+    _test_outlet_current_schedule(entries[0])
+    _test_outlet_current_schedule(entries[1], switched_it_on=True)
+    _test_outlet_current_schedule(entries[2], sequence_rampup=True, current_schedule_nr=None)
+    _test_outlet_current_schedule(entries[3], sequence_done=True, minutes_to_next_schedule_entry=0, current_schedule_nr=2)
+
+    with pytest.raises(AttributeError):
+        snapshot.buzzer_enabled = False
+    with pytest.raises(AttributeError):
+        snapshot.outlets[0].switched_on = False
+
+
+def test_snapshot_status_bits(sispy):
+    # control bit set, but no voltage on the outlet
+    sispy._dev.get_outlet_status = lambda outlet_nr: 0x01
+    sispy._dev.buzzer = 0x00
+    snapshot = sispy.snapshot()
+    assert snapshot.buzzer_enabled is False
+    assert snapshot.outlets[0].switched_on is True
+    assert snapshot.outlets[0].voltage_present is False
+
+
+# Test the read cache
+
+def test_cache_disabled(sispy):
+    sispy._dev.nr_reads = 0
+    sispy.outlets[0].switched_on
+    sispy.outlets[0].switched_on
+    assert sispy._dev.nr_reads == 2
+
+
+def test_cache(sispy):
+    now = [100.0]
+    sispy._get_monotonic_time = lambda: now[0]
+    sispy.set_cache_ttl(outlet_status=1, outlet_current_schedule_entry=10)
+    sispy._dev.nr_reads = 0
+
+    assert sispy.outlets[0].switched_on is True
+    assert sispy.outlets[0].switched_on is True
+    assert sispy.outlets[0].current_schedule_entry.minutes_to_next_schedule_entry == 2
+    assert sispy.outlets[0].current_schedule_entry.minutes_to_next_schedule_entry == 2
+    assert sispy._dev.nr_reads == 2
+    # other outlets have their own entries
+    assert sispy.outlets[1].switched_on is False
+    assert sispy._dev.nr_reads == 3
+    # the id is not cached
+    sispy.id
+    sispy.id
+    assert sispy._dev.nr_reads == 5
+
+    # status expired, current schedule entry not yet
+    now[0] += 2
+    sispy._dev.outlet_on[0] = False
+    assert sispy.outlets[0].switched_on is False
+    sispy.outlets[0].current_schedule_entry
+    sispy.outlets[1].switched_on
+    assert sispy._dev.nr_reads == 7
+
+    # explicit refresh
+    sispy.outlets[0].refresh()
+    sispy.outlets[0].current_schedule_entry
+    sispy.outlets[1].switched_on
+    assert sispy._dev.nr_reads == 8
+    sispy.refresh()
+    sispy.outlets[1].switched_on
+    assert sispy._dev.nr_reads == 9
+
+    with pytest.raises(ValueError):
+        sispy.set_cache_ttl(outlet_status=-1)
+
+
+def test_cache_invalidation(sispy):
+    sispy._get_monotonic_time = lambda: 100.0
+    sispy.set_cache_ttl(outlet_status=60, outlet_current_schedule_entry=60)
+    sispy._dev.nr_reads = 0
+
+    assert sispy.outlets[1].switched_on is False
+    sispy.outlets[1].current_schedule_entry
+    sispy.outlets[1].switched_on = True
+    sispy._dev.outlet_on[1] = True
+    assert sispy.outlets[1].switched_on is True
+    assert sispy._dev.nr_reads == 3
+
+    schedule = sispy.outlets[0].schedule
+    begin_time = schedule.time_activated
+    schedule._get_current_time = lambda: begin_time
+    sispy.outlets[0].current_schedule_entry
+    sispy._dev.nr_reads = 0
+    sispy.outlets[0].current_schedule_entry
+    assert sispy._dev.nr_reads == 0
+    schedule.apply(force=True)
+    sispy.outlets[0].current_schedule_entry
+    assert sispy._dev.nr_reads == 1
+
+
+def test_cache_snapshot(sispy):
+    sispy._get_monotonic_time = lambda: 100.0
+    sispy.set_cache_ttl(outlet_status=60, outlet_current_schedule_entry=60)
+    sispy.snapshot()
+    sispy._dev.nr_reads = 0
+    assert [o.switched_on for o in sispy.outlets] == [True, False, False, True]
+    assert sispy.outlets[2].current_schedule_entry.sequence_rampup is True
+    assert sispy._dev.nr_reads == 0
+    # a snapshot always reads the power strip
+    sispy.snapshot()
+    assert sispy._dev.nr_reads == 9
+
+
+# Test lazy construction and import time
+
+# import time budget of SisPy.lib, in seconds
+IMPORT_TIME_BUDGET = 0.01
+
+
+def test_lazy(device):
+    class MockSisPy(SisPy):
+        def _get_device(self):
+            self.nr_get_device += 1
+            return device
+    MockSisPy.nr_get_device = 0
+
+    sispy = MockSisPy(lazy=True)
+    assert sispy.nr_get_device == 0
+    assert device.nr_reads == 0
+    assert sispy.nr_outlets == 4
+    assert device.nr_reads == 0
+    assert sispy.outlets[0].switched_on is True
+    assert sispy.nr_get_device == 1
+    assert device.nr_reads == 1
+    assert sispy.snapshot().strip_id == 0x04030201
+    assert sispy.id == 0x04030201
+    assert sispy.nr_get_device == 1
+
+
+def test_lazy_device(device):
+    sispy = SisPy(device, lazy=True)
+    assert device.nr_reads == 0
+    assert sispy.id == 0x04030201
+    assert device.nr_reads == 1
+
+
+def test_timegm():
+    for epoch in (-5000000000, -1, 0, 951782400, 951868800, 1452013835, 4107542400, 10000000000):
+        t = time.gmtime(epoch)
+        assert _timegm(t) == calendar.timegm(t) == epoch
+
+
+def test_import_time(tmpdir):
+    code = ("import sys, time\n"
+            "start = time.perf_counter()\n"
+            "import SisPy.lib\n"
+            "print(time.perf_counter() - start)\n"
+            "print('usb' in sys.modules)\n")
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    # scripts run with compiled bytecode, compile it in a first run
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPYCACHEPREFIX'] = str(tmpdir)
+    subprocess.check_output([sys.executable, '-c', code], env=env)
+    # take the best of a few runs, a busy machine shouldn't fail the test
+    runs = [subprocess.check_output([sys.executable, '-c', code], env=env).decode('utf-8').split() for i in range(3)]
+    assert all(run[1] == 'False' for run in runs)
+    assert min(float(run[0]) for run in runs) < IMPORT_TIME_BUDGET
+
+
 # Test outlet status
 
 def test_outlet_status(sispy):
@@ -595,6 +800,39 @@ def test_outlet_schedule_entry_remove(outlet_schedule_data, sispy):
     assert entry1.end_time == time.strptime('2016-01-05 17:14:35 UTC', '%Y-%m-%d %H:%M:%S %Z')
 
 
+def test_outlet_schedule_cumulative_minutes(outlet_schedule_data, sispy):
+    schedule = OutletSchedule(outlet_schedule_data, sispy)
+
+    def check():
+        total = 0
+        for entry in schedule.entries:
+            assert entry._start_epoch() == schedule._start_epoch() + total * 60
+            total += entry.minutes_to_next_schedule_entry
+        if schedule.periodic is True:
+            assert schedule.periodicity_minutes == total
+        else:
+            assert schedule.schedule_minutes == total
+
+    check()
+    for i in range(4):
+        schedule.add_entry()
+        schedule.entries[-1].minutes_to_next_schedule_entry = 10 * (i + 1)
+        check()
+    schedule.entries[1].minutes_to_next_schedule_entry = 100
+    check()
+    schedule.entries[3].end_time = time.gmtime(schedule.entries[3]._start_epoch() + 7 * 60)
+    check()
+    schedule.entries[4].start_time = time.gmtime(schedule.entries[3]._start_epoch() + 60)
+    assert schedule.entries[3].minutes_to_next_schedule_entry == 1
+    check()
+    schedule.remove_entry()
+    schedule.periodic = False
+    check()
+    schedule.reset()
+    check()
+    assert schedule.periodicity_minutes == 0
+
+
 def test_outlet_schedule_data(outlet_schedule_data, outlet_schedule_data_reset, sispy):
     schedule = OutletSchedule(outlet_schedule_data, sispy)
     begin_time = schedule.time_activated
@@ -621,7 +859,7 @@ def test_outlet_schedule_apply_activated_change(sispy):
 
     schedule._get_current_time = lambda: begin_time
 
-    schedule.apply()
+    assert schedule.apply(force=True) is True
     assert schedule.time_activated == begin_time
     assert schedule.rampup_minutes == rampup_minutes
 
@@ -629,7 +867,7 @@ def test_outlet_schedule_apply_activated_change(sispy):
     schedule._get_current_time = lambda: new_begin_time
     new_rampup_minutes = rampup_minutes + 5 * 60
 
-    schedule.apply()
+    assert schedule.apply(force=True) is True
     assert schedule.time_activated == new_begin_time
     assert schedule.rampup_minutes == new_rampup_minutes
 
@@ -641,9 +879,559 @@ def test_outlet_schedule_apply_data(sispy, outlet_schedule_data):
 
     schedule._get_current_time = lambda: begin_time
 
-    schedule.apply()
+    assert schedule.apply(force=True) is True
     assert sispy._dev.send_meta == bytearray([0x21, 0x09, 0x04, 0x03, 0x00])
     assert sispy._dev.send_data == bytearray([0x04]) + outlet_schedule_data
 
 
+def test_outlet_schedule_apply_unchanged(sispy):
+    schedule = sispy.outlets[0].schedule
+    assert schedule.dirty is False
+    sispy._dev.send_data = None
+
+    # nothing changed, nothing written
+    assert schedule.apply() is False
+    assert sispy._dev.send_data is None
+
+    # setting the same values doesn't make the schedule dirty
+    schedule.periodic = True
+    schedule.entries[0].switch_on = True
+    schedule.entries[0].minutes_to_next_schedule_entry = 3
+    assert schedule.dirty is False
+
+
+def test_outlet_schedule_apply_equivalent(sispy, outlet_schedule_data):
+    schedule = sispy.outlets[0].schedule
+    begin_time = schedule.time_activated
+    start_time = schedule.start_time
+    sispy._dev.send_data = None
+
+    # rebuild the same schedule, activated one hour later
+    schedule.reset()
+    schedule.periodic = True
+    schedule.add_entry()
+    schedule.entries[0].start_time = start_time
+    schedule.entries[0].switch_on = True
+    schedule.entries[0].minutes_to_next_schedule_entry = 3
+    schedule.add_entry()
+    schedule.entries[1].minutes_to_next_schedule_entry = 2
+    assert schedule.dirty is True
+
+    schedule._get_current_time = lambda: time.gmtime(calendar.timegm(begin_time) - 3600)
+    assert schedule.apply() is False
+    assert sispy._dev.send_data is None
+    assert schedule.dirty is False
+    # the values from the power strip are kept
+    assert schedule.time_activated == begin_time
+    assert schedule.rampup_minutes == 1
+
+
+def test_outlet_schedule_apply_changed(sispy, outlet_schedule_data):
+    schedule = sispy.outlets[0].schedule
+    begin_time = schedule.time_activated
+    schedule._get_current_time = lambda: begin_time
+
+    schedule.entries[1].minutes_to_next_schedule_entry = 4
+    assert schedule.dirty is True
+    assert schedule.apply() is True
+    outlet_schedule_data[6] = 0x4
+    assert sispy._dev.send_data == bytearray([0x04]) + outlet_schedule_data
+    assert schedule._data == outlet_schedule_data
+    assert schedule.dirty is False
+
+    # applying again doesn't write
+    sispy._dev.send_data = None
+    assert schedule.apply() is False
+    assert sispy._dev.send_data is None
+
+    # a different start time needs a write
+    schedule.entries[0].start_time = time.gmtime(calendar.timegm(schedule.start_time) + 60)
+    assert schedule.apply() is True
+    assert sispy._dev.send_data is not None
+
+
+# Test memory use
+
+# bytes per outlet with a 16 entry schedule and a current schedule entry
+OUTLET_MEMORY_BUDGET = 800
+
+
+def test_concurrent_writes():
+    # a slow power strip, so the transfers of both threads overlap
+    device = EmulatedDevice(dev_id=1234, epoch=1452013800, latency=0.01)
+    sispy = SisPy(device)
+    for outlet in sispy.outlets:
+        outlet.switched_on = False
+    errors = []
+
+    def switch_on(outlet_nr):
+        try:
+            for i in range(20):
+                sispy.outlets[outlet_nr].switched_on = True
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=switch_on, args=(nr,)) for nr in (0, 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert [outlet.switched_on for outlet in sispy.outlets] == [True, True, False, False]
+
+
+def test_read_without_copy(sispy):
+    data = sispy._usb_read(SisPy._OUTLET_SCHEDULE, 0)
+    # a view on the received report, without its report nr
+    assert isinstance(data, memoryview)
+    assert data.obj[0] == 4
+    # kept as it was received
+    assert isinstance(sispy.outlets[0].refresh_schedule()._data, memoryview)
+
+
+def test_slots(sispy):
+    snapshot = sispy.snapshot()
+    schedule = sispy.outlets[0].schedule
+    for obj in (snapshot, snapshot.outlets[0], sispy.outlets[0], sispy.outlets[0].current_schedule_entry, schedule, schedule.entries[0]):
+        assert not hasattr(obj, '__dict__')
+
+
+def test_schedule_entries_are_views(outlet_schedule_data, sispy):
+    schedule = OutletSchedule(outlet_schedule_data, sispy)
+    entry = schedule.entries[1]
+    entry.minutes_to_next_schedule_entry = 7
+    entry.switch_on = True
+    assert schedule.entries[1].minutes_to_next_schedule_entry == 7
+    assert schedule.entries[1].switch_on is True
+    assert schedule._values[1] == 0x8007
+
+
+def test_memory_per_outlet(sispy):
+    data = codec.encode_schedule(1452013835, [0x8001 + i for i in range(16)], 1)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    outlets = []
+    for i in range(1000):
+        outlet = Outlet(i % 4, sispy)
+        outlet._schedule = OutletSchedule(data, sispy, i % 4)
+        outlets.append((outlet, OutletCurrentScheduleEntry(bytearray([0x01, 0x02, 0x80]))))
+    per_outlet = (tracemalloc.get_traced_memory()[0] - before) / 1000.0
+    tracemalloc.stop()
+    assert len(outlets[-1][0].schedule.entries) == 16
+    assert per_outlet < OUTLET_MEMORY_BUDGET
+
+
+# Test the evaluation of schedules at many times
+
+# start of the schedule in outlet_schedule_data(), after the rampup
+SCHEDULE_START = 1452013835 + 60
+# timestamps evaluated per second, at least
+STATE_AT_THROUGHPUT = 1000000
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def state_at_implementation(request, monkeypatch):
+    from SisPy import lib
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+        monkeypatch.setattr(lib, '_numpy', False)
+    else:
+        monkeypatch.setattr(lib, '_numpy', None)
+    return request.param
+
+
+def _state_at(schedule, times, initial_state=False):
+    states, entry_nrs = schedule.state_at(times, initial_state)
+    return ([bool(state) for state in states], [int(nr) for nr in entry_nrs])
+
+
+def test_outlet_schedule_state_at(outlet_schedule_data, sispy, state_at_implementation):
+    schedule = OutletSchedule(outlet_schedule_data, sispy)
+    times = [SCHEDULE_START - 30, SCHEDULE_START, SCHEDULE_START + 179, SCHEDULE_START + 180,
+             SCHEDULE_START + 299, SCHEDULE_START + 300, SCHEDULE_START + 1000 * 300 + 200]
+    assert _state_at(schedule, times) == ([False, True, True, False, False, True, False], [-1, 0, 0, 1, 1, 0, 1])
+    # the rampup keeps the state the outlet had
+    assert _state_at(schedule, times[:1], initial_state=True) == ([True], [-1])
+
+
+def test_outlet_schedule_state_at_non_periodic(outlet_schedule_data_non_periodic, sispy, state_at_implementation):
+    schedule = OutletSchedule(outlet_schedule_data_non_periodic, sispy)
+    times = [SCHEDULE_START + 60, SCHEDULE_START + 240, SCHEDULE_START + 300, SCHEDULE_START + 86400]
+    # done: the last entry switched it off
+    assert _state_at(schedule, times, initial_state=True) == ([True, False, False, False], [0, 1, 2, 2])
+
+
+def test_outlet_schedule_state_at_vanilla(outlet_schedule_data_vanilla, sispy, state_at_implementation):
+    schedule = OutletSchedule(outlet_schedule_data_vanilla, sispy)
+    assert _state_at(schedule, [0, SCHEDULE_START], initial_state=True) == ([True, True], [-1, -1])
+
+
+def test_outlet_schedule_state_at_delay(sispy, state_at_implementation):
+    # wait 2 minutes without switching, on for 3 minutes, off for 4 minutes, repeat
+    schedule = OutletSchedule(codec.encode_schedule(1452013835, codec.schedule_entries([0x4002, 0x8003, 0x0004], True), 1), sispy)
+    times = [SCHEDULE_START + 60, SCHEDULE_START + 180, SCHEDULE_START + 360, SCHEDULE_START + 540 + 60]
+    # the first cycle starts with the state before the schedule, the next ones with the state at the end of a cycle
+    assert _state_at(schedule, times, initial_state=True) == ([True, True, False, False], [0, 1, 2, 0])
+    assert _state_at(schedule, times) == ([False, True, False, False], [0, 1, 2, 0])
+
+
+def test_outlet_schedule_state_at_numpy(outlet_schedule_data, sispy, state_at_implementation):
+    if state_at_implementation != 'numpy':
+        pytest.skip("numpy only")
+    import numpy
+    schedule = OutletSchedule(outlet_schedule_data, sispy)
+    times = SCHEDULE_START + numpy.arange(0, 600, 60, dtype=numpy.int64).reshape(2, 5)
+    states, entry_nrs = schedule.state_at(times)
+    assert states.shape == entry_nrs.shape == (2, 5)
+    assert states.tolist() == [[True, True, True, False, False]] * 2
+    assert entry_nrs.tolist() == [[0, 0, 0, 1, 1]] * 2
+
+    times = SCHEDULE_START - 3600 + numpy.arange(STATE_AT_THROUGHPUT, dtype=numpy.float64) * 7.5
+    best = None
+    for run in range(3):
+        start = time.perf_counter()
+        states, entry_nrs = schedule.state_at(times)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    assert best < 1.0
+    assert abs(states.mean() - 0.6) < 0.01
+
+
+# Test against an emulated power strip
+
+def _configure(emulated_device, start_epoch):
+    """A configuration management run: build the schedule from scratch and apply it."""
+    schedule = _follow(SisPy(emulated_device).outlets[0].schedule, emulated_device)
+    schedule.reset()
+    schedule.periodic = True
+    schedule.add_entry()
+    schedule.entries[0].start_time = time.gmtime(start_epoch)
+    schedule.entries[0].switch_on = True
+    schedule.entries[0].minutes_to_next_schedule_entry = 3
+    schedule.add_entry()
+    schedule.entries[1].minutes_to_next_schedule_entry = 2
+    return schedule.apply()
+
+
+def test_reapply_running_schedule(emulated_device):
+    assert _configure(emulated_device, EPOCH + 60) is True
+    emulated_device.advance(30)
+    assert _configure(emulated_device, EPOCH + 60) is False
+    # the first entry started already, nothing to write either
+    emulated_device.advance(600)
+    assert _configure(emulated_device, EPOCH + 60) is False
+    # still the schedule activated by the first run
+    assert codec.decode_schedule(emulated_device.outlets[0].schedule_data)[0] == EPOCH
+    # a minute later, 8.5 minutes ago: in the second entry of the second cycle, so it starts again with the third
+    # cycle, in 90 seconds. The rampup is counted in whole minutes, so half a minute early.
+    assert _configure(emulated_device, EPOCH + 120) is True
+    epoch_activated, values, rampup_minutes = codec.decode_schedule(emulated_device.outlets[0].schedule_data)
+    assert (epoch_activated, epoch_activated + rampup_minutes * 60) == (EPOCH + 630, EPOCH + 690)
+    # a non-periodic schedule can't be started again
+    emulated_device.advance(600)
+    schedule = _follow(SisPy(emulated_device).outlets[0].schedule, emulated_device)
+    schedule.periodic = False
+    with pytest.raises(ValueError):
+        schedule.apply()
+
+
+# Test the schedule cache of the outlets
+
+@pytest.mark.parametrize('periodic', [True, False])
+def test_expected_current_entry(emulated_sispy, emulated_device, periodic):
+    schedule = _program(emulated_sispy, 0, periodic=periodic, entries=((True, 3), (False, 1), (True, 2), (False, 4)), rampup_minutes=2)
+    # the emulator is the reference for what the power strip reports
+    for i in range(60):
+        expected = schedule._expected_current_entry(emulated_device.now)
+        data = emulated_device.outlets[0].current_schedule_entry_data()
+        assert bytearray([expected[0], expected[1] & 0xFF, expected[1] >> 8]) == data
+        assert schedule._matches_current_entry(data, emulated_device.now) is True
+        emulated_device.advance(37)
+
+
+def test_schedule_cache_forever(emulated_sispy, emulated_device):
+    schedule = emulated_sispy.outlets[0].schedule
+    transfers = emulated_device.nr_transfers
+    emulated_device.advance(3600)
+    assert emulated_sispy.outlets[0].schedule is schedule
+    assert emulated_device.nr_transfers == transfers
+
+
+def test_schedule_cache_max_age(emulated_sispy, emulated_device):
+    clock = [0.0]
+    emulated_sispy._get_monotonic_time = lambda: clock[0]
+    emulated_sispy.set_schedule_max_age(60)
+    outlet = emulated_sispy.outlets[0]
+    schedule = _follow(_program(emulated_sispy, 0), emulated_device)
+
+    transfers = emulated_device.nr_transfers
+    bytes_moved = emulated_device.nr_bytes
+    # not checked within the max age
+    clock[0] += 30
+    emulated_device.advance(30)
+    assert outlet.schedule is schedule
+    assert emulated_device.nr_transfers == transfers
+
+    clock[0] += 30
+    emulated_device.advance(30)
+    assert outlet.schedule is schedule
+    assert emulated_device.nr_transfers == transfers + 1
+    # the kept schedule was checked with the current schedule entry report only
+    assert emulated_device.nr_bytes == bytes_moved + 4
+
+    clock[0] += 59
+    emulated_device.advance(59)
+    assert outlet.schedule is schedule
+    assert emulated_device.nr_transfers == transfers + 1
+
+
+def test_schedule_cache_reprogrammed(emulated_sispy, emulated_device):
+    clock = [0.0]
+    emulated_sispy._get_monotonic_time = lambda: clock[0]
+    emulated_sispy.set_schedule_max_age(0)
+    outlet = emulated_sispy.outlets[0]
+    schedule = _follow(_program(emulated_sispy, 0), emulated_device)
+    emulated_device.advance(600)
+
+    # another process reprograms the power strip
+    _program(SisPy(emulated_device), 0, entries=((False, 7),))
+    bytes_moved = emulated_device.nr_bytes
+    new_schedule = outlet.schedule
+    assert new_schedule is not schedule
+    assert [(e.switch_on, e.minutes_to_next_schedule_entry) for e in new_schedule.entries] == [(False, 7)]
+    assert emulated_device.nr_bytes == bytes_moved + 4 + 39
+
+
+def test_schedule_cache_timing_error(emulated_sispy, emulated_device):
+    emulated_sispy.set_schedule_max_age(0)
+    schedule = _follow(_program(emulated_sispy, 0), emulated_device)
+    emulated_device.advance(60)
+    emulated_device.power_failure(60)
+    assert emulated_sispy.outlets[0].schedule is not schedule
+
+
+def test_schedule_cache_dirty(emulated_sispy, emulated_device):
+    emulated_sispy.set_schedule_max_age(0)
+    schedule = _follow(_program(emulated_sispy, 0), emulated_device)
+    _program(SisPy(emulated_device), 0, entries=((False, 7),))
+    schedule.entries[0].minutes_to_next_schedule_entry = 10
+    # changes that aren't applied are never thrown away
+    assert emulated_sispy.outlets[0].schedule is schedule
+
+
+def test_refresh_schedule(emulated_sispy, emulated_device):
+    outlet = emulated_sispy.outlets[0]
+    schedule = outlet.schedule
+    _program(SisPy(emulated_device), 0, entries=((False, 7),))
+    assert outlet.schedule is schedule
+    new_schedule = outlet.refresh_schedule()
+    assert new_schedule is not schedule
+    assert outlet.schedule is new_schedule
+    assert len(new_schedule.entries) == 1
+
+
+def test_schedule_max_age_negative(emulated_sispy):
+    with pytest.raises(ValueError):
+        emulated_sispy.set_schedule_max_age(-1)
+
+
+def test_batch_coalescing(emulated_sispy, emulated_device):
+    transfers = emulated_device.nr_transfers
+    with emulated_sispy.batch() as batch:
+        emulated_sispy.outlets[0].switched_on = True
+        emulated_sispy.outlets[1].switched_on = True
+        emulated_sispy.outlets[0].switched_on = False
+        emulated_sispy.outlets[0].switched_on = True
+        # nothing written yet
+        assert emulated_device.nr_transfers == transfers
+        assert emulated_device.outlets[0].switched_on is False
+    assert emulated_device.nr_transfers == transfers + 2
+    assert [o.switched_on for o in emulated_device.outlets] == [True, True, False, False]
+    assert batch.changed == [0, 1]
+    assert batch.unchanged == []
+
+
+def test_batch_cached_state(emulated_sispy, emulated_device):
+    emulated_sispy.set_cache_ttl(outlet_status=60)
+    emulated_device.outlets[2].switched_on = True
+    [outlet.switched_on for outlet in emulated_sispy.outlets]
+    transfers = emulated_device.nr_transfers
+    with emulated_sispy.batch() as batch:
+        for outlet in emulated_sispy.outlets:
+            outlet.switched_on = True
+    # outlet 2 is on already
+    assert batch.changed == [0, 1, 3]
+    assert batch.unchanged == [2]
+    assert emulated_device.nr_transfers == transfers + 3
+
+
+def test_batch_exception(emulated_sispy, emulated_device):
+    transfers = emulated_device.nr_transfers
+    with pytest.raises(RuntimeError):
+        with emulated_sispy.batch():
+            emulated_sispy.outlets[0].switched_on = True
+            raise RuntimeError("stop")
+    assert emulated_device.nr_transfers == transfers
+    assert emulated_device.outlets[0].switched_on is False
+    # not batching anymore
+    emulated_sispy.outlets[0].switched_on = True
+    assert emulated_device.outlets[0].switched_on is True
+
+
+def test_batch_nested(emulated_sispy, emulated_device):
+    with emulated_sispy.batch() as outer:
+        with emulated_sispy.batch() as inner:
+            emulated_sispy.outlets[3].switched_on = True
+        assert emulated_device.outlets[3].switched_on is False
+        emulated_sispy.outlets[1].switched_on = True
+    assert inner.changed == []
+    assert outer.changed == [1, 3]
+    assert emulated_device.outlets[3].switched_on is True
+
+
+def test_set_states(emulated_sispy, emulated_device):
+    emulated_device.outlets[3].switched_on = True
+    assert emulated_sispy.set_states([True, None, True, False]) == [0, 2, 3]
+    assert [o.switched_on for o in emulated_device.outlets] == [True, False, True, False]
+    assert emulated_sispy.set_states([]) == []
+    with pytest.raises(ValueError):
+        emulated_sispy.set_states([True] * 5)
+    with pytest.raises(TypeError):
+        emulated_sispy.set_states([1])
+
+
+def test_set_states_nested(emulated_sispy, emulated_device):
+    emulated_device.outlets[3].switched_on = True
+    with emulated_sispy.batch() as batch:
+        assert emulated_sispy.set_states([None, True, None, True]) == [1, 3]
+        emulated_sispy.outlets[0].switched_on = True
+        assert emulated_device.outlets[1].switched_on is False
+    assert batch.changed == [0, 1, 3]
+    assert [o.switched_on for o in emulated_device.outlets] == [True, True, False, True]
+
+
+@pytest.mark.parametrize('periodic', [True, False])
+def test_state_at(emulated_sispy, emulated_device, periodic):
+    _program(emulated_sispy, 0, periodic=periodic, entries=((True, 3), (False, 1), (True, 2), (False, 4)), rampup_minutes=2)
+    # the "d" flag on the first and the third entry
+    data = bytearray(emulated_device.outlets[0].schedule_data)
+    data[5] |= 0x40
+    data[9] |= 0x40
+    emulated_device.outlets[0].set_schedule(data)
+    schedule = OutletSchedule(data, emulated_sispy)
+    # the emulator is the reference for what the power strip does
+    times = []
+    states = []
+    for i in range(200):
+        times.append(emulated_device.now)
+        states.append(emulated_sispy.outlets[0].switched_on)
+        emulated_device.advance(37)
+    assert [bool(state) for state in schedule.state_at(times)[0]] == states
+
+
+# Test the prediction of the current schedule entries
+
+def _predicting(emulated_sispy, emulated_device, verify_interval=600):
+    clock = [0.0]
+    emulated_sispy._get_monotonic_time = lambda: clock[0]
+    emulated_sispy.set_schedule_prediction(verify_interval)
+    schedule = _follow(_program(emulated_sispy, 0, entries=((True, 3), (False, 1), (True, 2), (False, 4)), rampup_minutes=2), emulated_device)
+
+    def advance(seconds):
+        clock[0] += seconds
+        emulated_device.advance(seconds)
+    return (schedule, advance)
+
+
+def test_schedule_prediction(emulated_sispy, emulated_device):
+    schedule, advance = _predicting(emulated_sispy, emulated_device)
+    outlet = emulated_sispy.outlets[0]
+    transfers = emulated_device.nr_transfers
+    for i in range(50):
+        # the emulator is the reference for what the power strip reports
+        assert outlet.current_schedule_entry._data == emulated_device.outlets[0].current_schedule_entry_data()
+        advance(37)
+    # read after writing the schedule, then when the last verification is 10 minutes old
+    assert emulated_device.nr_transfers == transfers + 3
+    assert outlet.prediction_drift_minutes == 0
+
+
+def test_schedule_prediction_drift(emulated_sispy, emulated_device):
+    schedule, advance = _predicting(emulated_sispy, emulated_device)
+    outlet = emulated_sispy.outlets[0]
+    # the clock of the computer is a minute behind
+    schedule._get_current_time = lambda: time.gmtime(emulated_device.now - 60)
+    for i in range(20):
+        assert outlet.current_schedule_entry._data == emulated_device.outlets[0].current_schedule_entry_data()
+        advance(37)
+    assert outlet.prediction_drift_minutes == 1
+
+    # too much drift: read the power strip every time
+    schedule._get_current_time = lambda: time.gmtime(emulated_device.now - 5 * 60)
+    advance(600)
+    transfers = emulated_device.nr_transfers
+    for i in range(5):
+        assert outlet.current_schedule_entry._data == emulated_device.outlets[0].current_schedule_entry_data()
+        assert outlet.prediction_drift_minutes is None
+        advance(37)
+    assert emulated_device.nr_transfers == transfers + 5
+
+    # until it fits again, e.g. after a snapshot
+    schedule._get_current_time = lambda: time.gmtime(emulated_device.now)
+    emulated_sispy.snapshot()
+    assert outlet.prediction_drift_minutes == 0
+    transfers = emulated_device.nr_transfers
+    outlet.current_schedule_entry
+    assert emulated_device.nr_transfers == transfers
+
+
+def test_schedule_prediction_timing_error(emulated_sispy, emulated_device):
+    schedule, advance = _predicting(emulated_sispy, emulated_device)
+    outlet = emulated_sispy.outlets[0]
+    outlet.current_schedule_entry
+    emulated_device.power_failure(3600)
+    advance(600)
+    assert outlet.current_schedule_entry.timing_error is True
+    transfers = emulated_device.nr_transfers
+    assert outlet.current_schedule_entry.timing_error is True
+    assert emulated_device.nr_transfers == transfers + 1
+
+
+def test_schedule_prediction_invalidation(emulated_sispy, emulated_device):
+    schedule, advance = _predicting(emulated_sispy, emulated_device)
+    outlet = emulated_sispy.outlets[0]
+    outlet.current_schedule_entry
+    transfers = emulated_device.nr_transfers
+    # writing a schedule, changing it without applying it and refreshing all need the power strip
+    _program(emulated_sispy, 0, entries=((False, 7),))
+    outlet.current_schedule_entry
+    assert emulated_device.nr_transfers == transfers + 2
+    outlet.current_schedule_entry
+    assert emulated_device.nr_transfers == transfers + 2
+    outlet.schedule.entries[0].minutes_to_next_schedule_entry = 8
+    outlet.current_schedule_entry
+    outlet.current_schedule_entry
+    assert emulated_device.nr_transfers == transfers + 4
+    outlet.schedule.reset()
+    _follow(outlet.refresh_schedule(), emulated_device)
+    outlet.current_schedule_entry
+    outlet.refresh()
+    outlet.current_schedule_entry
+    outlet.current_schedule_entry
+    assert emulated_device.nr_transfers == transfers + 7
+
+
+def test_schedule_prediction_disabled(emulated_sispy, emulated_device):
+    schedule, advance = _predicting(emulated_sispy, emulated_device)
+    emulated_sispy.set_schedule_prediction(None)
+    transfers = emulated_device.nr_transfers
+    emulated_sispy.outlets[0].current_schedule_entry
+    emulated_sispy.outlets[0].current_schedule_entry
+    assert emulated_device.nr_transfers == transfers + 2
+    with pytest.raises(ValueError):
+        emulated_sispy.set_schedule_prediction(-1)
+    with pytest.raises(ValueError):
+        emulated_sispy.set_schedule_prediction(60, max_drift=-1)
+
+
 # vim: set ai tabstop=4 shiftwidth=4 expandtab :
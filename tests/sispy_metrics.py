@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.metrics.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy.emulator import EmulatedDevice
+from SisPy.lib import SisPy
+from SisPy.metrics import LATENCY_BUCKETS
+from SisPy.metrics import MetricsRegistry
+from SisPy.metrics import READ
+from SisPy.metrics import REGISTRY
+from SisPy.metrics import WRITE
+from SisPy.policy import TransferPolicy
+
+import errno
+import json
+import pytest
+
+
+class TimeoutError(IOError):
+    pass
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry()
+
+
+@pytest.fixture
+def sispy():
+    return SisPy(EmulatedDevice(dev_id=5))
+
+
+####
+# Actual test code
+####
+
+def test_metrics_disabled(sispy):
+    assert sispy._ctrl_transfer == sispy._dev.ctrl_transfer
+    REGISTRY.reset()
+    sispy.outlets[0].switched_on
+    assert REGISTRY.stats() == {}
+
+
+def test_metrics_default_registry(sispy):
+    REGISTRY.reset()
+    sispy.enable_metrics()
+    sispy.outlets[0].switched_on
+    assert REGISTRY.stats()[(5, 3, READ)]['count'] == 1
+    sispy.disable_metrics()
+    sispy.outlets[0].switched_on
+    assert REGISTRY.stats()[(5, 3, READ)]['count'] == 1
+    REGISTRY.reset()
+
+
+def test_metrics_counters(sispy, registry):
+    sispy.enable_metrics(registry)
+    sispy.outlets[1].switched_on
+    sispy.outlets[1].switched_on
+    sispy.outlets[1].switched_on = True
+    sispy.outlets[1].schedule
+    sispy.snapshot()
+
+    stats = registry.stats()
+    assert stats[(5, 6, READ)]['count'] == 3
+    assert stats[(5, 6, READ)]['bytes'] == 6
+    assert stats[(5, 6, WRITE)]['count'] == 1
+    assert stats[(5, 6, WRITE)]['bytes'] == 2
+    assert stats[(5, 7, READ)]['bytes'] == 39
+    assert stats[(5, 2, READ)]['count'] == 1
+    assert stats[(5, 14, READ)]['count'] == 1
+    assert sum(stats[(5, 6, READ)]['latency_buckets']) == 3
+    assert stats[(5, 6, READ)]['errors'] == 0
+
+
+def test_metrics_errors(sispy, registry):
+    sispy.enable_metrics(registry)
+
+    def fail(*args):
+        raise IOError("no such device")
+    sispy._dev.ctrl_transfer = fail
+    sispy._set_device(sispy._dev)
+    with pytest.raises(IOError):
+        sispy.outlets[0].switched_on
+
+    def timeout(*args):
+        raise TimeoutError(errno.ETIMEDOUT, "timed out")
+    sispy._dev.ctrl_transfer = timeout
+    sispy._set_device(sispy._dev)
+    with pytest.raises(IOError):
+        sispy.outlets[0].switched_on
+
+    stats = registry.stats()[(5, 3, READ)]
+    assert stats['count'] == 2
+    assert stats['errors'] == 2
+    assert stats['timeouts'] == 1
+
+
+def test_metrics_listener(sispy, registry):
+    events = []
+
+    def listener(*args):
+        events.append(args)
+    registry.add_listener(listener)
+    sispy.enable_metrics(registry)
+    sispy.outlets[0].switched_on = False
+    assert len(events) == 1
+    assert events[0][:4] == (5, 3, WRITE, 2)
+    assert events[0][5] is None
+    registry.remove_listener(listener)
+    sispy.outlets[0].switched_on = False
+    assert len(events) == 1
+
+
+def test_metrics_listener_error(sispy, registry, caplog):
+    def listener(*args):
+        raise RuntimeError("broken listener")
+    registry.add_listener(listener)
+    sispy.enable_metrics(registry)
+    sispy.set_transfer_policy(TransferPolicy(retries=0, failure_threshold=1))
+    sispy.outlets[0].switched_on = False
+    sispy.outlets[0].switched_on = True
+    stats = registry.stats()[(5, 3, WRITE)]
+    assert stats['count'] == 2
+    assert stats['errors'] == 0
+    assert "broken listener" in caplog.text
+
+
+def test_metrics_json(sispy, registry):
+    sispy.enable_metrics(registry)
+    sispy.outlets[0].switched_on
+    data = json.loads(registry.to_json())
+    assert data['latency_buckets'] == list(LATENCY_BUCKETS)
+    assert data['transfers'][0]['strip_id'] == 5
+    assert data['transfers'][0]['report_nr'] == 3
+    assert data['transfers'][0]['direction'] == READ
+    assert data['transfers'][0]['count'] == 1
+
+
+def test_metrics_prometheus(sispy, registry):
+    sispy.enable_metrics(registry)
+    sispy.outlets[0].switched_on
+    sispy.outlets[0].switched_on
+    text = registry.prometheus_text()
+    assert '# TYPE sispy_usb_transfers_total counter' in text
+    assert 'sispy_usb_transfers_total{strip="5",report="3",direction="read"} 2' in text
+    assert 'sispy_usb_transfer_seconds_bucket{strip="5",report="3",direction="read",le="+Inf"} 2' in text
+    assert 'sispy_usb_transfer_seconds_count{strip="5",report="3",direction="read"} 2' in text
+
+    registry.reset()
+    assert registry.stats() == {}
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
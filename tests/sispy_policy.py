@@ -0,0 +1,211 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.policy.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy.emulator import EmulatedDevice
+from SisPy.lib import SisPy
+from SisPy.metrics import MetricsRegistry
+from SisPy.policy import CLOSED
+from SisPy.policy import CircuitOpenError
+from SisPy.policy import OPEN
+from SisPy.policy import TransferPolicy
+from SisPy.pool import SisPyPool
+
+import pytest
+import time
+
+# 2016-01-05 17:10:00 UTC
+EPOCH = 1452013800
+
+
+#####
+# some mock objects to be able to inject test data
+#####
+
+class FlakyDevice(EmulatedDevice):
+    """Fails the next `failures` transfers, after waiting `delay` seconds. Keeps the timeouts it gets."""
+    def __init__(self, *args, **kwargs):
+        EmulatedDevice.__init__(self, *args, **kwargs)
+        self.failures = 0
+        self.delay = 0
+        self.timeouts = []
+
+    def ctrl_transfer(self, request_type, request, value=0, index=0, data_or_length=None, timeout=None):
+        self.timeouts.append(timeout)
+        if self.failures > 0:
+            self.failures -= 1
+            time.sleep(self.delay)
+            raise IOError("flaky")
+        return EmulatedDevice.ctrl_transfer(self, request_type, request, value, index, data_or_length, timeout)
+
+
+@pytest.fixture
+def device():
+    return FlakyDevice(dev_id=7, epoch=EPOCH)
+
+
+@pytest.fixture
+def policy():
+    policy = TransferPolicy(min_timeout=20, max_timeout=500, probe_interval=0.01)
+    policy._sleeps = []
+    policy._sleep = policy._sleeps.append
+    yield policy
+    policy.close()
+
+
+@pytest.fixture
+def sispy(device, policy):
+    sispy = SisPy(device)
+    sispy.set_transfer_policy(policy)
+    return sispy
+
+
+####
+# Actual test code
+####
+
+def test_policy_invalid():
+    with pytest.raises(ValueError):
+        TransferPolicy(min_timeout=0)
+    with pytest.raises(ValueError):
+        TransferPolicy(min_timeout=600, max_timeout=500)
+    with pytest.raises(ValueError):
+        TransferPolicy(percentile=0)
+    with pytest.raises(ValueError):
+        TransferPolicy(retries=-1)
+
+
+def test_policy_adaptive_timeout(sispy, device, policy):
+    assert policy.timeout == 500
+    for i in range(8):
+        sispy.outlets[0].switched_on
+    # the emulator answers in microseconds
+    assert policy.timeout == 20
+    assert device.timeouts[-1] == 500
+    sispy.outlets[0].switched_on
+    assert device.timeouts[-1] == 20
+
+    # the slowest transfers set the timeout
+    device.latency = 0.01
+    for i in range(4):
+        sispy.outlets[0].switched_on
+    assert 40 <= policy.timeout < 500
+
+
+def test_policy_timeout_backs_off(sispy, device, policy):
+    for i in range(8):
+        sispy.outlets[0].switched_on
+    assert policy.timeout == 20
+    device.failures = 1
+    device.delay = 0.02
+    sispy.outlets[0].switched_on
+    assert device.timeouts[-2:] == [20, 40]
+
+
+def test_policy_read_retries(sispy, device, policy):
+    device.failures = 2
+    assert sispy.outlets[1].switched_on is False
+    assert len(policy._sleeps) == 2
+    # jittered exponential backoff
+    assert 0.005 <= policy._sleeps[0] <= 0.015
+    assert 0.01 <= policy._sleeps[1] <= 0.03
+
+    device.failures = 3
+    with pytest.raises(IOError):
+        sispy.outlets[1].switched_on
+    assert policy.state == CLOSED
+
+
+def test_policy_write_not_retried(sispy, device, policy):
+    device.failures = 1
+    with pytest.raises(IOError):
+        sispy.outlets[2].switched_on = True
+    assert policy._sleeps == []
+    assert device.outlets[2].switched_on is False
+    sispy.outlets[2].switched_on = True
+    assert device.outlets[2].switched_on is True
+
+
+def test_policy_circuit_breaker(sispy, device, policy):
+    device.failures = 1000
+    for i in range(3):
+        with pytest.raises(IOError):
+            sispy.outlets[0].switched_on
+    assert policy.state == OPEN
+    nr_timeouts = len(device.timeouts)
+    with pytest.raises(CircuitOpenError):
+        sispy.outlets[0].switched_on
+    # failing fast, no transfer
+    with pytest.raises(CircuitOpenError):
+        sispy.outlets[0].switched_on = True
+    assert len(device.timeouts) - nr_timeouts < 5
+
+    # the probe closes the circuit once the power strip answers again
+    device.failures = 0
+    deadline = time.time() + 5
+    while policy.state == OPEN and time.time() < deadline:
+        time.sleep(0.001)
+    assert policy.state == CLOSED
+    assert sispy.outlets[0].switched_on is False
+
+
+def test_policy_failures_reset(sispy, device, policy):
+    for i in range(5):
+        device.failures = 3
+        with pytest.raises(IOError):
+            sispy.outlets[0].switched_on
+        sispy.outlets[0].switched_on
+    assert policy.state == CLOSED
+
+
+def test_policy_metrics(sispy, device):
+    registry = MetricsRegistry()
+    sispy.enable_metrics(registry)
+    device.failures = 2
+    sispy.outlets[0].switched_on
+    stats = registry.stats()[(7, 3, 'read')]
+    # every attempt is recorded
+    assert (stats['count'], stats['errors']) == (3, 2)
+
+
+def test_policy_removed(sispy, device, policy):
+    sispy.set_transfer_policy(None)
+    device.failures = 1
+    with pytest.raises(IOError):
+        sispy.outlets[0].switched_on
+    assert device.timeouts[-1] == 500
+
+
+def test_pool_policy():
+    dead = FlakyDevice(dev_id=2, epoch=EPOCH)
+    devices = [EmulatedDevice(dev_id=1, epoch=EPOCH, latency=0.001), dead]
+    with SisPyPool(devices) as pool:
+        pool.set_transfer_policy(retries=0, failure_threshold=1, probe_interval=60)
+        assert pool[1]._policy is not pool[2]._policy
+        dead.failures = 1000
+        dead.delay = 0.1
+        with pytest.raises(IOError):
+            pool.map(lambda sispy: sispy.snapshot())
+        # the dead power strip doesn't slow down the others anymore
+        start = time.perf_counter()
+        futures = [pool.submit(i, lambda sispy: sispy.snapshot()) for i in (1, 2)]
+        assert futures[0].result().strip_id == 1
+        with pytest.raises(CircuitOpenError):
+            futures[1].result()
+        assert time.perf_counter() - start < 0.1
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -0,0 +1,326 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.pool.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy import codec
+from SisPy.emulator import EmulatedDevice
+from SisPy.lib import Outlet
+from SisPy.lib import SisPy
+from SisPy.pool import ScheduleResult
+from SisPy.pool import SisPyPool
+
+import pytest
+import struct
+import threading
+import time
+
+# 2016-01-05 17:10:00 UTC
+EPOCH = 1452013800
+
+
+#####
+# some mock objects to be able to inject test data
+#####
+
+class MockDevice(object):
+    def __init__(self, dev_id, barrier=None):
+        self.dev_id = dev_id
+        self.barrier = barrier
+        self.outlet_on = [False, False, False, False]
+        self.threads = set()
+
+    def ctrl_transfer(self, request_type, request, value=0, index=0, data_or_length=None, timeout=None):
+        self.threads.add(threading.current_thread().name)
+        report_nr = value & 0xFF
+        if request_type & 0x80:
+            if report_nr == 1:
+                return bytearray([report_nr]) + bytearray(struct.pack('<L', self.dev_id))
+            if report_nr in (3, 6, 9, 12):
+                if self.barrier is not None:
+                    # all devices need to be read at the same time to get past this
+                    self.barrier.wait(5)
+                return bytearray([report_nr, 0x03 if self.outlet_on[(report_nr - 3) // 3] else 0x00])
+        else:
+            if report_nr in (3, 6, 9, 12):
+                self.outlet_on[(report_nr - 3) // 3] = (data_or_length[1] == 1)
+            return len(data_or_length)
+
+
+@pytest.fixture
+def devices():
+    return [MockDevice(i) for i in (30, 10, 20)]
+
+
+@pytest.fixture
+def pool(devices):
+    pool = SisPyPool(devices)
+    yield pool
+    pool.close()
+
+
+####
+# Actual test code
+####
+
+def test_pool_ids(pool):
+    assert len(pool) == 3
+    assert pool.ids == [10, 20, 30]
+    assert 20 in pool
+    assert 40 not in pool
+    assert isinstance(pool[10], SisPy)
+    assert pool[10].id == 10
+    assert sorted(pool.strips.keys()) == [10, 20, 30]
+
+
+def test_pool_id_read_once():
+    devices = [EmulatedDevice(dev_id=i, epoch=EPOCH) for i in (1, 2, 3)]
+    with SisPyPool(devices) as pool:
+        assert pool.ids == [1, 2, 3]
+        assert [device.nr_transfers for device in devices] == [1, 1, 1]
+
+
+def test_pool_empty():
+    with SisPyPool([]) as pool:
+        assert len(pool) == 0
+        assert pool.map(lambda sispy: sispy.id) == {}
+
+
+def test_pool_duplicate_ids():
+    with pytest.raises(ValueError):
+        SisPyPool([MockDevice(1), MockDevice(1)])
+
+
+class UnreadableDevice(MockDevice):
+    def ctrl_transfer(self, *args, **kwargs):
+        raise IOError("no permission")
+
+
+class FoundPool(SisPyPool):
+    """A pool that found the devices itself."""
+    def __init__(self, devices, disposed):
+        self._found = devices
+        self._disposed = disposed
+        SisPyPool.__init__(self)
+
+    def _find_devices(self):
+        return self._found
+
+    def _dispose_device(self, dev):
+        self._disposed.append(dev)
+
+
+def test_pool_open_error():
+    disposed = []
+    with pytest.raises(IOError):
+        FoundPool([MockDevice(1), UnreadableDevice(2), MockDevice(3)], disposed)
+    # all the others were opened, and released again
+    assert sorted(dev.dev_id for dev in disposed) == [1, 3]
+
+    disposed = []
+    with pytest.raises(ValueError):
+        FoundPool([MockDevice(1), MockDevice(1)], disposed)
+    assert len(disposed) == 2
+
+
+def test_pool_outlet(pool, devices):
+    outlet = pool[(20, 2)]
+    assert isinstance(outlet, Outlet)
+    assert outlet is pool.outlet(20, 2)
+    outlet.switched_on = True
+    assert devices[2].outlet_on == [False, False, True, False]
+    assert pool[(20, 2)].switched_on is True
+    assert pool[(10, 2)].switched_on is False
+
+
+def test_pool_submit(pool, devices):
+    def switch(outlet, value):
+        outlet.switched_on = value
+        return outlet.switched_on
+
+    assert pool.submit((30, 1), switch, True).result() is True
+    assert devices[0].outlet_on == [False, True, False, False]
+    assert pool.submit(30, lambda sispy: sispy.nr_outlets).result() == 4
+
+
+def test_pool_map(pool):
+    assert pool.map(lambda sispy: sispy.id) == {10: 10, 20: 20, 30: 30}
+    assert pool.map(lambda outlet: outlet.switched_on, [(10, 0), (20, 3)]) == {(10, 0): False, (20, 3): False}
+
+
+def test_pool_map_exception(pool):
+    def fail(sispy):
+        raise RuntimeError("oops")
+
+    with pytest.raises(RuntimeError):
+        pool.map(fail)
+
+
+def test_pool_parallel():
+    barrier = threading.Barrier(3)
+    devices = [MockDevice(i, barrier) for i in (1, 2, 3)]
+    with SisPyPool(devices) as pool:
+        # this would time out on the barrier if the power strips were read one after the other
+        assert pool.map(lambda sispy: sispy.outlets[0].switched_on) == {1: False, 2: False, 3: False}
+        # one worker per device, always the same one
+        pool.map(lambda sispy: sispy.id)
+        threads = [dev.threads for dev in devices]
+    # the construction happens in a separate thread pool
+    assert all(len(t) == 2 for t in threads)
+
+
+class FailingDevice(EmulatedDevice):
+    def ctrl_transfer(self, request_type, request, value=0, index=0, data_or_length=None, timeout=None):
+        if request_type == 0x21 and value & 0xFF == 7:
+            raise IOError("write failed")
+        return EmulatedDevice.ctrl_transfer(self, request_type, request, value, index, data_or_length, timeout)
+
+
+@pytest.fixture
+def emulated_pool():
+    devices = [EmulatedDevice(dev_id=i, epoch=EPOCH, latency=0.005) for i in (1, 2, 3)]
+    pool = SisPyPool(devices)
+    yield pool
+    pool.close()
+
+
+def _template(sispy):
+    schedule = sispy.outlets[0].schedule
+    schedule.reset()
+    schedule.add_entry()
+    schedule.add_entry()
+    schedule.entries[0].switch_on = True
+    schedule.entries[0].minutes_to_next_schedule_entry = 60
+    schedule.entries[1].minutes_to_next_schedule_entry = 30
+    schedule.entries[0].start_time = time.gmtime(EPOCH + 600)
+    return schedule
+
+
+def test_pool_apply_schedules(emulated_pool):
+    pool = emulated_pool
+    template = _template(pool[1])
+    keys = [(strip_id, outlet_nr) for strip_id in pool.ids for outlet_nr in range(4)]
+    start = time.perf_counter()
+    results = pool.apply_schedules(dict((key, template) for key in keys), activation_time=time.gmtime(EPOCH))
+    seconds = time.perf_counter() - start
+
+    assert sorted(results.keys()) == keys
+    for key, result in results.items():
+        assert isinstance(result, ScheduleResult)
+        assert result.key == key
+        assert result.written is True
+        assert result.error is None
+        assert result.seconds > 0
+    # the power strips were written in parallel
+    assert seconds < sum(result.seconds for result in results.values())
+
+    # all outlets got the same schedule, activated at the same time
+    stored = set(bytes(sispy._dev.outlets[i].schedule_data) for sispy in pool.strips.values() for i in range(4))
+    assert len(stored) == 1
+    transfers = sum(sispy._dev.nr_transfers for sispy in pool.strips.values())
+    for key in keys:
+        schedule = pool[key].schedule
+        assert schedule.time_activated == time.gmtime(EPOCH)
+        assert schedule.rampup_minutes == 10
+        assert [(e.switch_on, e.minutes_to_next_schedule_entry) for e in schedule.entries] == [(True, 60), (False, 30)]
+    # the kept schedules were updated without reading them
+    assert sum(sispy._dev.nr_transfers for sispy in pool.strips.values()) == transfers
+    assert pool[(1, 0)].schedule is template
+
+    # nothing changed: skipped without constructing the schedule
+    results = pool.apply_schedules(dict((key, template) for key in keys), activation_time=time.gmtime(EPOCH + 60))
+    assert not any(result.written or result.error for result in results.values())
+    assert sum(sispy._dev.nr_transfers for sispy in pool.strips.values()) == transfers
+    assert template.time_activated == time.gmtime(EPOCH)
+    results = pool.apply_schedules({(2, 1): template}, force=True, activation_time=time.gmtime(EPOCH + 60))
+    assert results[(2, 1)].written is True
+    # the schedule is running already, which is fine when nothing has to be written
+    results = pool.apply_schedules(dict((key, template) for key in keys))
+    assert not any(result.written or result.error for result in results.values())
+    # changed back and forth
+    template.entries[0].minutes_to_next_schedule_entry = 61
+    template.entries[0].minutes_to_next_schedule_entry = 60
+    assert template.dirty is True
+    assert pool.apply_schedules({(1, 0): template})[(1, 0)].written is False
+    assert template.dirty is False
+    # a changed schedule that is running already keeps its phase: it starts again with its next entry
+    template.entries[0].minutes_to_next_schedule_entry = 5
+    # 3 minutes into the second cycle of 35 minutes
+    results = pool.apply_schedules({(1, 0): template}, activation_time=time.gmtime(EPOCH + 600 + 38 * 60))
+    assert results[(1, 0)].written is True
+    assert codec.decode_schedule(pool.strips[1]._dev.outlets[0].schedule_data) == \
+        (EPOCH + 600 + 38 * 60, (0x001E, 0x8005) + (codec.ENTRY_UNUSED,) * 14, 2)
+    assert template.start_time == time.gmtime(EPOCH + 600 + 40 * 60)
+    assert [(e.switch_on, e.minutes_to_next_schedule_entry) for e in template.entries] == [(False, 30), (True, 5)]
+
+
+def test_pool_apply_running_template(emulated_pool):
+    pool = emulated_pool
+    template = _template(pool[1])
+    pool.apply_schedules({(1, 0): template}, activation_time=time.gmtime(EPOCH))
+    # read back as in the README, 160 minutes after the start: 10 minutes into the second entry of the second cycle
+    template = pool[1].outlets[0].refresh_schedule()
+    activation_time = time.gmtime(EPOCH + 600 + 160 * 60)
+    results = pool.apply_schedules(dict(((i, j), template) for i in pool.ids for j in range(4)), activation_time=activation_time)
+    assert results[(1, 0)].written is False
+    assert all(result.written for key, result in results.items() if key != (1, 0))
+    for key in results:
+        if key != (1, 0):
+            schedule = pool[key].schedule
+            assert schedule.time_activated == activation_time
+            # the outlets switch on together at the start of the third cycle
+            assert schedule.start_time == time.gmtime(EPOCH + 600 + 180 * 60)
+            assert [(e.switch_on, e.minutes_to_next_schedule_entry) for e in schedule.entries] == [(True, 60), (False, 30)]
+    # the template stays as it is
+    assert template.start_time == time.gmtime(EPOCH + 600)
+    assert template.dirty is False
+    # nothing to write the next time, although each push anchors the template again
+    transfers = sum(sispy._dev.nr_transfers for sispy in pool.strips.values())
+    results = pool.apply_schedules(dict(((i, j), template) for i in pool.ids for j in range(4)), activation_time=time.gmtime(EPOCH + 600 + 200 * 60))
+    assert not any(result.written or result.error for result in results.values())
+    assert sum(sispy._dev.nr_transfers for sispy in pool.strips.values()) == transfers
+    # a non-periodic schedule can't be started again
+    template.periodic = False
+    with pytest.raises(ValueError):
+        pool.apply_schedules({(2, 0): template}, activation_time=activation_time)
+
+
+def test_pool_apply_schedules_error():
+    devices = [EmulatedDevice(dev_id=1, epoch=EPOCH), FailingDevice(dev_id=2, epoch=EPOCH)]
+    with SisPyPool(devices) as pool:
+        template = _template(pool[1])
+        results = pool.apply_schedules(dict(((i, j), template) for i in (1, 2) for j in range(4)), activation_time=time.gmtime(EPOCH))
+        # report 7 is the schedule of outlet 1
+        assert isinstance(results[(2, 1)].error, IOError)
+        assert results[(2, 1)].written is False
+        assert [results[(i, j)].written for i in (1, 2) for j in range(4)] == [True] * 5 + [False] + [True] * 2
+
+
+def test_pool_apply_schedules_invalid(emulated_pool):
+    pool = emulated_pool
+    template = _template(pool[1])
+    transfers = sum(sispy._dev.nr_transfers for sispy in pool.strips.values())
+    with pytest.raises(KeyError):
+        pool.apply_schedules({(1, 1): template, (4, 0): template}, activation_time=time.gmtime(EPOCH))
+    with pytest.raises(TypeError):
+        pool.apply_schedules({1: template})
+    for i in range(16):
+        template.add_entry()
+    with pytest.raises(ValueError):
+        pool.apply_schedules({(1, 1): template}, activation_time=time.gmtime(EPOCH))
+    assert sum(sispy._dev.nr_transfers for sispy in pool.strips.values()) == transfers
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
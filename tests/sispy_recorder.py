@@ -0,0 +1,172 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.recorder.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy.recorder import RecordedRun
+from SisPy.recorder import StateRecorder
+
+from conftest import EPOCH
+from conftest import _program
+
+import os
+import pytest
+import random
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join('strip.rec'))
+
+
+def _snapshot(sispy):
+    """A snapshot taken at the time of the emulated device."""
+    snapshot = sispy.snapshot()
+    snapshot._epoch_taken = sispy._dev.now
+    return snapshot
+
+
+def _sample(recorder, sispy, minutes):
+    """Record a snapshot every minute."""
+    new_records = 0
+    for i in range(minutes):
+        new_records += recorder.record(_snapshot(sispy))
+        sispy._dev.advance(60)
+    return new_records
+
+
+####
+# Actual test code
+####
+
+def test_recorder_create(path, sispy):
+    with pytest.raises(ValueError):
+        StateRecorder(path)
+    with StateRecorder(path, strip_id=7, capacity=10) as recorder:
+        assert recorder.strip_id == 7
+        assert recorder.capacity == 10
+        assert len(recorder) == 0
+        assert list(recorder.runs()) == []
+    assert os.path.getsize(path) == 24 + 10 * 28
+
+    with pytest.raises(ValueError):
+        StateRecorder(path, strip_id=8)
+    with StateRecorder(path) as recorder:
+        assert recorder.capacity == 10
+
+    other = path + '.other'
+    with open(other, 'wb') as f:
+        f.write(b'\x00' * 100)
+    with pytest.raises(ValueError):
+        StateRecorder(other)
+
+
+def test_recorder_run_length(path, sispy, device):
+    with StateRecorder(path, strip_id=7) as recorder:
+        assert _sample(recorder, sispy, 10) == 1
+        device.outlets[1].switched_on = True
+        assert _sample(recorder, sispy, 5) == 1
+        assert len(recorder) == 2
+        runs = list(recorder.runs())
+        assert [run.nr_samples for run in runs] == [10, 5]
+        assert isinstance(runs[0], RecordedRun)
+        assert (runs[0].time_first, runs[0].time_last) == (EPOCH, EPOCH + 9 * 60)
+        assert [outlet.switched_on for outlet in runs[0].outlets] == [False] * 4
+        assert [outlet.switched_on for outlet in runs[1].outlets] == [False, True, False, False]
+        assert runs[1].outlets[1].voltage_present is True
+
+
+def test_recorder_countdown(path, sispy, device):
+    _program(sispy, 2, periodic=False, entries=((True, 30), (False, 20)), rampup_minutes=10)
+    with StateRecorder(path, strip_id=7) as recorder:
+        _sample(recorder, sispy, 70)
+        runs = list(recorder.runs())
+        # rampup, on, off, done
+        assert [run.nr_samples for run in runs] == [10, 30, 20, 10]
+        entry = runs[1].outlets[2].current_schedule_entry
+        assert (entry.current_schedule_nr, entry.minutes_to_next_schedule_entry) == (1, 30)
+        entry = runs[1].outlets_at(runs[1].time_first + 10 * 60)[2].current_schedule_entry
+        assert entry.minutes_to_next_schedule_entry == 20
+        assert runs[3].outlets[2].current_schedule_entry.sequence_done is True
+
+
+def test_recorder_gap(path, sispy, device):
+    with StateRecorder(path, strip_id=7, max_gap=120) as recorder:
+        _sample(recorder, sispy, 3)
+        device.advance(600)
+        assert recorder.record(_snapshot(sispy)) is True
+        assert len(recorder) == 2
+
+
+def test_recorder_ring(path, sispy, device):
+    with StateRecorder(path, strip_id=7, capacity=3) as recorder:
+        for i in range(5):
+            device.outlets[0].switched_on = (i % 2 == 0)
+            _sample(recorder, sispy, 2)
+        assert len(recorder) == 3
+        assert [run.time_first for run in recorder.runs()] == [EPOCH + i * 120 for i in (2, 3, 4)]
+        assert [run.outlets[0].switched_on for run in recorder.runs()] == [True, False, True]
+
+    # adding to the last record after opening again
+    with StateRecorder(path) as recorder:
+        assert recorder.record(_snapshot(sispy)) is False
+        assert [run.nr_samples for run in recorder.runs()] == [2, 2, 3]
+
+
+def test_recorder_range(path, sispy, device):
+    with StateRecorder(path, strip_id=7) as recorder:
+        for i in range(100):
+            device.outlets[0].switched_on = (i % 2 == 0)
+            _sample(recorder, sispy, 3)
+    with StateRecorder(path, readonly=True) as recorder:
+        runs = list(recorder.runs(EPOCH + 30 * 180 + 200, EPOCH + 40 * 180))
+        assert [run.time_first for run in runs] == [EPOCH + i * 180 for i in range(31, 41)]
+        assert list(recorder.runs(EPOCH + 1000 * 180)) == []
+        assert len(list(recorder.runs(end=EPOCH - 1))) == 0
+        with pytest.raises(Exception):
+            recorder.record(_snapshot(sispy))
+
+
+def test_recorder_size(path, sispy, device):
+    # a week sampled every minute, with a daily schedule
+    _program(sispy, 0, periodic=True, entries=((True, 14 * 60), (False, 10 * 60)), rampup_minutes=0)
+    with StateRecorder(path, strip_id=7) as recorder:
+        _sample(recorder, sispy, 7 * 24 * 60)
+        assert len(recorder) <= 2 * 7 + 2
+        assert sum(run.nr_samples for run in recorder.runs()) == 7 * 24 * 60
+
+
+def test_recorder_jitter(path, sispy, device):
+    # the power strip counts its minutes from the start of the schedule, half a minute off the minutes of the clock
+    # of the computer, which samples every minute a few seconds before or after the minute of the power strip ends
+    device.advance(30)
+    _program(sispy, 0, periodic=True, entries=((True, 600), (False, 600)), rampup_minutes=0)
+    start = device.now
+    jitter = random.Random(0)
+    with StateRecorder(path, strip_id=7) as recorder:
+        for i in range(1, 1200):
+            device.advance(start + i * 60 + jitter.choice((-2, 2)) - device.now)
+            recorder.record(_snapshot(sispy))
+        assert [run.outlets[0].switched_on for run in recorder.runs()] == [True, False]
+        assert sum(run.nr_samples for run in recorder.runs()) == 1199
+
+
+def test_recorder_wrong_strip(path, sispy):
+    with StateRecorder(path, strip_id=8) as recorder:
+        with pytest.raises(ValueError):
+            recorder.record(_snapshot(sispy))
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -0,0 +1,232 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.registry.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy.emulator import EmulatedDevice
+from SisPy.registry import DeviceRegistry
+from SisPy.registry import DisconnectedError
+
+import pytest
+import threading
+import time
+
+# 2016-01-05 17:10:00 UTC
+EPOCH = 1452013800
+
+
+#####
+# some mock objects to be able to inject test data
+#####
+
+class PluggedDevice(EmulatedDevice):
+    """An emulated power strip on a USB port, which stops answering when it's unplugged."""
+    def __init__(self, dev_id, bus, address, port_numbers):
+        EmulatedDevice.__init__(self, dev_id=dev_id, epoch=EPOCH)
+        self.bus = bus
+        self.address = address
+        self.port_numbers = port_numbers
+        self.plugged = True
+
+    def ctrl_transfer(self, *args, **kwargs):
+        if not self.plugged:
+            raise IOError("No such device")
+        return EmulatedDevice.ctrl_transfer(self, *args, **kwargs)
+
+
+class Bus(object):
+    """The USB devices to enumerate."""
+    def __init__(self, *devices):
+        self.devices = list(devices)
+        self.nr_scans = 0
+
+    def find(self):
+        self.nr_scans += 1
+        return list(self.devices)
+
+    def unplug(self, dev):
+        dev.plugged = False
+        self.devices.remove(dev)
+
+    def replug(self, dev):
+        """The same power strip, plugged in again: a new USB device at a new address."""
+        self.unplug(dev)
+        new_dev = PluggedDevice(dev._id, dev.bus, dev.address + 10, dev.port_numbers)
+        new_dev.outlets = dev.outlets
+        self.devices.append(new_dev)
+        return new_dev
+
+
+@pytest.fixture
+def bus():
+    return Bus(PluggedDevice(1, 1, 5, [2]), PluggedDevice(2, 1, 6, [3, 1]))
+
+
+@pytest.fixture
+def registry(bus):
+    registry = DeviceRegistry(bus.find)
+    yield registry
+    registry.stop()
+
+
+####
+# Actual test code
+####
+
+def test_registry_scan(registry, bus):
+    assert registry.scan() == ([1, 2], [])
+    assert registry.ids == [1, 2]
+    assert 1 in registry
+    assert len(registry) == 2
+    assert registry[2].id == 2
+    assert registry.connected(1) is True
+    assert registry.location(2) == (1, (3, 1))
+    assert sorted(registry.strips.keys()) == [1, 2]
+
+    # known USB devices aren't opened again
+    transfers = [dev.nr_transfers for dev in bus.devices]
+    assert registry.scan() == ([], [])
+    assert [dev.nr_transfers for dev in bus.devices] == transfers
+
+
+def test_registry_removal(registry, bus):
+    events = []
+    registry.add_listener(lambda strip_id, connected: events.append((strip_id, connected)))
+    registry.scan()
+    outlet = registry[1].outlets[0]
+    bus.unplug(bus.devices[0])
+    assert registry.scan() == ([], [1])
+    assert registry.connected(1) is False
+    assert events == [(1, True), (2, True), (1, False)]
+    with pytest.raises(IOError):
+        outlet.switched_on = True
+    # the other power strip isn't bothered
+    registry[2].outlets[0].switched_on = True
+
+
+def test_registry_replug(registry, bus):
+    registry.scan()
+    sispy = registry[1]
+    outlet = sispy.outlets[1]
+    new_dev = bus.replug(bus.devices[0])
+    assert registry.scan() == ([1], [])
+    assert registry[1] is sispy
+    outlet.switched_on = True
+    assert new_dev.outlets[1].switched_on is True
+    assert new_dev.nr_transfers == 1 + 1
+
+
+def test_registry_transparent_reconnect(registry, bus):
+    registry.scan()
+    outlet = registry[2].outlets[3]
+    new_dev = bus.replug(bus.devices[1])
+    nr_scans = bus.nr_scans
+    # the failing transfer finds the power strip again
+    outlet.switched_on = True
+    assert bus.nr_scans == nr_scans + 1
+    assert new_dev.outlets[3].switched_on is True
+    assert registry.location(2) == (1, (3, 1))
+
+
+def test_registry_error_without_reconnect(registry, bus):
+    registry.scan()
+
+    def fail(*args, **kwargs):
+        raise IOError("pipe error")
+    bus.devices[0].ctrl_transfer = fail
+    with pytest.raises(IOError) as e:
+        registry[1].outlets[0].switched_on = True
+    assert str(e.value) == "pipe error"
+    assert registry.connected(1) is True
+
+
+def test_registry_missing_fails_fast(bus):
+    clock = [0.0]
+    registry = DeviceRegistry(bus.find, rescan_interval=10)
+    registry._get_monotonic_time = lambda: clock[0]
+    registry.scan()
+    outlet = registry[1].outlets[0]
+    dev = bus.devices[0]
+    bus.unplug(dev)
+    nr_scans = bus.nr_scans
+    # the failing transfer scans once, finding the power strip is gone
+    with pytest.raises(IOError):
+        outlet.switched_on = True
+    assert bus.nr_scans == nr_scans + 1
+    assert registry.connected(1) is False
+    # polling it doesn't enumerate the USB devices again
+    for i in range(10):
+        with pytest.raises(DisconnectedError):
+            outlet.switched_on = True
+    assert bus.nr_scans == nr_scans + 1
+    # until the rescan interval passed
+    bus.devices.append(dev)
+    dev.plugged = True
+    clock[0] += 10
+    outlet.switched_on = True
+    assert bus.nr_scans == nr_scans + 2
+    assert dev.outlets[0].switched_on is True
+
+
+def test_registry_scan_without_lock(registry, bus):
+    registry.scan()
+    enumerating = threading.Event()
+    done = threading.Event()
+
+    def slow_find():
+        enumerating.set()
+        done.wait(5)
+        return list(bus.devices)
+    registry._find_devices = slow_find
+    thread = threading.Thread(target=registry.scan)
+    thread.start()
+    enumerating.wait(5)
+    # the other power strips aren't held up while enumerating
+    registry[2].outlets[0].switched_on = True
+    assert registry.connected(2) is True
+    done.set()
+    thread.join()
+
+
+def test_registry_address_reused(registry, bus):
+    registry.scan()
+    bus.unplug(bus.devices[0])
+    # another power strip at another port gets the address of the one unplugged
+    bus.devices.append(PluggedDevice(3, 1, 5, [4]))
+    assert registry.scan() == ([3], [1])
+    assert registry.location(3) == (1, (4,))
+
+
+def test_registry_unanswering_device(registry, bus):
+    bus.devices[0].plugged = False
+    assert registry.scan() == ([2], [])
+    bus.devices[0].plugged = True
+    assert registry.scan() == ([1], [])
+
+
+def test_registry_thread(registry, bus):
+    registry.start(interval=0.01)
+    deadline = time.time() + 5
+    while len(registry) < 2 and time.time() < deadline:
+        time.sleep(0.001)
+    assert registry.ids == [1, 2]
+    bus.unplug(bus.devices[0])
+    while registry.connected(1) and time.time() < deadline:
+        time.sleep(0.001)
+    assert registry.connected(1) is False
+    registry.stop()
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
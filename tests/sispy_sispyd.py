@@ -0,0 +1,257 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.sispyd.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy.lib import OutletSchedule
+from SisPy.metrics import MetricsRegistry
+from SisPy.policy import TransferPolicy
+from SisPy.lib import SisPy
+from SisPy.pool import SisPyPool
+from SisPy.sispyd import _error_payload
+from SisPy.sispyd import _OP_READ
+from SisPy.sispyd import _OP_READ_REPORTS
+from SisPy.sispyd import _OP_WRITE
+from SisPy.sispyd import BrokerConnection
+from SisPy.sispyd import SisPyBroker
+from SisPy.sispyd import SisPyClient
+
+from sispy_aio import FullMockDevice
+
+import os
+import pytest
+import socket
+import stat
+import struct
+import threading
+import time
+
+
+@pytest.fixture
+def devices():
+    return [FullMockDevice(i) for i in (7, 3)]
+
+
+@pytest.fixture
+def broker(devices, tmp_path):
+    pool = SisPyPool(devices)
+    broker = SisPyBroker(pool, str(tmp_path / 'sispyd.sock'))
+    broker.start()
+    yield broker
+    broker.close()
+    pool.close()
+
+
+####
+# Actual test code
+####
+
+def test_broker_socket(broker):
+    assert os.path.exists(broker.path)
+    assert stat.S_IMODE(os.stat(broker.path).st_mode) == 0o600
+    broker.close()
+    assert not os.path.exists(broker.path)
+
+
+def test_broker_running(broker, devices):
+    pool = SisPyPool([FullMockDevice(5)])
+    # the running broker keeps its socket
+    with pytest.raises(IOError):
+        SisPyBroker(pool, broker.path)
+    connection = BrokerConnection(broker.path)
+    assert connection.strip_ids() == [3, 7]
+    connection.close()
+    pool.close()
+
+
+def test_broker_stale_socket(devices, tmp_path):
+    path = str(tmp_path / 'sispyd.sock')
+    # left behind by a broker that was killed
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.close()
+    pool = SisPyPool(devices)
+    broker = SisPyBroker(pool, path, mode=0o660)
+    broker.start()
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o660
+    connection = BrokerConnection(path)
+    assert connection.strip_ids() == [3, 7]
+    connection.close()
+    broker.close()
+
+    # not a socket: not removed
+    with open(path, 'w') as f:
+        f.write('data')
+    with pytest.raises(IOError):
+        SisPyBroker(pool, path)
+    assert os.path.isfile(path)
+    pool.close()
+
+
+def test_client_strips(broker):
+    connection = BrokerConnection(broker.path)
+    assert connection.strip_ids() == [3, 7]
+    client = SisPyClient(connection=connection)
+    assert isinstance(client, SisPy)
+    assert client.id == 3
+    client = SisPyClient(7, connection=connection)
+    assert client.id == 7
+    assert client.nr_outlets == 4
+    connection.close()
+
+
+def test_client_unknown_strip(broker):
+    with pytest.raises(IOError):
+        SisPyClient(99, broker.path)
+
+
+def test_client_lazy(broker, tmp_path):
+    # nothing happens until it's needed
+    client = SisPyClient(path=str(tmp_path / 'nothing.sock'), lazy=True)
+    client.close()
+    client = SisPyClient(path=broker.path, lazy=True)
+    assert client._dev is None
+    assert client.id == 3
+    assert client.outlets[0].switched_on is False
+    client.close()
+
+
+def test_client_transfer_options(broker, devices):
+    client = SisPyClient(7, broker.path)
+    # the requests to sispyd are recorded, retried and queued like USB transfers
+    registry = MetricsRegistry()
+    client.enable_metrics(registry)
+    client.set_transfer_policy(TransferPolicy(retries=1, backoff=0))
+    worker = client.enable_io_worker()
+    client.outlets[1].switched_on = True
+    assert client.outlets[1].switched_on is True
+    assert devices[0].outlet_on == [False, True, False, False]
+    stats = registry.stats()
+    assert stats[(7, 6, 'write')]['count'] == 1
+    assert stats[(7, 6, 'read')]['count'] == 1
+    assert worker.stats()['interactive']['count'] == 1
+    client.disable_io_worker()
+    client.set_transfer_policy(None)
+    client.disable_metrics()
+    client.close()
+
+
+def test_client_outlets(broker, devices):
+    client = SisPyClient(7, broker.path)
+    outlet = client.outlets[2]
+    assert outlet.switched_on is False
+    outlet.switched_on = True
+    assert devices[0].outlet_on == [False, False, True, False]
+    assert outlet.switched_on is True
+    # the other power strip is untouched
+    assert devices[1].outlet_on == [False, False, False, False]
+
+    entry = outlet.current_schedule_entry
+    assert entry.switched_it_on is True
+    assert entry.minutes_to_next_schedule_entry == 2
+    client.close()
+
+
+def test_client_schedule(broker, devices):
+    client = SisPyClient(3, broker.path)
+    schedule = client.outlets[1].schedule
+    assert isinstance(schedule, OutletSchedule)
+    assert len(schedule.entries) == 0
+
+    schedule._get_current_time = lambda: time.gmtime(1000000)
+    schedule.add_entry()
+    schedule.entries[0].start_time = time.gmtime(1000000 + 60)
+    schedule.entries[0].minutes_to_next_schedule_entry = 5
+    assert schedule.apply() is True
+    assert struct.unpack('<L', devices[1].schedules[1][0:4])[0] == 1000000
+    client.close()
+
+
+def test_client_snapshot(broker, devices):
+    devices[0].outlet_on[3] = True
+    client = SisPyClient(7, broker.path)
+    snapshot = client.snapshot()
+    assert snapshot.strip_id == 7
+    assert snapshot.buzzer_enabled is False
+    assert [o.switched_on for o in snapshot.outlets] == [False, False, False, True]
+    assert all(o.current_schedule_entry.switched_it_on for o in snapshot.outlets)
+    client.close()
+
+
+def test_pipelining(broker):
+    connection = BrokerConnection(broker.path)
+    request_ids = [connection.submit(_OP_READ, strip_id, bytearray([SisPy._OUTLET_STATUS, 0])) for strip_id in (3, 7, 3, 7)]
+    # collect the results in another order than they were sent in
+    results = [connection.result(request_id) for request_id in reversed(request_ids)]
+    assert results == [bytearray([0])] * 4
+    connection.close()
+
+
+def test_broker_invalid_requests(broker, devices):
+    connection = BrokerConnection(broker.path)
+    for opcode, payload in ((_OP_READ, [SisPy._OUTLET_STATUS, 4]),
+                            (_OP_READ, [SisPy._OUTLET_STATUS, 0xFF]),
+                            (_OP_READ, [SisPy._BUZZER, 0]),
+                            (_OP_READ, [7, 0]),
+                            (_OP_READ, [SisPy._OUTLET_STATUS]),
+                            (_OP_WRITE, [SisPy._ID, 0xFF, 0, 0, 0, 0]),
+                            (_OP_WRITE, [SisPy._BUZZER, 0xFF, 0]),
+                            (_OP_WRITE, [SisPy._OUTLET_STATUS, 4, 1]),
+                            (_OP_WRITE, [SisPy._OUTLET_STATUS, 0, 1, 1]),
+                            (_OP_READ_REPORTS, [1, 5]),
+                            (_OP_READ_REPORTS, [15, 2]),
+                            (_OP_READ_REPORTS, [3, 5]),
+                            (_OP_READ_REPORTS, [3])):
+        with pytest.raises(IOError) as e:
+            connection.call(opcode, 7, bytearray(payload))
+        assert str(e.value).startswith("ValueError: ")
+    assert devices[0].outlet_on == [False] * 4
+    # the connection still works
+    assert connection.call(_OP_READ, 7, bytearray([SisPy._OUTLET_STATUS, 3])) == bytearray([0])
+    connection.close()
+
+
+def test_broker_long_error():
+    # 3 bytes per character, 0xFFFF bytes would end in the middle of one
+    payload = _error_payload(ValueError("x" + "\u20ac" * 30000))
+    assert len(payload) == 0xFFFF - 2
+    assert payload.decode('utf-8') == "ValueError: x" + "\u20ac" * ((0xFFFF - 13) // 3)
+    assert _error_payload(KeyError(1)) == b'KeyError: 1'
+
+
+def test_shared_connection(broker, devices):
+    connection = BrokerConnection(broker.path)
+    clients = [SisPyClient(strip_id, connection=connection) for strip_id in (3, 7)]
+    errors = []
+
+    def work(client):
+        try:
+            for i in range(20):
+                client.outlets[i % 4].switched_on = (i % 2 == 0)
+                assert client.outlets[i % 4].switched_on is (i % 2 == 0)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(client,)) for client in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert all(dev.overlap is False for dev in devices)
+    connection.close()
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
@@ -0,0 +1,230 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.watch.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy.aio import AsyncSisPy
+from SisPy.lib import SisPy
+from SisPy.watch import OutletEvent
+from SisPy.watch import SEQUENCE_DONE
+from SisPy.watch import SWITCHED_OFF
+from SisPy.watch import SWITCHED_ON
+from SisPy.watch import TIMING_ERROR
+from SisPy.watch import VOLTAGE_LOST
+from SisPy.watch import VOLTAGE_RESTORED
+from SisPy.watch import Watcher
+
+from conftest import _program
+
+import asyncio
+import pytest
+import queue
+import time
+
+
+def _kinds(events):
+    return [(event.outlet_nr, event.kind) for event in events]
+
+
+####
+# Actual test code
+####
+
+def test_watch_first_poll(sispy):
+    watcher = Watcher(sispy)
+    assert watcher.snapshot is None
+    assert watcher.poll() == []
+    assert watcher.snapshot is not None
+
+
+def test_watch_switch(sispy, device):
+    watcher = Watcher(sispy)
+    watcher.poll()
+    assert watcher.poll() == []
+    device.outlets[1].switched_on = True
+    events = watcher.poll()
+    assert _kinds(events) == [(1, SWITCHED_ON)]
+    assert isinstance(events[0], OutletEvent)
+    assert events[0].strip_id == 7
+    before = time.time()
+    device.outlets[1].switched_on = False
+    events = watcher.poll()
+    assert isinstance(events[0].time_detected, float)
+    assert before <= events[0].time_detected <= time.time()
+    assert time.gmtime(events[0].time_detected) == watcher.snapshot.time_taken
+    device.outlets[1].switched_on = True
+    watcher.poll()
+    assert watcher.poll() == []
+    device.outlets[1].switched_on = False
+    assert _kinds(watcher.poll()) == [(1, SWITCHED_OFF)]
+
+
+def test_watch_voltage(sispy, device):
+    watcher = Watcher(sispy)
+    device.outlets[2].switched_on = True
+    watcher.poll()
+    device.outlets[2].voltage_present = False
+    assert _kinds(watcher.poll()) == [(2, VOLTAGE_LOST)]
+    device.outlets[2].voltage_present = True
+    assert _kinds(watcher.poll()) == [(2, VOLTAGE_RESTORED)]
+    # switching off is not a voltage loss
+    device.outlets[2].switched_on = False
+    assert _kinds(watcher.poll()) == [(2, SWITCHED_OFF)]
+
+
+def test_watch_schedule(sispy, device):
+    _program(sispy, 0, periodic=False, entries=((True, 3), (False, 2)))
+    watcher = Watcher(sispy)
+    watcher.poll()
+    device.advance(60)
+    assert _kinds(watcher.poll()) == [(0, SWITCHED_ON)]
+    device.advance(300)
+    assert _kinds(watcher.poll()) == [(0, SWITCHED_OFF), (0, SEQUENCE_DONE)]
+
+
+def test_watch_timing_error(sispy, device):
+    _program(sispy, 3)
+    watcher = Watcher(sispy)
+    watcher.poll()
+    device.power_failure(60)
+    assert _kinds(watcher.poll()) == [(3, TIMING_ERROR)]
+    device.power_failure(60)
+    assert watcher.poll() == []
+
+
+def test_watch_interval(sispy, device):
+    watcher = Watcher(sispy, min_interval=1, max_interval=600)
+    watcher.poll()
+    # nothing scheduled
+    assert watcher.next_interval == 600
+    _program(sispy, 0, entries=((True, 5), (False, 2)), rampup_minutes=1)
+    watcher.poll()
+    # the rampup ends within a minute
+    assert watcher.next_interval == 1
+    device.advance(60)
+    watcher.poll()
+    # the first entry ends in 4 to 5 minutes
+    assert watcher.next_interval == 240
+    device.advance(240)
+    watcher.poll()
+    assert watcher.next_interval == 1
+    with pytest.raises(ValueError):
+        Watcher(sispy, min_interval=0)
+    with pytest.raises(ValueError):
+        Watcher(sispy, min_interval=2, max_interval=1)
+
+
+def test_watch_adaptive(sispy, device):
+    _program(sispy, 0, entries=((True, 10), (False, 5)), rampup_minutes=1)
+    start = device.now
+    # the switching moments in the first hour
+    transitions = [start + 60 + i * 60 for i in range(0, 60, 15)] + [start + 60 + i * 60 for i in range(10, 60, 15)]
+    watcher = Watcher(sispy, min_interval=1, max_interval=60)
+    watcher.poll()
+    polls = 0
+    detected = []
+    while device.now < start + 3600:
+        device.advance(watcher.next_interval)
+        polls += 1
+        if len(watcher.poll()) > 0:
+            detected.append(device.now)
+    assert len(detected) == len(transitions)
+    # every switch is seen within min_interval
+    assert all(0 <= t - s <= 1 for t, s in zip(detected, sorted(transitions)))
+    # polling every second would take 3600 polls
+    assert polls < 3600 / 5
+
+
+def test_watch_thread(sispy, device):
+    events = queue.Queue()
+    watcher = sispy.watch(events.put, min_interval=0.01, max_interval=0.02)
+    try:
+        # wait for the first poll
+        while watcher.snapshot is None:
+            time.sleep(0.001)
+        device.outlets[3].switched_on = True
+        event = events.get(timeout=5)
+        assert (event.outlet_nr, event.kind) == (3, SWITCHED_ON)
+    finally:
+        watcher.stop()
+    assert watcher.error is None
+
+
+def test_watch_thread_error(sispy):
+    errors = queue.Queue()
+
+    def fail(*args):
+        raise IOError("gone")
+    sispy._ctrl_transfer = fail
+    watcher = sispy.watch(lambda event: None, min_interval=0.01, max_interval=0.01, error_callback=errors.put)
+    assert isinstance(errors.get(timeout=5), IOError)
+    watcher.stop()
+
+    watcher = sispy.watch(lambda event: None, min_interval=0.01, max_interval=0.01)
+    watcher._thread.join(5)
+    assert isinstance(watcher.error, IOError)
+    watcher.stop()
+
+
+def test_watch_thread_callback_error(sispy, device):
+    errors = queue.Queue()
+    events = queue.Queue()
+
+    def callback(event):
+        events.put(event)
+        raise ValueError("broken callback")
+    watcher = sispy.watch(callback, min_interval=0.01, max_interval=0.02, error_callback=errors.put)
+    try:
+        while watcher.snapshot is None:
+            time.sleep(0.001)
+        device.outlets[1].switched_on = True
+        device.outlets[2].switched_on = True
+        kinds = set()
+        while len(kinds) < 2:
+            event = events.get(timeout=5)
+            kinds.add((event.outlet_nr, event.kind))
+        assert kinds == {(1, SWITCHED_ON), (2, SWITCHED_ON)}
+        assert isinstance(errors.get(timeout=5), ValueError)
+        assert watcher._thread.is_alive()
+    finally:
+        watcher.stop()
+
+    watcher = sispy.watch(callback, min_interval=0.01, max_interval=0.02)
+    while watcher.snapshot is None:
+        time.sleep(0.001)
+    device.outlets[1].switched_on = False
+    watcher._thread.join(5)
+    assert isinstance(watcher.error, ValueError)
+    watcher.stop()
+
+
+def test_watch_async(sispy, device):
+    async def run():
+        async_sispy = AsyncSisPy(sispy)
+        events = async_sispy.watch(min_interval=0.01, max_interval=0.02)
+        next_event = asyncio.ensure_future(events.__anext__())
+        # let the first poll (after reading the id) happen
+        while device.nr_transfers < 1 + 9:
+            await asyncio.sleep(0.01)
+        device.outlets[0].switched_on = True
+        event = await asyncio.wait_for(next_event, 5)
+        await events.aclose()
+        await async_sispy.close()
+        return (event.outlet_nr, event.kind)
+
+    assert asyncio.run(run()) == (0, SWITCHED_ON)
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :
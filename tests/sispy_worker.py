@@ -0,0 +1,221 @@
+#! /usr/bin/env python
+
+# Test script for SisPy.worker.
+# Copyright (C) 2016  Eric Seynaeve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from SisPy.emulator import EmulatedDevice
+from SisPy.lib import SisPy
+from SisPy.worker import INTERACTIVE
+from SisPy.worker import IOWorker
+from SisPy.worker import MONITORING
+from SisPy.worker import SCHEDULE
+from SisPy.worker import transfer_priority
+
+import pytest
+import threading
+import time
+
+# 2016-01-05 17:10:00 UTC
+EPOCH = 1452013800
+
+
+#####
+# some mock objects to be able to inject test data
+#####
+
+class RecordingDevice(EmulatedDevice):
+    """Keeps the thread and report of every transfer, notices overlapping transfers and can hold them at a gate."""
+    def __init__(self, *args, **kwargs):
+        EmulatedDevice.__init__(self, *args, **kwargs)
+        self.transfers = []
+        self.overlaps = 0
+        self.busy = False
+        self.gate = None
+
+    def ctrl_transfer(self, request_type, request, value=0, index=0, data_or_length=None, timeout=None):
+        if self.busy:
+            self.overlaps += 1
+        self.busy = True
+        try:
+            if self.gate is not None:
+                self.gate.wait(5)
+            self.transfers.append((threading.current_thread().name, 'read' if request_type & 0x80 else 'write', value & 0xFF))
+            time.sleep(0.0001)
+            return EmulatedDevice.ctrl_transfer(self, request_type, request, value, index, data_or_length, timeout)
+        finally:
+            self.busy = False
+
+
+@pytest.fixture
+def device():
+    return RecordingDevice(dev_id=7, epoch=EPOCH)
+
+
+@pytest.fixture
+def sispy(device):
+    sispy = SisPy(device)
+    yield sispy
+    sispy.disable_io_worker()
+
+
+def _wait_for(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    assert condition()
+
+
+####
+# Actual test code
+####
+
+def test_transfer_priority():
+    assert transfer_priority(0xa1, 0x0303) == MONITORING
+    assert transfer_priority(0xa1, 0x0304) == MONITORING
+    assert transfer_priority(0x21, 0x0303) == INTERACTIVE
+    assert transfer_priority(0x21, 0x0309) == INTERACTIVE
+    assert transfer_priority(0x21, 0x0304) == SCHEDULE
+    assert transfer_priority(0x21, 0x030d) == SCHEDULE
+
+
+def test_worker_thread(sispy, device):
+    worker = sispy.enable_io_worker()
+    assert sispy.enable_io_worker() is worker
+    device.transfers = []
+    sispy.outlets[0].switched_on = True
+    assert sispy.outlets[0].switched_on is True
+    assert set(t[0] for t in device.transfers) == set([worker._thread.name])
+
+    sispy.disable_io_worker()
+    device.transfers = []
+    sispy.outlets[0].switched_on
+    assert device.transfers[0][0] == threading.current_thread().name
+    with pytest.raises(IOError):
+        worker.call(MONITORING, lambda: None)
+
+
+def test_worker_errors(sispy, device):
+    sispy.enable_io_worker()
+    with pytest.raises(IOError):
+        sispy._usb_read(3, 7)
+    # the worker carries on
+    assert sispy.outlets[1].switched_on is False
+
+
+def test_worker_priority(sispy, device):
+    schedule = sispy._usb_read(SisPy._OUTLET_SCHEDULE, 2)
+    worker = sispy.enable_io_worker()
+    device.gate = threading.Event()
+    device.transfers = []
+
+    threads = []
+
+    def start(func):
+        thread = threading.Thread(target=func)
+        thread.start()
+        threads.append(thread)
+
+    # the first read keeps the worker busy until the gate opens
+    start(lambda: sispy.outlets[0].switched_on)
+    _wait_for(lambda: device.busy)
+    for i in range(3):
+        start(lambda: sispy.outlets[1].switched_on)
+    start(lambda: sispy._usb_write(SisPy._OUTLET_SCHEDULE, 2, schedule))
+    start(lambda: setattr(sispy.outlets[3], 'switched_on', True))
+    _wait_for(lambda: worker.queue_depth == 5)
+    device.gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert [t[1:] for t in device.transfers] == [('read', 3), ('write', 12), ('write', 10)] + [('read', 6)] * 3
+    stats = worker.stats()
+    assert stats['queue_depth'] == 0
+    assert stats['max_queue_depth'] == 5
+    assert (stats['interactive']['count'], stats['schedule']['count'], stats['monitoring']['count']) == (1, 1, 4)
+    # the reads waited for the writes
+    assert stats['monitoring']['wait_max'] >= stats['interactive']['wait_max'] > 0
+    assert stats['monitoring']['wait_sum'] >= stats['monitoring']['wait_max']
+
+
+def test_worker_threads(sispy, device):
+    sispy.enable_io_worker()
+    errors = []
+
+    def work(nr):
+        try:
+            for i in range(20):
+                sispy.outlets[nr].switched_on = (i % 2 == 0)
+                sispy.outlets[nr].switched_on
+                sispy.snapshot()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=work, args=(i % 4,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert errors == []
+    assert device.overlaps == 0
+
+
+def test_worker_refresh_race(sispy, device):
+    class VanishingCache(dict):
+        """A write on the worker thread invalidates an entry right after refresh() listed the keys."""
+        def __iter__(self):
+            keys = list(dict.__iter__(self))
+            self.pop(keys[0], None)
+            return iter(keys)
+    sispy.set_cache_ttl(outlet_status=60, outlet_current_schedule_entry=60)
+    sispy.enable_io_worker()
+    sispy.outlets[1].switched_on
+    sispy.outlets[1].current_schedule_entry
+    sispy._cache = VanishingCache(sispy._cache)
+    sispy.refresh(1)
+    assert len(sispy._cache) == 0
+
+
+def test_worker_batches_per_thread(sispy, device):
+    sispy.enable_io_worker()
+    with sispy.batch() as batch:
+        sispy.outlets[0].switched_on = True
+        # another thread isn't batching
+        thread = threading.Thread(target=lambda: setattr(sispy.outlets[1], 'switched_on', True))
+        thread.start()
+        thread.join(5)
+        assert device.outlets[1].switched_on is True
+        assert device.outlets[0].switched_on is False
+    assert batch.changed == [0]
+    assert device.outlets[0].switched_on is True
+
+
+def test_worker_lazy():
+    device = RecordingDevice(dev_id=7, epoch=EPOCH)
+    sispy = SisPy(lazy=True)
+    sispy._get_device = lambda: device
+    worker = sispy.enable_io_worker()
+    assert sispy.id == 7
+    assert device.transfers[0][0] == worker._thread.name
+    sispy.disable_io_worker()
+
+
+def test_worker_close_idle():
+    worker = IOWorker()
+    assert worker.call(INTERACTIVE, lambda x: x + 1, 1) == 2
+    worker.close()
+    worker.close()
+    assert not worker._thread.is_alive()
+
+# vim: set ai tabstop=4 shiftwidth=4 expandtab :